@@ -13,13 +13,34 @@ interface DialogueTranscriptModalProps {
     isOpen: boolean;
     onClose: () => void;
     dialogueId: string | null;
+    // Other dialogues the user is likely to open next; fetched in the same request
+    prefetchDialogueIds?: string[];
     // apiUrl: string; // Optional: Pass if available, otherwise use default
 }
 
 // Define a default API base URL (adjust if your backend runs elsewhere)
 const DEFAULT_API_BASE_URL = 'http://localhost:8000'; 
 
-const DialogueTranscriptModal: React.FC<DialogueTranscriptModalProps> = ({ isOpen, onClose, dialogueId }) => {
+// Finished transcripts never change, so keep every one we have fetched for the session
+const transcriptCache = new Map<string, DialogueTurn[]>();
+const MAX_TRANSCRIPTS_PER_REQUEST = 50;
+
+const fetchTranscripts = async (apiUrl: string, dialogueIds: string[]): Promise<void> => {
+    const response = await fetch(`${apiUrl}/api/v1/dialogues/transcripts?ids=${dialogueIds.map(encodeURIComponent).join(',')}`);
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ detail: response.statusText }));
+        throw new Error(`Failed to fetch transcript: ${response.status} ${errorData.detail || response.statusText}`);
+    }
+    const data = await response.json();
+    for (const entry of data.transcripts || []) {
+        // Empty transcripts may still be written later, so only cache ones with turns
+        if (entry.turns && entry.turns.length > 0) {
+            transcriptCache.set(entry.dialogue_id, entry.turns);
+        }
+    }
+};
+
+const DialogueTranscriptModal: React.FC<DialogueTranscriptModalProps> = ({ isOpen, onClose, dialogueId, prefetchDialogueIds = [] }) => {
     const [transcript, setTranscript] = useState<DialogueTurn[]>([]);
     const [isLoading, setIsLoading] = useState(false);
     const [error, setError] = useState<string | null>(null);
@@ -28,17 +49,20 @@ const DialogueTranscriptModal: React.FC<DialogueTranscriptModalProps> = ({ isOpe
 
     useEffect(() => {
         if (isOpen && dialogueId && apiUrl) {
+            const cachedTurns = transcriptCache.get(dialogueId);
+            if (cachedTurns) {
+                setError(null);
+                setTranscript(cachedTurns);
+                return;
+            }
             const fetchTranscript = async () => {
                 setIsLoading(true);
                 setError(null);
                 try {
-                    const response = await fetch(`${apiUrl}/api/v1/dialogues/${dialogueId}/transcript`);
-                    if (!response.ok) {
-                        const errorData = await response.json().catch(() => ({ detail: response.statusText }));
-                        throw new Error(`Failed to fetch transcript: ${response.status} ${errorData.detail || response.statusText}`);
-                    }
-                    const data = await response.json();
-                    setTranscript(data.turns || []);
+                    const idsToFetch = [dialogueId, ...prefetchDialogueIds.filter(id => id !== dialogueId && !transcriptCache.has(id))]
+                        .slice(0, MAX_TRANSCRIPTS_PER_REQUEST);
+                    await fetchTranscripts(apiUrl, idsToFetch);
+                    setTranscript(transcriptCache.get(dialogueId) || []);
                 } catch (err: any) {
                     setError(err.message || 'An unknown error occurred');
                     setTranscript([]);
@@ -58,6 +58,11 @@ const MemoryStreamTab: React.FC<MemoryStreamTabProps> = ({ memoryStream }) => {
         });
     }, [memoryStream, activeFilter]);
 
+    // Transcripts of the other dialogues in view are fetched together with the one opened
+    const visibleDialogueIds = useMemo(() => filteredMemoryStream
+        .filter(memory => memory.type === 'dialogue_summary' && memory.metadata?.dialogue_id)
+        .map(memory => memory.metadata!.dialogue_id!), [filteredMemoryStream]);
+
     const filterTypes = ['all', 'social', 'environment', 'periodic', 'dialogue_summary', 'reflect', 'plan', 'replan', 'other'];
 
     const handleViewTranscript = (dialogueId: string) => {
@@ -148,6 +153,7 @@ const MemoryStreamTab: React.FC<MemoryStreamTabProps> = ({ memoryStream }) => {
                     isOpen={isTranscriptModalOpen} 
                     onClose={() => setIsTranscriptModalOpen(false)}
                     dialogueId={selectedDialogueId}
+                    prefetchDialogueIds={visibleDialogueIds}
                 />
             )}
         </>
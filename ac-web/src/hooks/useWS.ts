@@ -4,6 +4,7 @@ import { useSimStore } from '../store/simStore';
 import type { SimClock, DisplayNPC, DisplayArea } from '../store/simStore'; // Import types
 import dayjs from 'dayjs';
 import duration from 'dayjs/plugin/duration';
+import { decodeMsgpack } from '../msgpack';
 
 dayjs.extend(duration);
 
@@ -18,14 +19,39 @@ interface BackendState {
     };
 }
 
+interface StateSnapshotMessage {
+    seq: number;
+    tick: number;
+    state: BackendState;
+}
+
+interface StateDeltaMessage {
+    seq: number;
+    tick: number;
+    npcs: Array<Partial<DisplayNPC> & { id: string }>; // Full record for new NPCs, changed fields otherwise
+    removed_npc_ids: string[];
+    sim_clock: BackendState['sim_clock'];
+    environment: BackendState['environment'];
+}
+
 export const useWS = () => {
     const { setNPCs, setAreas, setClock, pushLog, closeNPCDetailModal, refreshNPCDetailModal } = useSimStore((state) => state.actions);
     const socketRef = useRef<WebSocket | null>(null); // Changed type to native WebSocket
+    const lastSeqRef = useRef<number | null>(null); // seq of the last applied state_snapshot/state_delta
 
     const apiUrl = import.meta.env.VITE_API_URL;
     let wsUrl = '';
     if (apiUrl) {
-        wsUrl = apiUrl.replace('http', 'ws') + '/ws';
+        const params = new URLSearchParams();
+        if (import.meta.env.VITE_WS_BATCH === 'true') {
+            // Opt in to one batched frame per tick
+            params.set('batch', '1');
+        }
+        if (import.meta.env.VITE_WS_ENCODING === 'msgpack') {
+            // Opt in to binary MessagePack frames (the ws_config frame stays JSON text)
+            params.set('encoding', 'msgpack');
+        }
+        wsUrl = apiUrl.replace('http', 'ws') + '/ws' + (params.toString() ? `?${params}` : '');
     } else {
         console.error('VITE_API_URL is not defined! Check your .env file in the ac-web directory.');
     }
@@ -35,12 +61,14 @@ export const useWS = () => {
 
         // const socket = io(wsUrl); // Remove socket.io-client usage
         const socket = new WebSocket(wsUrl); // Use native WebSocket
+        socket.binaryType = 'arraybuffer'; // MessagePack frames arrive as ArrayBuffers
         socketRef.current = socket;
 
         socket.onopen = (event) => {
             // Remove verbose console log
+            // The server pushes a full state_snapshot right after connecting
+            lastSeqRef.current = null;
             pushLog('Connected to simulation server.');
-            fetchState("onOpen");
         };
 
         socket.onclose = (event) => {
@@ -53,102 +81,123 @@ export const useWS = () => {
             pushLog(`WebSocket error occurred.`);
         };
 
-        socket.onmessage = (event) => {
-            const rawData = event.data;
-            try {
-                const messageWrapper = typeof rawData === 'string' ? JSON.parse(rawData) : rawData;
-
-                if (messageWrapper.type === 'tick_update' && messageWrapper.data) {
-                    fetchState("onTick");
+        const handleMessage = (messageWrapper: any) => {
+            if (messageWrapper.type === 'state_snapshot' && messageWrapper.data) {
+                const snapshot = messageWrapper.data as StateSnapshotMessage;
+                lastSeqRef.current = snapshot.seq;
+                applyState(snapshot.state);
+            }
+            else if (messageWrapper.type === 'state_delta' && messageWrapper.data) {
+                const delta = messageWrapper.data as StateDeltaMessage;
+                if (lastSeqRef.current === null) {
+                    // Snapshot not received yet; it supersedes this delta
+                    return;
                 }
-                else if (messageWrapper.type === 'sim_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    if (eventData && eventData.description) {
-                        let emoji = "⚠️"; 
-                        
-                        // Handle built-in event types
-                        if (eventData.event_code === 'fire_alarm') emoji = "🔥";
-                        if (eventData.event_code === 'pizza_drop') emoji = "🍕";
-                        if (eventData.event_code === 'wifi_down') emoji = "📉";
-                        
-                        // Handle user-generated events
-                        if (eventData.event_code === 'user_event') {
-                            // If the message already has an emoji at the start, use it
-                            const messageHasEmoji = /^\p{Emoji}/u.test(eventData.description);
-                            emoji = messageHasEmoji ? "" : "🌐"; // Use globe emoji for user events if none present
-                        }
-                        
-                        // Add user indicator if this is a user-generated event
-                        const userPrefix = eventData.user_generated ? "USER EVENT: " : "EVENT: ";
-                        pushLog(`${emoji} DAY ${eventData.day || '-'} ${userPrefix}${eventData.description}`);
-                    }
+                if (delta.seq <= lastSeqRef.current) {
+                    // Already covered by the snapshot (e.g. a resync raced this delta)
+                    return;
                 }
-                else if (messageWrapper.type === 'planning_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    pushLog(`📋 PLAN D${eventData.day || '-'}: ${eventData.npc_name} ${eventData.status}${eventData.num_actions ? ' ('+eventData.num_actions+' actions)' : ''}.`);
-                    
-                    // Refresh NPC detail modal for the NPC whose plan changed
-                    if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
-                        const selectedNPC = useSimStore.getState().selectedNPCDetails;
-                        if (selectedNPC && selectedNPC.npc_name === eventData.npc_name) {
-                            setTimeout(() => {
-                                refreshNPCDetailModal(apiUrl);
-                            }, 500);
-                        }
-                    }
+                if (delta.seq > lastSeqRef.current + 1) {
+                    // Missed a delta: ask the server for a fresh snapshot
+                    lastSeqRef.current = null;
+                    socket.send(JSON.stringify({ type: 'resync' }));
+                    return;
                 }
-                else if (messageWrapper.type === 'reflection_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    pushLog(`🤔 REFLECT D${eventData.day || '-'}: ${eventData.npc_name} ${eventData.status}.`);
+                lastSeqRef.current = delta.seq;
+                applyDelta(delta);
+            }
+            else if (messageWrapper.type === 'sim_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                if (eventData && eventData.description) {
+                    let emoji = "⚠️"; 
                     
-                    // Refresh NPC detail modal for the NPC with new reflections
-                    if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
-                        const selectedNPC = useSimStore.getState().selectedNPCDetails;
-                        if (selectedNPC && selectedNPC.npc_name === eventData.npc_name) {
-                            setTimeout(() => {
-                                refreshNPCDetailModal(apiUrl);
-                            }, 500);
-                        }
+                    // Handle built-in event types
+                    if (eventData.event_code === 'fire_alarm') emoji = "🔥";
+                    if (eventData.event_code === 'pizza_drop') emoji = "🍕";
+                    if (eventData.event_code === 'wifi_down') emoji = "📉";
+                    
+                    // Handle user-generated events
+                    if (eventData.event_code === 'user_event') {
+                        // If the message already has an emoji at the start, use it
+                        const messageHasEmoji = /^\p{Emoji}/u.test(eventData.description);
+                        emoji = messageHasEmoji ? "" : "🌐"; // Use globe emoji for user events if none present
                     }
+                    
+                    // Add user indicator if this is a user-generated event
+                    const userPrefix = eventData.user_generated ? "USER EVENT: " : "EVENT: ";
+                    pushLog(`${emoji} DAY ${eventData.day || '-'} ${userPrefix}${eventData.description}`);
                 }
-                else if (messageWrapper.type === 'action_start' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    let timeStr = "";
-                    if (eventData.sim_time !== undefined) {
-                        const hours = Math.floor(eventData.sim_time / 60).toString().padStart(2, '0');
-                        const minutes = (eventData.sim_time % 60).toString().padStart(2, '0');
-                        timeStr = `${hours}:${minutes}`;
+            }
+            else if (messageWrapper.type === 'planning_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                pushLog(`📋 PLAN D${eventData.day || '-'}: ${eventData.npc_name} ${eventData.status}${eventData.num_actions ? ' ('+eventData.num_actions+' actions)' : ''}.`);
+                
+                // Refresh NPC detail modal for the NPC whose plan changed
+                if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
+                    const selectedNPC = useSimStore.getState().selectedNPCDetails;
+                    if (selectedNPC && selectedNPC.npc_name === eventData.npc_name) {
+                        setTimeout(() => {
+                            refreshNPCDetailModal(apiUrl);
+                        }, 500);
                     }
-                    pushLog(`${eventData.emoji || '🎬'} D${eventData.day || '-'} ${timeStr} ${eventData.npc_name}: ${eventData.action_title}`);
-                    
-                    // Refresh NPC detail modal if open - action updates likely affect completed actions
-                    if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
-                        const selectedNPC = useSimStore.getState().selectedNPCDetails;
-                        if (selectedNPC) {
-                            // Refresh with a slight delay to allow database updates to complete
-                            setTimeout(() => {
-                                refreshNPCDetailModal(apiUrl);
-                            }, 500);
-                        }
+                }
+            }
+            else if (messageWrapper.type === 'reflection_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                pushLog(`🤔 REFLECT D${eventData.day || '-'}: ${eventData.npc_name} ${eventData.status}.`);
+                
+                // Refresh NPC detail modal for the NPC with new reflections
+                if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
+                    const selectedNPC = useSimStore.getState().selectedNPCDetails;
+                    if (selectedNPC && selectedNPC.npc_name === eventData.npc_name) {
+                        setTimeout(() => {
+                            refreshNPCDetailModal(apiUrl);
+                        }, 500);
                     }
                 }
-                // START - New handler for social_event
-                else if (messageWrapper.type === 'social_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    let timeStr = "";
-                    if (eventData.sim_min_of_day !== undefined) {
-                        const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
-                        const minutes = (eventData.sim_min_of_day % 60).toString().padStart(2, '0');
-                        timeStr = `${hours}:${minutes}`;
+            }
+            else if (messageWrapper.type === 'action_start' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                let timeStr = "";
+                if (eventData.sim_time !== undefined) {
+                    const hours = Math.floor(eventData.sim_time / 60).toString().padStart(2, '0');
+                    const minutes = (eventData.sim_time % 60).toString().padStart(2, '0');
+                    timeStr = `${hours}:${minutes}`;
+                }
+                pushLog(`${eventData.emoji || '🎬'} D${eventData.day || '-'} ${timeStr} ${eventData.npc_name}: ${eventData.action_title}`);
+                
+                // Refresh NPC detail modal if open - action updates likely affect completed actions
+                if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
+                    const selectedNPC = useSimStore.getState().selectedNPCDetails;
+                    if (selectedNPC) {
+                        // Refresh with a slight delay to allow database updates to complete
+                        setTimeout(() => {
+                            refreshNPCDetailModal(apiUrl);
+                        }, 500);
                     }
-                    // Example: 👀 D2 05:15 Alice: Saw Bob in the Lounge.
-                    pushLog(`👀 D${eventData.day || '-'} ${timeStr} ${eventData.observer_npc_name}: ${eventData.description}`);
                 }
-                // END - New handler for social_event
+            }
+            // START - New handler for social_event
+            else if (messageWrapper.type === 'social_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                let timeStr = "";
+                if (eventData.sim_min_of_day !== undefined) {
+                    const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
+                    const minutes = (eventData.sim_min_of_day % 60).toString().padStart(2, '0');
+                    timeStr = `${hours}:${minutes}`;
+                }
+                // Example: 👀 D2 05:15 Alice: Saw Bob in the Lounge.
+                pushLog(`👀 D${eventData.day || '-'} ${timeStr} ${eventData.observer_npc_name}: ${eventData.description}`);
+            }
+            // END - New handler for social_event
 
-                // START - New handler for dialogue_event
-                else if (messageWrapper.type === 'dialogue_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
+            // START - New handler for dialogue_event
+            else if (messageWrapper.type === 'dialogue_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                if (eventData.status === 'restarted') {
+                    // The streamed lines so far are discarded; the dialogue is generated again
+                    pushLog(`💬 Dialogue between ${eventData.npc_a_name} and ${eventData.npc_b_name} restarted`);
+                } else {
                     let timeStr = "";
                     if (eventData.sim_min_of_day !== undefined) {
                         const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
@@ -158,95 +207,142 @@ export const useWS = () => {
                     // Example: 💬 D2 05:15 Alice (re Bob): I talked with Bob about watching shows.
                     pushLog(`💬 D${eventData.day || '-'} ${timeStr} ${eventData.npc_name} (re ${eventData.other_participant_name}): ${eventData.summary}`);
                 }
-                // END - New handler for dialogue_event
+            }
+            // END - New handler for dialogue_event
 
-                // START - New handler for replan_event
-                else if (messageWrapper.type === 'replan_event' && messageWrapper.data) {
-                    const eventData = messageWrapper.data;
-                    let timeStr = "";
-                    if (eventData.sim_min_of_day !== undefined) {
-                        const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
-                        const minutes = (eventData.sim_min_of_day % 60).toString().padStart(2, '0');
-                        timeStr = `${hours}:${minutes}`;
-                    }
-                    pushLog(`🔄 REPLAN D${eventData.day || '-'} ${timeStr} ${eventData.npc_name} due to ${eventData.replan_reason}: ${eventData.original_event}`);
+            // Streamed line of a dialogue still being generated
+            else if (messageWrapper.type === 'dialogue_turn' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                let timeStr = "";
+                if (eventData.sim_min_of_day !== undefined) {
+                    const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
+                    const minutes = (eventData.sim_min_of_day % 60).toString().padStart(2, '0');
+                    timeStr = `${hours}:${minutes}`;
+                }
+                // Example: 🗨️ D2 05:15 Alice: Hi Bob, did you catch the game?
+                pushLog(`🗨️ D${eventData.day || '-'} ${timeStr} ${eventData.speaker_name}: ${eventData.line}`);
+            }
 
-                    if (
-                        apiUrl && 
-                        useSimStore.getState().isNPCDetailModalOpen &&
-                        useSimStore.getState().selectedNPCDetails &&
-                        typeof useSimStore.getState().selectedNPCDetails?.npc_id === 'string' && 
-                        useSimStore.getState().selectedNPCDetails?.npc_id === eventData.npc_id
-                    ) {
-                        setTimeout(() => {
-                            refreshNPCDetailModal(apiUrl);
-                        }, 500);
-                    }
+            // START - New handler for replan_event
+            else if (messageWrapper.type === 'replan_event' && messageWrapper.data) {
+                const eventData = messageWrapper.data;
+                let timeStr = "";
+                if (eventData.sim_min_of_day !== undefined) {
+                    const hours = Math.floor(eventData.sim_min_of_day / 60).toString().padStart(2, '0');
+                    const minutes = (eventData.sim_min_of_day % 60).toString().padStart(2, '0');
+                    timeStr = `${hours}:${minutes}`;
                 }
-                // END - New handler for replan_event
+                pushLog(`🔄 REPLAN D${eventData.day || '-'} ${timeStr} ${eventData.npc_name} due to ${eventData.replan_reason}: ${eventData.original_event}`);
 
+                if (
+                    apiUrl && 
+                    useSimStore.getState().isNPCDetailModalOpen &&
+                    useSimStore.getState().selectedNPCDetails &&
+                    typeof useSimStore.getState().selectedNPCDetails?.npc_id === 'string' && 
+                    useSimStore.getState().selectedNPCDetails?.npc_id === eventData.npc_id
+                ) {
+                    setTimeout(() => {
+                        refreshNPCDetailModal(apiUrl);
+                    }, 500);
+                }
+            }
+            // END - New handler for replan_event
+        };
+
+        socket.onmessage = (event) => {
+            const rawData = event.data;
+            try {
+                const messageWrapper: any = typeof rawData === 'string' ? JSON.parse(rawData) : decodeMsgpack(rawData as ArrayBuffer);
+                if (messageWrapper.type === 'batch' && messageWrapper.data) {
+                    // Opt-in framing (?batch=1): every event of one tick arrives in a single frame
+                    (messageWrapper.data.events || []).forEach(handleMessage);
+                } else {
+                    handleMessage(messageWrapper);
+                }
             } catch (e) {
                 console.error('Error handling WebSocket message', e);
                 pushLog('Received malformed data from server.');
             }
         };
 
-        const fetchState = async (context: string) => {
-            if (!apiUrl) { console.error("No API URL available"); return; }
-            try {
-                const response = await fetch(`${apiUrl}/state`);
-                if (!response.ok) throw new Error(`Fetch /state failed: ${response.status}`);
-                const stateData = await response.json() as BackendState;
+        const applyClock = (simClock: BackendState['sim_clock'], environment: BackendState['environment']) => {
+            if (simClock && environment) {
+                const totalSimMinutesInDay = simClock.sim_min;
+                const currentDay = environment.day;
+                const d = dayjs.duration(totalSimMinutesInDay, 'minutes');
+                const hh = d.hours();
+                const mm = d.minutes();
+                setClock({ day: currentDay, hh, mm });
+                pushLog(`Tick: Day ${currentDay} - ${hh.toString().padStart(2,'0')}:${mm.toString().padStart(2,'0')}`);
+            } else {
+                console.warn("Clock data incomplete in state update");
+                pushLog('Clock data incomplete in state update.');
+            }
+        };
 
+        const refreshSelectedNPC = (changedNpcIds?: Set<string>) => {
+            if (!apiUrl || !useSimStore.getState().isNPCDetailModalOpen) return;
+            const selectedNPC = useSimStore.getState().selectedNPCDetails;
+            if (selectedNPC && (!changedNpcIds || changedNpcIds.has(selectedNPC.npc_id))) {
+                // Refresh with a slight delay to allow database updates to complete
+                setTimeout(() => {
+                    refreshNPCDetailModal(apiUrl);
+                }, 500);
+            }
+        };
+
+        const closeModalIfSelectedNPCGone = (npcs: DisplayNPC[]) => {
+            const selectedNPCDetails = useSimStore.getState().selectedNPCDetails;
+            if (selectedNPCDetails && !npcs.some(npc => npc.id === selectedNPCDetails.npc_id)) {
+                // Close the modal only if the selected NPC no longer exists
+                closeNPCDetailModal();
+            }
+        };
+
+        const applyState = (stateData: BackendState) => {
+            try {
                 if (stateData.npcs) {
-                    // Remove NPC logging completely
-                    
-                    // Check if the current selected NPC still exists in the updated NPC list
-                    const selectedNPCDetails = useSimStore.getState().selectedNPCDetails;
-                    if (selectedNPCDetails) {
-                        const selectedNpcId = selectedNPCDetails.npc_id;
-                        // Close the modal only if the selected NPC no longer exists
-                        const npcExists = stateData.npcs.some(npc => npc.id === selectedNpcId);
-                        if (!npcExists) {
-                            closeNPCDetailModal();
-                        }
-                    }
-                    
-                    // Update NPCs in the store
+                    closeModalIfSelectedNPCGone(stateData.npcs);
                     setNPCs(stateData.npcs);
                 }
-                
                 if (stateData.areas) {
-                    // Only log area data once at startup
                     setAreas(stateData.areas);
                 }
+                applyClock(stateData.sim_clock, stateData.environment);
+                refreshSelectedNPC();
+            } catch (error: any) {
+                console.error('Error applying state snapshot');
+                pushLog(`Error processing state snapshot: ${error.message}`);
+            }
+        };
 
-                if (stateData.sim_clock && stateData.environment) {
-                    const totalSimMinutesInDay = stateData.sim_clock.sim_min;
-                    const currentDay = stateData.environment.day;
-                    const d = dayjs.duration(totalSimMinutesInDay, 'minutes');
-                    const hh = d.hours();
-                    const mm = d.minutes();
-                    setClock({ day: currentDay, hh, mm });
-                    pushLog(`Tick: Day ${currentDay} - ${hh.toString().padStart(2,'0')}:${mm.toString().padStart(2,'0')}`);
-                } else {
-                    console.warn("Clock data incomplete in response");
-                    pushLog('Clock data incomplete in /state.');
-                }
+        const applyDelta = (delta: StateDeltaMessage) => {
+            try {
+                const removedIds = new Set(delta.removed_npc_ids || []);
+                const changedById = new Map((delta.npcs || []).map(npc => [npc.id, npc]));
+                const currentNpcs = useSimStore.getState().npcs;
+                const mergedNpcs = currentNpcs
+                    .filter(npc => !removedIds.has(npc.id))
+                    .map(npc => {
+                        const changes = changedById.get(npc.id);
+                        if (!changes) return npc;
+                        changedById.delete(npc.id);
+                        return { ...npc, ...changes } as DisplayNPC;
+                    });
+                // Anything left in changedById is a newly added NPC sent in full
+                changedById.forEach(npc => mergedNpcs.push(npc as DisplayNPC));
 
-                // After fetching state, refresh NPC details if modal is open
-                if (apiUrl && useSimStore.getState().isNPCDetailModalOpen) {
-                    const selectedNPC = useSimStore.getState().selectedNPCDetails;
-                    if (selectedNPC) {
-                        // Refresh with a slight delay to allow database updates to complete
-                        setTimeout(() => {
-                            refreshNPCDetailModal(apiUrl);
-                        }, 500);
-                    }
+                if (removedIds.size > 0) {
+                    closeModalIfSelectedNPCGone(mergedNpcs);
+                }
+                if ((delta.npcs && delta.npcs.length > 0) || removedIds.size > 0) {
+                    setNPCs(mergedNpcs);
                 }
+                applyClock(delta.sim_clock, delta.environment);
+                refreshSelectedNPC(new Set((delta.npcs || []).map(npc => npc.id)));
             } catch (error: any) {
-                console.error('Error fetching state');
-                pushLog(`Error fetching/processing state: ${error.message}`);
+                console.error('Error applying state delta');
+                pushLog(`Error processing state delta: ${error.message}`);
             }
         };
 
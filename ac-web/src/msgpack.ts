@@ -0,0 +1,75 @@
+// Minimal MessagePack decoder for WebSocket frames sent with ?encoding=msgpack.
+// Covers everything the backend's msgpack.packb() emits (nil, bool, ints, floats,
+// str, bin, arrays, maps); ext types are not used and are rejected.
+
+const textDecoder = new TextDecoder();
+
+export const decodeMsgpack = (buffer: ArrayBuffer): unknown => {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    let offset = 0;
+
+    const readStr = (length: number) => {
+        const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return value;
+    };
+    const readBin = (length: number) => {
+        const value = bytes.slice(offset, offset + length);
+        offset += length;
+        return value;
+    };
+    const readArray = (length: number) => {
+        const value: unknown[] = [];
+        for (let i = 0; i < length; i++) value.push(read());
+        return value;
+    };
+    const readMap = (length: number) => {
+        const value: Record<string, unknown> = {};
+        for (let i = 0; i < length; i++) {
+            const key = String(read());
+            value[key] = read();
+        }
+        return value;
+    };
+    const u8 = () => view.getUint8(offset++);
+    const u16 = () => { const v = view.getUint16(offset); offset += 2; return v; };
+    const u32 = () => { const v = view.getUint32(offset); offset += 4; return v; };
+
+    const read = (): unknown => {
+        const type = u8();
+        if (type <= 0x7f) return type; // positive fixint
+        if (type <= 0x8f) return readMap(type & 0x0f);
+        if (type <= 0x9f) return readArray(type & 0x0f);
+        if (type <= 0xbf) return readStr(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100; // negative fixint
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return readBin(u8());
+            case 0xc5: return readBin(u16());
+            case 0xc6: return readBin(u32());
+            case 0xca: { const v = view.getFloat32(offset); offset += 4; return v; }
+            case 0xcb: { const v = view.getFloat64(offset); offset += 8; return v; }
+            case 0xcc: return u8();
+            case 0xcd: return u16();
+            case 0xce: return u32();
+            case 0xcf: { const v = Number(view.getBigUint64(offset)); offset += 8; return v; }
+            case 0xd0: { const v = view.getInt8(offset); offset += 1; return v; }
+            case 0xd1: { const v = view.getInt16(offset); offset += 2; return v; }
+            case 0xd2: { const v = view.getInt32(offset); offset += 4; return v; }
+            case 0xd3: { const v = Number(view.getBigInt64(offset)); offset += 8; return v; }
+            case 0xd9: return readStr(u8());
+            case 0xda: return readStr(u16());
+            case 0xdb: return readStr(u32());
+            case 0xdc: return readArray(u16());
+            case 0xdd: return readArray(u32());
+            case 0xde: return readMap(u16());
+            case 0xdf: return readMap(u32());
+            default: throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+        }
+    };
+
+    return read();
+};
@@ -5,6 +5,7 @@ import datetime
 
 from ..services import supa, execute_supabase_query # Assuming supa client is in services
 from ..config import get_settings, Settings # For Supabase client initialization if needed, though supa should be pre-configured
+from ..websocket_utils import broadcast_cache_invalidation, CACHE_CATALOG, CACHE_PROMPTS
 
 router = APIRouter()
 
@@ -57,6 +58,9 @@ async def update_prompt_by_name(prompt_name: str, prompt_update: PromptUpdateReq
         )
 
         if update_response.data:
+            # Prompt edits (e.g. AVAILABLE_ACTIONS_LIST) go hand in hand with definition edits;
+            # every replica drops its cached copy, not just this one
+            await broadcast_cache_invalidation([CACHE_CATALOG, CACHE_PROMPTS])
             # Fetch the updated prompt to return it, as Supabase update doesn't return the full row by default with python client
             # or it might be simpler to just return the first element of update_response.data if it contains the updated record
             # For now, let's re-fetch to ensure `updated_at` is current from the DB.
@@ -0,0 +1,262 @@
+import asyncio
+import io
+import json
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+from .config import get_settings
+from .llm import batch_client, chat_completion_body
+from .services import supa, execute_supabase_query
+from .websocket_utils import broadcast_ws_message
+
+settings = get_settings()
+
+SIM_DAY_MINUTES = 24 * 60
+PLANNING_SIM_MIN_OF_DAY = 300  # 05:00, when run_daily_planning would have planned the day
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Shares of the real time left until 05:00 that the reflection job, and the whole night
+# including the planning job, may take; the rest is for inline fallbacks and margin
+REFLECTION_DEADLINE_SHARE = 0.5
+PLANNING_DEADLINE_SHARE = 0.9
+
+
+class BatchCognition:
+    """Nightly cognition through the Batch API instead of the tick.
+
+    At midnight start_night() serializes every NPC's reflection request into one JSONL
+    job and returns at once; a background task polls the job and applies the results
+    (NPCs missing from the output are reflected inline). With BATCH_PLANNING_ENABLED it
+    then does the same for the next day's plans, so by 05:00 most NPCs already have one.
+    The 05:00 tick calls claim_planned_npcs() without waiting and plans only the rest
+    inline; planning results arriving after that are discarded.
+
+    Jobs are cancelled at deadlines derived from the sim time left until 05:00 at the
+    current tick rate (and at most job_timeout_sec), so the inline fallbacks still run
+    before the plans are needed and one night's pipeline ends before the next starts.
+
+    The pipeline skips NPCs that already reflected or planned for the night, so a new
+    leader can restart it with resume_night() for whatever the old one left unfinished.
+    """
+
+    def __init__(self, poll_interval_sec: float, job_timeout_sec: float):
+        self.poll_interval_sec = poll_interval_sec
+        self.job_timeout_sec = job_timeout_sec
+        self._night_tasks: Dict[int, asyncio.Task] = {}  # next sim day -> pipeline task
+        self._planned: Dict[int, Set[str]] = {}
+        self._planning_open: Set[int] = set()
+        self.metrics: Dict[str, int] = {
+            "jobs_submitted": 0,
+            "jobs_failed": 0,
+            "requests_submitted": 0,
+            "results_applied": 0,
+            "inline_fallbacks": 0,
+            "late_plans_discarded": 0,
+        }
+
+    def start_night(self, day_being_reflected: int, reflection_context_time: int, next_day: int, current_sim_minutes_total: int) -> None:
+        """Starts the night's batch pipeline in the background."""
+        if next_day in self._night_tasks:
+            return
+        self._planning_open.add(next_day)
+        self._planned[next_day] = set()
+        planning_sim_min = (next_day - 1) * SIM_DAY_MINUTES + PLANNING_SIM_MIN_OF_DAY
+        real_sec_left = max(planning_sim_min - current_sim_minutes_total, 0) / settings.TICK_SIM_MIN * settings.TICK_REAL_SEC
+        now = time.monotonic()
+        deadlines = (now + real_sec_left * REFLECTION_DEADLINE_SHARE, now + real_sec_left * PLANNING_DEADLINE_SHARE)
+        task = asyncio.create_task(self._run_night(day_being_reflected, reflection_context_time, next_day, deadlines))
+        self._night_tasks[next_day] = task
+        task.add_done_callback(lambda _: self._night_tasks.pop(next_day, None))
+
+    def resume_night(self, current_sim_minutes_total: int) -> None:
+        """Restarts tonight's pipeline if it is before 05:00, e.g. after taking over from a leader that ran it."""
+        day = current_sim_minutes_total // SIM_DAY_MINUTES + 1
+        day_start = (day - 1) * SIM_DAY_MINUTES
+        if day <= 1 or current_sim_minutes_total - day_start >= PLANNING_SIM_MIN_OF_DAY:
+            return
+        print(f"BATCH: Resuming the nightly batch pipeline for Day {day}.")
+        self.start_night(day - 1, day_start - 1, day, current_sim_minutes_total)
+
+    def reset(self) -> None:
+        """Cancels running night pipelines and forgets their plans, e.g. when the simulation clock is reset."""
+        for task in list(self._night_tasks.values()):
+            task.cancel()
+        self._night_tasks.clear()
+        self._planned.clear()
+        self._planning_open.clear()
+
+    def claim_planned_npcs(self, day: int) -> Set[str]:
+        """Closes batch planning for `day` and returns the NPCs it already planned, without waiting."""
+        task = self._night_tasks.get(day)
+        if task is not None and not task.done():
+            print(f"BATCH: Planning batch for Day {day} not finished; planning the remaining NPCs inline.")
+        self._planning_open.discard(day)
+        return self._planned.pop(day, set())
+
+    async def _run_night(self, day_being_reflected: int, reflection_context_time: int, next_day: int, deadlines: Tuple[float, float]) -> None:
+        from .planning_and_reflection import run_nightly_reflection, get_planned_npc_ids
+        try:
+            npcs_res = await execute_supabase_query(lambda: supa.table('npc').select('id, name, traits, backstory').execute())
+            npcs = (npcs_res.data if npcs_res else None) or []
+            if not npcs:
+                return
+            reflection_deadline, planning_deadline = deadlines
+            # A resumed night only redoes what the previous leader did not finish
+            already_reflected = await self._reflected_npc_ids(reflection_context_time)
+            to_reflect = [npc for npc in npcs if npc['id'] not in already_reflected]
+            reflected = await self._reflect(to_reflect, day_being_reflected, reflection_context_time, reflection_deadline)
+            missing = {npc['id'] for npc in to_reflect} - reflected
+            if missing:
+                self.metrics["inline_fallbacks"] += len(missing)
+                await run_nightly_reflection(day_being_reflected, reflection_context_time, npc_ids=missing)
+            if settings.BATCH_PLANNING_ENABLED and next_day in self._planning_open:
+                already_planned = await get_planned_npc_ids(next_day)
+                self._planned[next_day] |= already_planned
+                await self._plan([npc for npc in npcs if npc['id'] not in already_planned], next_day, planning_deadline)
+        except Exception as e:
+            print(f"BATCH: Error in nightly batch pipeline for Day {day_being_reflected}: {e}")
+
+    @staticmethod
+    async def _reflected_npc_ids(reflection_context_time: int) -> Set[str]:
+        res = await execute_supabase_query(
+            lambda: supa.table('memory').select('npc_id').eq('kind', 'reflect').eq('sim_min', reflection_context_time).execute()
+        )
+        return {row['npc_id'] for row in ((res.data if res else None) or [])}
+
+    async def _reflect(self, npcs: List[Dict[str, Any]], day_being_reflected: int, reflection_context_time: int, deadline: float) -> Set[str]:
+        """Runs the reflection job; returns the ids of NPCs whose reflection was applied."""
+        from .planning_and_reflection import (
+            _build_reflection_prompts, _apply_reflection, REFLECTION_MODEL, REFLECTION_MAX_TOKENS
+        )
+        requests = {}
+        for npc in npcs:
+            await broadcast_ws_message("reflection_event", {"npc_id": npc['id'], "npc_name": npc['name'], "status": "started_reflection", "day": day_being_reflected})
+            system_prompt, user_prompt = await _build_reflection_prompts(npc, day_being_reflected, reflection_context_time)
+            requests[f"reflect:{day_being_reflected}:{npc['id']}"] = chat_completion_body(
+                system_prompt, user_prompt, max_tokens=REFLECTION_MAX_TOKENS, model=REFLECTION_MODEL
+            )
+        results = await self._submit_and_wait(requests, f"reflection Day {day_being_reflected}", deadline)
+
+        reflected = set()
+        for npc in npcs:
+            raw_reflection_text = results.get(f"reflect:{day_being_reflected}:{npc['id']}")
+            if raw_reflection_text is None:
+                continue
+            await _apply_reflection(npc, day_being_reflected, reflection_context_time, raw_reflection_text)
+            self.metrics["results_applied"] += 1
+            reflected.add(npc['id'])
+        return reflected
+
+    async def _plan(self, npcs: List[Dict[str, Any]], day: int, deadline: float) -> None:
+        """Runs the next-day planning job and commits every valid plan while planning is open."""
+        from .catalog import catalog
+        from .planning_and_reflection import (
+            _retrieve_planning_memories, _build_plan_prompts, _parse_daily_plan, _commit_daily_plan, PLAN_MAX_TOKENS
+        )
+        await catalog.ensure_loaded()
+        sim_date_str = f"Day {day}"
+        planning_time = (day - 1) * SIM_DAY_MINUTES + PLANNING_SIM_MIN_OF_DAY
+        requests = {}
+        for npc in npcs:
+            retrieved_memories_str = await _retrieve_planning_memories(npc, sim_date_str, planning_time)
+            system_prompt, user_prompt = _build_plan_prompts(npc, sim_date_str, retrieved_memories_str)
+            requests[f"plan:{day}:{npc['id']}"] = chat_completion_body(system_prompt, user_prompt, max_tokens=PLAN_MAX_TOKENS)
+        results = await self._submit_and_wait(requests, f"planning Day {day}", deadline)
+
+        for npc in npcs:
+            raw_plan_text = results.get(f"plan:{day}:{npc['id']}")
+            if not raw_plan_text:
+                continue
+            action_rows, parsed_actions_for_log = _parse_daily_plan(npc['id'], raw_plan_text)
+            if not action_rows:
+                continue
+            if day not in self._planning_open:
+                self.metrics["late_plans_discarded"] += 1
+                continue
+            # Claimed before the commit awaits, so the 05:00 inline pass skips this NPC
+            self._planned[day].add(npc['id'])
+            if await _commit_daily_plan(npc, day, planning_time, action_rows, parsed_actions_for_log):
+                self.metrics["results_applied"] += 1
+
+    async def _submit_and_wait(self, requests: Dict[str, Dict[str, Any]], label: str, deadline: float) -> Dict[str, str]:
+        """Submits one chat-completion batch job and returns custom_id -> completion text.
+
+        The job is cancelled at `deadline` (time.monotonic()) or after job_timeout_sec,
+        whichever comes first. Failed, expired or timed-out jobs return what they have (possibly nothing);
+        callers treat missing ids as "do it inline".
+        """
+        if not requests:
+            return {}
+        jsonl = "\n".join(
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+            for custom_id, body in requests.items()
+        )
+        try:
+            input_file = await asyncio.to_thread(
+                batch_client.files.create, file=("cognition.jsonl", io.BytesIO(jsonl.encode("utf-8"))), purpose="batch"
+            )
+            batch = await asyncio.to_thread(
+                batch_client.batches.create, input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+            )
+        except Exception as e:
+            print(f"BATCH: Could not submit {label} job: {e}")
+            self.metrics["jobs_failed"] += 1
+            return {}
+        self.metrics["jobs_submitted"] += 1
+        self.metrics["requests_submitted"] += len(requests)
+        print(f"BATCH: Submitted {label} job {batch.id} with {len(requests)} requests.")
+
+        deadline = min(deadline, time.monotonic() + self.job_timeout_sec)
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            if time.monotonic() > deadline:
+                print(f"BATCH: {label} job {batch.id} timed out; cancelling.")
+                try:
+                    await asyncio.to_thread(batch_client.batches.cancel, batch.id)
+                except Exception as e:
+                    print(f"BATCH: Could not cancel job {batch.id}: {e}")
+                break
+            await asyncio.sleep(self.poll_interval_sec)
+            try:
+                batch = await asyncio.to_thread(batch_client.batches.retrieve, batch.id)
+            except Exception as e:
+                print(f"BATCH: Error polling job {batch.id}: {e}")
+
+        if batch.status != "completed":
+            self.metrics["jobs_failed"] += 1
+        if not getattr(batch, "output_file_id", None):
+            print(f"BATCH: {label} job {batch.id} ended as '{batch.status}' without output.")
+            return {}
+        try:
+            output = await asyncio.to_thread(batch_client.files.content, batch.output_file_id)
+        except Exception as e:
+            print(f"BATCH: Could not download output of job {batch.id}: {e}")
+            return {}
+        results = self._parse_output(output.text)
+        print(f"BATCH: {label} job {batch.id} '{batch.status}': {len(results)}/{len(requests)} results.")
+        return results
+
+    @staticmethod
+    def _parse_output(output_text: str) -> Dict[str, str]:
+        results = {}
+        for line in output_text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                content = response["body"]["choices"][0]["message"]["content"]
+            except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                continue
+            if content:
+                results[entry["custom_id"]] = content.strip()
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running_nights": sorted(self._night_tasks), **self.metrics}
+
+
+batch_cognition = BatchCognition(
+    poll_interval_sec=settings.BATCH_POLL_INTERVAL_SEC,
+    job_timeout_sec=settings.BATCH_JOB_TIMEOUT_SEC,
+)
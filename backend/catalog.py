@@ -0,0 +1,152 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from .services import supa, execute_supabase_query
+
+# Action titles that are performed at a specific object. Used to place an action
+# instance (and therefore the NPC) in the area that holds the object.
+ACTION_TITLE_TO_OBJECT_NAME: Dict[str, str] = {
+    "Work": "PC",
+    "Sleep": "Bed",
+    "Brush Teeth": "Toothbrush",
+    "Watch TV": "TV",
+    "Relax on Couch": "Couch",
+    "Have Coffee": "Coffee Table",
+}
+
+DEFAULT_ACTION_DURATION_MIN = 30
+
+
+class Catalog:
+    """In-memory copy of the static reference tables (action_def, area, object).
+
+    These tables only change when the world is reseeded or definitions are edited,
+    so they are loaded once and served from indexes until invalidate() is called.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._loaded = False
+        self.action_defs: List[Dict] = []
+        self.areas: List[Dict] = []
+        self.objects: List[Dict] = []
+        self._action_defs_by_id: Dict[str, Dict] = {}
+        self._action_defs_by_title: Dict[str, Dict] = {}
+        self._areas_by_id: Dict[str, Dict] = {}
+        self._areas_by_name: Dict[str, Dict] = {}
+        self._objects_by_id: Dict[str, Dict] = {}
+        self._objects_by_name: Dict[str, Dict] = {}
+        self._object_by_action_title: Dict[str, Dict] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def load(self) -> None:
+        """(Re)loads all reference tables and rebuilds the indexes."""
+        async with self._lock:
+            await self._load_unlocked()
+
+    async def ensure_loaded(self) -> "Catalog":
+        """Loads the catalog if it has not been loaded since the last invalidation."""
+        if self._loaded:
+            return self
+        async with self._lock:
+            if not self._loaded:
+                await self._load_unlocked()
+        return self
+
+    def invalidate(self) -> None:
+        """Marks the catalog stale; the next ensure_loaded() refetches everything."""
+        self._loaded = False
+
+    async def _load_unlocked(self) -> None:
+        try:
+            action_defs_res = await execute_supabase_query(lambda: supa.table("action_def").select("*").execute())
+            areas_res = await execute_supabase_query(lambda: supa.table("area").select("*").execute())
+            objects_res = await execute_supabase_query(lambda: supa.table("object").select("*").execute())
+        except Exception as e:
+            print(f"Error loading reference catalog: {e}")
+            return
+
+        self.action_defs = (action_defs_res.data if action_defs_res else None) or []
+        self.areas = (areas_res.data if areas_res else None) or []
+        self.objects = (objects_res.data if objects_res else None) or []
+
+        self._action_defs_by_id = {ad["id"]: ad for ad in self.action_defs if ad.get("id")}
+        self._action_defs_by_title = {}
+        for ad in self.action_defs:
+            if ad.get("title"):
+                self._action_defs_by_title.setdefault(ad["title"], ad)
+
+        self._areas_by_id = {area["id"]: area for area in self.areas if area.get("id")}
+        self._areas_by_name = {}
+        for area in self.areas:
+            if area.get("name"):
+                self._areas_by_name.setdefault(area["name"], area)
+
+        self._objects_by_id = {obj["id"]: obj for obj in self.objects if obj.get("id")}
+        self._objects_by_name = {}
+        for obj in self.objects:
+            if obj.get("name"):
+                self._objects_by_name.setdefault(obj["name"], obj)
+
+        self._object_by_action_title = {}
+        for title, object_name in ACTION_TITLE_TO_OBJECT_NAME.items():
+            obj = self._objects_by_name.get(object_name)
+            if obj:
+                self._object_by_action_title[title] = obj
+
+        self._loaded = True
+        print(
+            f"CATALOG: Loaded {len(self.action_defs)} action defs, {len(self.areas)} areas, {len(self.objects)} objects."
+        )
+
+    # --- action_def lookups ---
+    def action_def(self, action_def_id: Optional[str]) -> Optional[Dict]:
+        return self._action_defs_by_id.get(action_def_id) if action_def_id else None
+
+    def action_def_by_title(self, title: Optional[str]) -> Optional[Dict]:
+        return self._action_defs_by_title.get(title) if title else None
+
+    def action_titles(self) -> List[str]:
+        return list(self._action_defs_by_title.keys())
+
+    def action_duration(self, action_def_id: Optional[str]) -> int:
+        action_def = self.action_def(action_def_id)
+        if action_def and action_def.get("base_minutes"):
+            return action_def["base_minutes"]
+        return DEFAULT_ACTION_DURATION_MIN
+
+    # --- area lookups ---
+    def area(self, area_id: Optional[str]) -> Optional[Dict]:
+        return self._areas_by_id.get(area_id) if area_id else None
+
+    def area_by_name(self, name: Optional[str]) -> Optional[Dict]:
+        return self._areas_by_name.get(name) if name else None
+
+    def area_name(self, area_id: Optional[str], default: Optional[str] = None) -> Optional[str]:
+        area = self.area(area_id)
+        return area.get("name", default) if area else default
+
+    # --- object lookups ---
+    def object(self, object_id: Optional[str]) -> Optional[Dict]:
+        return self._objects_by_id.get(object_id) if object_id else None
+
+    def object_by_name(self, name: Optional[str]) -> Optional[Dict]:
+        return self._objects_by_name.get(name) if name else None
+
+    def object_area_name(self, object_id: Optional[str]) -> Optional[str]:
+        obj = self.object(object_id)
+        return self.area_name(obj.get("area_id")) if obj else None
+
+    # --- title -> object -> area ---
+    def object_for_action_title(self, title: Optional[str]) -> Optional[Dict]:
+        return self._object_by_action_title.get(title) if title else None
+
+    def area_for_action_title(self, title: Optional[str]) -> Optional[Dict]:
+        obj = self.object_for_action_title(title)
+        return self.area(obj.get("area_id")) if obj else None
+
+
+catalog = Catalog()
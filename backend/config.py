@@ -9,6 +9,35 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str
     TICK_REAL_SEC: float = 1.0  # 1 real-sec
     TICK_SIM_MIN: int = 15       # Changed from 5 to 15 sim-min
+    LLM_MAX_CONCURRENCY: int = 8 # Concurrent LLM completions (also bounds concurrent dialogues)
+    PLANNING_MAX_CONCURRENCY: int = 8 # NPCs planned concurrently in the daily planning window
+    PLANNING_MODE: str = "individual" # "batched": several NPCs per planning completion (falls back per NPC); "individual": one each
+    PLANNING_BATCH_SIZE: int = 5        # NPCs per batched planning completion
+    DIALOGUE_MODE: str = "separate" # "joint": transcript + both summaries in one JSON completion; "separate": three completions
+    DIALOGUE_QUEUE_MAX_SIZE: int = 64   # Pending dialogue requests kept; lowest priority is dropped beyond this
+    DIALOGUE_MAX_PER_TICK: int = 4      # Dialogues that may start in one tick
+    DIALOGUE_MAX_PER_SIM_HOUR: int = 12 # Dialogues that may start within any 60 sim-minutes
+    REPLAN_DEBOUNCE_SIM_MIN: int = 15   # Replan triggers for one NPC within this many sim-minutes are merged into one replan
+    REPLAN_DEBOUNCE_MAX_WAIT_SEC: float = 10.0 # Real-time backstop for processes that don't run the tick loop
+    REPLAN_GATE_ENABLED: bool = True    # Decide clear replan cases locally instead of asking the LLM
+    REPLAN_GATE_SKIP_BELOW: float = 0.15  # Event vs. upcoming action similarity below which the replan is skipped
+    REPLAN_GATE_REPLAN_ABOVE: float = 0.55 # ... and above which it goes ahead without asking
+    REPLAN_GATE_AUDIT_RATE: float = 0.1  # Share of local skips re-asked to the LLM to measure false negatives
+    COGNITION_MODE: str = "inline"     # "batch": nightly reflection (and next-day planning) go through the Batch API off the tick path
+    BATCH_PLANNING_ENABLED: bool = True # In batch mode, also plan the next day in a batch job once reflections are in
+    BATCH_API_BASE_URL: str = ""        # Batch API endpoint; empty = OpenAI, or a compatible local stand-in server
+    BATCH_POLL_INTERVAL_SEC: float = 5.0   # How often a submitted batch job is polled
+    BATCH_JOB_TIMEOUT_SEC: float = 3600.0  # Upper bound; jobs are also cancelled in time for 05:00 at the current tick rate
+    REFLECTION_MODE: str = "nightly"  # "incremental": reflect when new experiences add up; "nightly": every NPC at midnight
+    REFLECTION_IMPORTANCE_THRESHOLD: int = 20  # Summed importance of experiences since the last reflection that triggers one
+    REFLECTION_RELATED_TOP_K: int = 10  # Older memories related to the new experiences added to a reflection
+    SPECULATIVE_PLANNING_ENABLED: bool = False  # Plan each NPC's day during its night hours (01:30-04:30) instead of all at 05:00
+    RUN_SCHEDULER: bool = True   # False for web-only workers that just serve API/WebSocket traffic
+    LEADER_LEASE_ENABLED: bool = False  # True for multi-replica deployments: only the lease holder ticks
+    LEADER_LEASE_TTL_SEC: float = 5.0
+    WS_PUBSUB_BACKEND: str = "inprocess"  # "inprocess" or "redis" (cross-process WebSocket fan-out)
+    WS_PUBSUB_URL: str = "redis://localhost:6379/0"
+    WS_PUBSUB_CHANNEL: str = "ac:ws"
 
     class Config:
         env_file = '.env' # Path relative to project root where uvicorn is run
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Dict, Set, Tuple
+
+from .services import supa, execute_supabase_query
+
+
+def canonical_pair(npc_id1: str, npc_id2: str) -> Tuple[str, str]:
+    """Returns NPC IDs in a canonical order (lexicographically smaller first)."""
+    return tuple(sorted((npc_id1, npc_id2)))
+
+
+class DialogueCooldowns:
+    """In-memory copy of npc_dialogue_cooldowns, keyed by canonical NPC pair.
+
+    Checks are answered from the dict with no I/O; set_cooldown() updates the dict
+    immediately and writes the row through to the DB in the background. Entries are
+    dropped lazily once the sim clock passes them.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._loaded = False
+        self._cooldown_until: Dict[Tuple[str, str], int] = {}
+        self._pending_writes: Set[asyncio.Task] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def load(self) -> None:
+        """(Re)loads every cooldown row from the DB."""
+        async with self._lock:
+            await self._load_unlocked()
+
+    async def ensure_loaded(self) -> "DialogueCooldowns":
+        if self._loaded:
+            return self
+        async with self._lock:
+            if not self._loaded:
+                await self._load_unlocked()
+        return self
+
+    def invalidate(self) -> None:
+        """Marks the table stale; the next ensure_loaded() refetches it."""
+        self._loaded = False
+
+    async def _load_unlocked(self) -> None:
+        try:
+            res = await execute_supabase_query(
+                lambda: supa.table('npc_dialogue_cooldowns').select('npc_id_1, npc_id_2, cooldown_until_sim_min').execute()
+            )
+        except Exception as e:
+            print(f"Error loading dialogue cooldowns: {e}")
+            return
+        self._cooldown_until = {
+            canonical_pair(row['npc_id_1'], row['npc_id_2']): row.get('cooldown_until_sim_min') or 0
+            for row in ((res.data if res else None) or [])
+        }
+        self._loaded = True
+        print(f"COOLDOWNS: Loaded {len(self._cooldown_until)} dialogue cooldowns.")
+
+    def is_on_cooldown(self, npc_id1: str, npc_id2: str, current_tick: int) -> bool:
+        pair = canonical_pair(npc_id1, npc_id2)
+        cooldown_until = self._cooldown_until.get(pair)
+        if cooldown_until is None:
+            return False
+        if cooldown_until > current_tick:
+            return True
+        del self._cooldown_until[pair]  # Expired
+        return False
+
+    def set_cooldown(self, npc_id1: str, npc_id2: str, cooldown_until: int) -> None:
+        pair = canonical_pair(npc_id1, npc_id2)
+        self._cooldown_until[pair] = cooldown_until
+        task = asyncio.create_task(self._write_through(pair, cooldown_until))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _write_through(self, pair: Tuple[str, str], cooldown_until: int) -> None:
+        id1_canon, id2_canon = pair
+        try:
+            await execute_supabase_query(
+                lambda: supa.table('npc_dialogue_cooldowns')
+                .upsert({'npc_id_1': id1_canon, 'npc_id_2': id2_canon, 'cooldown_until_sim_min': cooldown_until})
+                .execute()
+            )
+        except Exception as e:
+            print(f"    !!!! Failed to persist dialogue cooldown for pair {pair}: {e}")
+
+    async def flush(self) -> None:
+        """Waits for outstanding write-throughs, e.g. before giving up the leader lease."""
+        if self._pending_writes:
+            await asyncio.gather(*list(self._pending_writes), return_exceptions=True)
+
+
+dialogue_cooldowns = DialogueCooldowns()
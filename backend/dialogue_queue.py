@@ -0,0 +1,175 @@
+import heapq
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .cooldowns import canonical_pair
+
+# Weights of the three priority terms. Recency decays to half an hour after the
+# encounter; relationship strength and encounter importance are used as given.
+PRIORITY_RECENCY_WEIGHT = 1.0
+PRIORITY_RECENCY_HALF_LIFE_MIN = 30
+PRIORITY_RELATIONSHIP_WEIGHT = 0.5
+PRIORITY_IMPORTANCE_WEIGHT = 0.25
+
+SIM_HOUR_MINUTES = 60
+
+
+def relationship_strength(relationships: Any, other_npc_id: str) -> float:
+    """Reads how strongly an NPC feels about another from its free-form relationships JSON.
+
+    Accepts either a number or an object with a strength/affinity/score field; unknown
+    shapes count as no relationship.
+    """
+    if not isinstance(relationships, dict):
+        return 0.0
+    value = relationships.get(other_npc_id)
+    if isinstance(value, dict):
+        value = value.get("strength", value.get("affinity", value.get("score")))
+    try:
+        return abs(float(value))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def encounter_importance(npc_a: Dict[str, Any], npc_b: Dict[str, Any]) -> int:
+    """Rates an encounter 1-3 from the NPC rows: +1 when neither lists the other in its
+    relationships (a first meeting), +1 when either is between actions and free to talk.
+    """
+    importance = 1
+    known_a = isinstance(npc_a.get("relationships"), dict) and npc_b["id"] in npc_a["relationships"]
+    known_b = isinstance(npc_b.get("relationships"), dict) and npc_a["id"] in npc_b["relationships"]
+    if not known_a and not known_b:
+        importance += 1
+    if not npc_a.get("current_action_id") or not npc_b.get("current_action_id"):
+        importance += 1
+    return importance
+
+
+class DialogueQueue:
+    """Bounded dialogue request queue with a pair index and an LLM start budget.
+
+    At most one request is queued per NPC pair; a newer encounter refreshes it. Each tick,
+    take_for_tick() starts the highest-priority requests that fit both the per-tick and the
+    per-sim-hour budget and leaves the rest queued (deferred) until they go stale.
+    """
+
+    def __init__(self, max_size: int, max_per_tick: int, max_per_sim_hour: int, max_age_min: int):
+        self.max_size = max_size
+        self.max_per_tick = max_per_tick
+        self.max_per_sim_hour = max_per_sim_hour
+        self.max_age_min = max_age_min
+        self._requests: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._recent_starts: Deque[int] = deque()  # sim minute of every start within the last sim hour
+        self.metrics: Dict[str, int] = {
+            "enqueued": 0,
+            "refreshed": 0,
+            "started": 0,
+            "deferred": 0,
+            "dropped_queue_full": 0,
+            "dropped_stale": 0,
+            "dropped_cooldown": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def requests(self) -> List[Dict[str, Any]]:
+        return list(self._requests.values())
+
+    def contains(self, npc_a_id: str, npc_b_id: str) -> bool:
+        return canonical_pair(npc_a_id, npc_b_id) in self._requests
+
+    @staticmethod
+    def priority(request: Dict[str, Any], current_tick: int) -> float:
+        age = max(current_tick - request["tick"], 0)
+        recency = 0.5 ** (age / PRIORITY_RECENCY_HALF_LIFE_MIN)
+        return (
+            PRIORITY_RECENCY_WEIGHT * recency
+            + PRIORITY_RELATIONSHIP_WEIGHT * request.get("relationship", 0.0)
+            + PRIORITY_IMPORTANCE_WEIGHT * request.get("importance", 1)
+        )
+
+    def add(self, request: Dict[str, Any]) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Queues a request. Returns (added, evicted request or None).
+
+        A request for a pair that is already queued refreshes the queued one instead of
+        being added. When the queue is full, the lowest-priority request (possibly the
+        new one) is dropped.
+        """
+        pair = canonical_pair(request["npc_a_id"], request["npc_b_id"])
+        existing = self._requests.get(pair)
+        if existing is not None:
+            if request["tick"] >= existing["tick"]:
+                for field in ("tick", "trigger_event", "area_name", "relationship", "importance"):
+                    if field in request:
+                        existing[field] = request[field]
+            self.metrics["refreshed"] += 1
+            return False, None
+
+        evicted = None
+        if len(self._requests) >= self.max_size:
+            current_tick = request["tick"]
+            weakest_pair, weakest = min(self._requests.items(), key=lambda item: self.priority(item[1], current_tick))
+            self.metrics["dropped_queue_full"] += 1
+            if self.priority(weakest, current_tick) >= self.priority(request, current_tick):
+                return False, request
+            del self._requests[weakest_pair]
+            evicted = weakest
+        self._requests[pair] = request
+        self.metrics["enqueued"] += 1
+        return True, evicted
+
+    def _budget_left(self, current_tick: int) -> int:
+        while self._recent_starts and self._recent_starts[0] <= current_tick - SIM_HOUR_MINUTES:
+            self._recent_starts.popleft()
+        return max(min(self.max_per_tick, self.max_per_sim_hour - len(self._recent_starts)), 0)
+
+    def take_for_tick(
+        self, current_tick: int, is_on_cooldown: Callable[[str, str, int], bool]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Returns (requests to start now, requests dropped as stale or on cooldown).
+
+        Both lists are removed from the queue; anything else stays queued for a later tick.
+        """
+        dropped = []
+        for pair, request in list(self._requests.items()):
+            if current_tick > request["tick"] + self.max_age_min:
+                self.metrics["dropped_stale"] += 1
+            elif is_on_cooldown(request["npc_a_id"], request["npc_b_id"], current_tick):
+                self.metrics["dropped_cooldown"] += 1
+            else:
+                continue
+            del self._requests[pair]
+            dropped.append(request)
+
+        budget = self._budget_left(current_tick)
+        selected = heapq.nlargest(budget, self._requests.values(), key=lambda req: self.priority(req, current_tick)) if budget else []
+        for request in selected:
+            del self._requests[canonical_pair(request["npc_a_id"], request["npc_b_id"])]
+            self._recent_starts.append(current_tick)
+        self.metrics["started"] += len(selected)
+        self.metrics["deferred"] += len(self._requests)
+        return selected, dropped
+
+    def replace(self, requests: List[Dict[str, Any]]) -> None:
+        """Replaces the queue contents, e.g. with the shared queue when becoming leader."""
+        self._requests = {}
+        for request in requests:
+            self._requests[canonical_pair(request["npc_a_id"], request["npc_b_id"])] = request
+
+    def reset(self) -> List[Dict[str, Any]]:
+        """Empties the queue and the sim-hour budget, e.g. after the clock is set back. Returns the dropped requests."""
+        dropped = list(self._requests.values())
+        self._requests = {}
+        self._recent_starts.clear()
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._requests),
+            "max_size": self.max_size,
+            "max_per_tick": self.max_per_tick,
+            "max_per_sim_hour": self.max_per_sim_hour,
+            "started_last_sim_hour": len(self._recent_starts),
+            **self.metrics,
+        }
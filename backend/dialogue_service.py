@@ -1,17 +1,23 @@
 import asyncio
+import json
 import random
 import re
 from typing import List, Dict, Any, Set, Optional, Tuple
 
 from .config import get_settings
-from .llm import call_llm
+from .llm import call_llm_async, stream_llm
 from .prompts import (
     get_dialogue_system_prompt, get_dialogue_user_prompt, format_traits,
-    get_dialogue_summary_system_prompt, get_dialogue_summary_user_prompt
+    get_dialogue_summary_system_prompt, get_dialogue_summary_user_prompt,
+    get_dialogue_joint_system_prompt, get_dialogue_joint_user_prompt
 )
 from .memory_service import retrieve_memories, get_embedding
-from .services import supa, execute_supabase_query
+from .services import supa, execute_supabase_query, bulk_insert
 from .websocket_utils import broadcast_ws_message
+from .cooldowns import canonical_pair, dialogue_cooldowns
+from .dialogue_queue import DialogueQueue
+from .transcript_cache import transcript_cache
+from .replan_coordinator import replan_coordinator
 # We will need to import run_daily_planning from planning_and_reflection if we call it directly,
 # or scheduler's get_current_sim_time_and_day.
 # For now, this version will return NPCs to replan.
@@ -19,14 +25,82 @@ from .websocket_utils import broadcast_ws_message
 settings = get_settings()
 
 # --- State for Dialogue Processing ---
-pending_dialogue_requests: List[Dict[str, Any]] = []
-# global npc_dialogue_cooldown_until # REMOVED - Will use DB table
-# npc_dialogue_cooldown_until: Dict[str, int] = {} # REMOVED
+# Cooldowns live in cooldowns.dialogue_cooldowns (in-memory, written through to npc_dialogue_cooldowns)
 DIALOGUE_COOLDOWN_MINUTES = 480 # UPDATED to 8 hours (8 * 60)
 
+# Pending requests: one per NPC pair, started by priority within the LLM budget
+dialogue_queue = DialogueQueue(
+    max_size=settings.DIALOGUE_QUEUE_MAX_SIZE,
+    max_per_tick=settings.DIALOGUE_MAX_PER_TICK,
+    max_per_sim_hour=settings.DIALOGUE_MAX_PER_SIM_HOUR,
+    max_age_min=DIALOGUE_COOLDOWN_MINUTES, # Requests older than this are stale
+)
+DIALOGUE_MODE_JOINT = "joint"
+DIALOGUE_TURN_SIM_MINUTES = 1 # Sim-time spacing between persisted turns
+
 # Track active dialogues to prevent race conditions
 active_dialogues_pending_completion: Dict[Tuple[str, str], int] = {}
 
+# Dialogues run concurrently up to the LLM budget; an NPC takes part in one at a time
+_dialogue_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+_npc_dialogue_locks: Dict[str, asyncio.Lock] = {}
+# Post-processing (persistence, summaries, memories, replans) of dialogues already shown in the UI
+_background_dialogue_tasks: Set[asyncio.Task] = set()
+
+# Columns of the shared dialogue_request table (LEADER_LEASE_ENABLED deployments only)
+DIALOGUE_REQUEST_FIELDS = (
+    'npc_a_id', 'npc_b_id', 'npc_a_name', 'npc_b_name', 'npc_a_traits', 'npc_b_traits',
+    'trigger_event', 'tick', 'area_name', 'relationship', 'importance',
+)
+
+async def _persist_dialogue_request(request: Dict[str, Any]) -> None:
+    """Writes a queued request through to dialogue_request so a new leader can pick it up."""
+    try:
+        res = await execute_supabase_query(
+            lambda: supa.table('dialogue_request').insert({field: request[field] for field in DIALOGUE_REQUEST_FIELDS}).execute()
+        )
+        if res and res.data:
+            request['request_id'] = res.data[0]['id']
+    except Exception as e:
+        print(f"Error persisting dialogue request for {request['npc_a_name']} & {request['npc_b_name']}: {e}")
+
+async def _delete_persisted_dialogue_requests(requests: List[Dict[str, Any]]) -> None:
+    request_ids = [req['request_id'] for req in requests if req.get('request_id')]
+    if not request_ids:
+        return
+    try:
+        await execute_supabase_query(lambda: supa.table('dialogue_request').delete().in_('id', request_ids).execute())
+    except Exception as e:
+        print(f"Error deleting {len(request_ids)} processed dialogue requests: {e}")
+
+async def load_pending_dialogue_requests() -> int:
+    """Replaces the in-memory queue with the shared one. Called when this process becomes leader."""
+    try:
+        res = await execute_supabase_query(
+            lambda: supa.table('dialogue_request').select('*').order('created_at').execute()
+        )
+    except Exception as e:
+        print(f"Error loading pending dialogue requests: {e}")
+        return len(dialogue_queue)
+    dialogue_queue.replace([
+        {**{field: row.get(field) for field in DIALOGUE_REQUEST_FIELDS}, 'request_id': row['id']}
+        for row in ((res.data if res else None) or [])
+    ])
+    active_dialogues_pending_completion.clear()
+    return len(dialogue_queue)
+
+async def clear_dialogue_requests() -> None:
+    """Deletes every persisted dialogue request, e.g. when the simulation clock is reset.
+
+    Each process's in-memory queue is emptied by broadcast_simulation_reset().
+    """
+    if not settings.LEADER_LEASE_ENABLED:
+        return
+    try:
+        await execute_supabase_query(lambda: supa.table('dialogue_request').delete().gte('tick', 0).execute())
+    except Exception as e:
+        print(f"Error clearing dialogue requests: {e}")
+
 def _parse_dialogue_from_llm(raw_text: str, npc_a_name: str, npc_b_name: str) -> List[Dict[str, str]]:
     """
     Parses the raw dialogue text from the LLM into structured turns.
@@ -74,224 +148,420 @@ def _parse_dialogue_from_llm(raw_text: str, npc_a_name: str, npc_b_name: str) ->
 
 def _get_canonical_npc_pair(npc_id1: str, npc_id2: str) -> Tuple[str, str]:
     """Returns NPC IDs in a canonical order (lexicographically smaller first)."""
-    return tuple(sorted((npc_id1, npc_id2)))
+    return canonical_pair(npc_id1, npc_id2)
 
-async def are_npcs_on_cooldown(npc_id1_check: str, npc_id2_check: str, current_tick: int) -> bool:
-    """Checks the DB to see if a given pair of NPCs is on dialogue cooldown."""
-    id1_canon, id2_canon = _get_canonical_npc_pair(npc_id1_check, npc_id2_check)
-    try:
-        cooldown_res = await execute_supabase_query(
-            lambda: supa.table('npc_dialogue_cooldowns')
-            .select('cooldown_until_sim_min')
-            .eq('npc_id_1', id1_canon)
-            .eq('npc_id_2', id2_canon)
-            .maybe_single()
-            .execute()
-        )
-        if cooldown_res and cooldown_res.data and cooldown_res.data.get('cooldown_until_sim_min', 0) > current_tick:
-            return True # Cooldown is active
-    except Exception as e:
-        print(f"Error checking are_npcs_on_cooldown in DB: {e}")
-        # If DB check fails, assume not on cooldown to allow dialogue attempts (fail open)
-    return False # Not on cooldown or DB check failed
+def are_npcs_on_cooldown(npc_id1_check: str, npc_id2_check: str, current_tick: int) -> bool:
+    """Checks whether a given pair of NPCs is on dialogue cooldown. In-memory, no I/O."""
+    return dialogue_cooldowns.is_on_cooldown(npc_id1_check, npc_id2_check, current_tick)
 
-async def add_pending_dialogue_request(npc_a_id: str, npc_b_id: str, npc_a_name: str, npc_b_name: str, npc_a_traits: List[str], npc_b_traits: List[str], trigger_event: str, current_tick: int, area_name: str):
-    """Adds a dialogue request if not already present and NPCs are not on DB cooldown (checked by caller or here as safeguard)."""
+async def add_pending_dialogue_request(npc_a_id: str, npc_b_id: str, npc_a_name: str, npc_b_name: str, npc_a_traits: List[str], npc_b_traits: List[str], trigger_event: str, current_tick: int, area_name: str, relationship: float = 0.0, importance: int = 1):
+    """Queues a dialogue request unless the pair is on cooldown (checked by caller or here as safeguard).
+
+    A pair that is already queued is refreshed rather than queued twice. relationship and
+    importance raise the request's priority when the per-tick/per-sim-hour budget is tight.
+    """
     
     # This check is somewhat redundant if the scheduler calls are_npcs_on_cooldown first, 
     # but kept as a direct safeguard within the service if called from elsewhere or if scheduler's check is bypassed.
-    if await are_npcs_on_cooldown(npc_a_id, npc_b_id, current_tick):
+    if are_npcs_on_cooldown(npc_a_id, npc_b_id, current_tick):
         print(f"[DialogueAddAttemptDB-Direct] Cooldown active for pair ({npc_a_name}, {npc_b_name}). Request at tick {current_tick} rejected.")
         return
 
-    for req in pending_dialogue_requests:
-        if req['tick'] == current_tick and \
-           ((req['npc_a_id'] == npc_a_id and req['npc_b_id'] == npc_b_id) or \
-            (req['npc_a_id'] == npc_b_id and req['npc_b_id'] == npc_a_id)):
-            return
-
-    pending_dialogue_requests.append({
+    request = {
         'npc_a_id': npc_a_id, 'npc_b_id': npc_b_id,
         'npc_a_name': npc_a_name, 'npc_b_name': npc_b_name,
         'npc_a_traits': npc_a_traits, 'npc_b_traits': npc_b_traits,
         'trigger_event': trigger_event, 'tick': current_tick,
-        'area_name': area_name
-    })
+        'area_name': area_name, 'relationship': relationship, 'importance': importance
+    }
+    added, evicted = dialogue_queue.add(request)
+    if evicted is not None:
+        print(f"[DialogueQueue] Queue full ({dialogue_queue.max_size}); dropped request for {evicted['npc_a_name']} & {evicted['npc_b_name']}.")
+    if settings.LEADER_LEASE_ENABLED:
+        if added:
+            await _persist_dialogue_request(request)
+        if evicted is not None and evicted is not request:
+            await _delete_persisted_dialogue_requests([evicted])
 
-async def process_pending_dialogues(current_sim_minutes_total: int) -> None:
-    """Processes dialogues and triggers replanning when appropriate."""
-    global pending_dialogue_requests
+def _parse_joint_dialogue(raw_text: str, npc_a_name: str, npc_b_name: str) -> Optional[Tuple[List[Dict[str, str]], str, str]]:
+    """
+    Validates a joint-mode JSON response: {"turns": [{"speaker", "line"}, ...], "summary_a", "summary_b"}.
+    Returns (turns, summary_a, summary_b), or None if anything required is missing or malformed.
+    """
+    try:
+        payload = json.loads(raw_text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(payload, dict) or not isinstance(payload.get('turns'), list):
+        return None
 
-    if not pending_dialogue_requests:
-        return
-    print(f"DEBUG: Processing {len(pending_dialogue_requests)} pending dialogue requests at tick {current_sim_minutes_total}.")
-    
-    processed_indices = []
-    for i, request in enumerate(pending_dialogue_requests):
-        npc_a_id = request['npc_a_id']
-        npc_b_id = request['npc_b_id']
-        npc_a_name = request['npc_a_name']
-        npc_b_name = request['npc_b_name']
-        npc_a_traits = request['npc_a_traits']
-        npc_b_traits = request['npc_b_traits']
-        trigger_event = request['trigger_event']
-        request_tick = request['tick']
-        area_name = request['area_name']
-
-        if current_sim_minutes_total > request_tick + DIALOGUE_COOLDOWN_MINUTES: # Stale check remains
-            processed_indices.append(i)
+    speakers = {npc_a_name.lower(): npc_a_name, npc_b_name.lower(): npc_b_name}
+    dialogue_turns = []
+    for turn in payload['turns']:
+        if not isinstance(turn, dict):
             continue
+        speaker = str(turn.get('speaker', '')).strip().strip('*').lower()
+        line = str(turn.get('line', '')).strip()
+        # Normalize the speaker name to match the actual NPC name; drop anyone else
+        if speaker in speakers and line:
+            dialogue_turns.append({'speaker': speakers[speaker], 'line': line})
 
-        # Final cooldown safeguard. The primary cooldown check and the 50% initiation chance
-        # are handled in scheduler.py *before* a dialogue request is added.
-        # If a request reaches this point, it means it passed those initial checks.
-        if await are_npcs_on_cooldown(npc_a_id, npc_b_id, current_sim_minutes_total):
-            print(f"  [ProcessQueueDB] Dialogue for {npc_a_name} & {npc_b_name} skipped: Cooldown (final check).")
-            processed_indices.append(i)
+    summary_a = payload.get('summary_a')
+    summary_b = payload.get('summary_b')
+    if not dialogue_turns or not isinstance(summary_a, str) or not isinstance(summary_b, str) \
+            or not summary_a.strip() or not summary_b.strip():
+        return None
+    return dialogue_turns, summary_a.strip(), summary_b.strip()
+
+# A complete {"speaker": ..., "line": ...} object inside a partially streamed joint response
+_JOINT_TURN_PATTERN = re.compile(r'\{\s*"speaker"\s*:\s*"(?:[^"\\]|\\.)*"\s*,\s*"line"\s*:\s*"(?:[^"\\]|\\.)*"\s*\}')
+
+def _streamed_turns_separate(text: str, npc_a_name: str, npc_b_name: str, final: bool) -> List[Dict[str, str]]:
+    """Turns of a partially streamed plain-text dialogue that can no longer change.
+
+    The last turn may still get continuation lines, so it only counts once the stream ends.
+    """
+    if final:
+        return _parse_dialogue_from_llm(text, npc_a_name, npc_b_name)
+    complete_lines = text[:text.rfind('\n') + 1]
+    return _parse_dialogue_from_llm(complete_lines, npc_a_name, npc_b_name)[:-1]
+
+def _streamed_turns_joint(text: str, npc_a_name: str, npc_b_name: str, final: bool) -> List[Dict[str, str]]:
+    """Complete turn objects found so far in a partially streamed joint JSON response."""
+    speakers = {npc_a_name.lower(): npc_a_name, npc_b_name.lower(): npc_b_name}
+    dialogue_turns = []
+    for match in _JOINT_TURN_PATTERN.finditer(text):
+        try:
+            turn = json.loads(match.group(0))
+        except json.JSONDecodeError:
             continue
+        speaker = str(turn.get('speaker', '')).strip().strip('*').lower()
+        line = str(turn.get('line', '')).strip()
+        if speaker in speakers and line:
+            dialogue_turns.append({'speaker': speakers[speaker], 'line': line})
+    return dialogue_turns
+
+async def _stream_dialogue(
+    system_prompt: str, user_prompt: str, max_tokens: int, request: Dict[str, Any], dialogue_id: str,
+    start_min: int, streamed_turns, response_format: Optional[Dict] = None,
+) -> str:
+    """Streams a dialogue completion, broadcasting each turn as a dialogue_turn as soon as it is
+    complete. Returns the full raw text."""
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+    speaker_ids = {npc_a_name: request['npc_a_id'], npc_b_name: request['npc_b_id']}
+    raw_text = ""
+    sent_count = 0
+
+    async def _send_new_turns(final: bool):
+        nonlocal sent_count
+        dialogue_turns = streamed_turns(raw_text, npc_a_name, npc_b_name, final)
+        for turn_index in range(sent_count, len(dialogue_turns)):
+            turn = dialogue_turns[turn_index]
+            turn_min = start_min + turn_index * DIALOGUE_TURN_SIM_MINUTES
+            await broadcast_ws_message("dialogue_turn", {
+                "dialogue_id": dialogue_id, "turn_index": turn_index,
+                "npc_id": speaker_ids.get(turn['speaker']), "speaker_name": turn['speaker'], "line": turn['line'],
+                "npc_a_id": request['npc_a_id'], "npc_b_id": request['npc_b_id'],
+                "sim_min_of_day": turn_min % 1440, "day": (turn_min // 1440) + 1
+            })
+        sent_count = max(sent_count, len(dialogue_turns))
+
+    async for chunk in stream_llm(system_prompt, user_prompt, max_tokens=max_tokens, response_format=response_format):
+        raw_text += chunk
+        if '\n' in chunk or '}' in chunk:
+            await _send_new_turns(final=False)
+    await _send_new_turns(final=True)
+    return raw_text
+
+async def _generate_dialogue_joint(request: Dict[str, Any], memories: Any, dialogue_id: str, start_min: int) -> Optional[Tuple[List[Dict[str, str]], str, str]]:
+    """One streamed JSON completion for the transcript and both participants' summaries. None on any failure."""
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+    system_prompt = get_dialogue_joint_system_prompt().format(
+        npc_name=npc_a_name, traits=format_traits(request['npc_a_traits']),
+        other_npc_name=npc_b_name, other_npc_traits=format_traits(request['npc_b_traits'])
+    )
+    user_prompt = get_dialogue_joint_user_prompt().format(
+        npc_name=npc_a_name, other_npc_name=npc_b_name,
+        area_name=request['area_name'], memories=memories
+    )
+    raw_response = await _stream_dialogue(
+        system_prompt, user_prompt, 800, request, dialogue_id, start_min, _streamed_turns_joint,
+        response_format={"type": "json_object"},
+    )
+    if not raw_response:
+        return None
+    print(f"    Raw joint dialogue:\n{raw_response}")
+    return _parse_joint_dialogue(raw_response, npc_a_name, npc_b_name)
+
+async def _generate_dialogue_separate(request: Dict[str, Any], memories: Any, dialogue_id: str, start_min: int) -> Optional[List[Dict[str, str]]]:
+    """The dialogue from NPC A's perspective, streamed; summaries are made later by _summarize_dialogue."""
+    npc_a_id = request['npc_a_id']
+    npc_b_id = request['npc_b_id']
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+
+    dialogue_system_template_A = get_dialogue_system_prompt()
+    dialogue_user_template_A = get_dialogue_user_prompt()
+
+    system_prompt_A = dialogue_system_template_A.format(npc_name=npc_a_name, traits=format_traits(request['npc_a_traits']))
+    user_prompt_A = dialogue_user_template_A.format(
+        other_npc_name=npc_b_name,
+        other_npc_traits=format_traits(request['npc_b_traits']),
+        area_name=request['area_name'],
+        memories=memories
+    )
+
+    raw_dialogue_text = await _stream_dialogue(system_prompt_A, user_prompt_A, 600, request, dialogue_id, start_min, _streamed_turns_separate)
+
+    if not raw_dialogue_text:
+        print(f"    LLM call for dialogue between {npc_a_name} & {npc_b_name} returned no text.")
+        return None
+
+    print(f"    Raw dialogue:\n{raw_dialogue_text}")
+    parsed_dialogue_turns = _parse_dialogue_from_llm(raw_dialogue_text, npc_a_name, npc_b_name)
+
+    if not parsed_dialogue_turns:
+        print(f"DIALOGUE: Could not parse dialogue between {npc_a_name} and {npc_b_name}. Raw text: {raw_dialogue_text}")
+        await broadcast_ws_message("dialogue_event", {"status": "failed_parsing", "npc_a_id": npc_a_id, "npc_b_id": npc_b_id, "npc_a_name": npc_a_name, "npc_b_name": npc_b_name})
+        return None
+    return parsed_dialogue_turns
+
+async def _summarize_dialogue(request: Dict[str, Any], dialogue_turns: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[str]]:
+    """One summary call per participant, in parallel. For B's summary we don't need B's
+    memories: the transcript they just took part in is the context."""
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+    dialogue_transcript = "\n".join([f"{turn['speaker']}: {turn['line']}" for turn in dialogue_turns])
+    summary_system = get_dialogue_summary_system_prompt() # No formatting needed for this system prompt
+    dialogue_summary_user_template = get_dialogue_summary_user_prompt()
+    summary_user_A = dialogue_summary_user_template.format(npc_name=npc_a_name, other_npc_name=npc_b_name, dialogue_transcript=dialogue_transcript)
+    summary_user_B = dialogue_summary_user_template.format(npc_name=npc_b_name, other_npc_name=npc_a_name, dialogue_transcript=dialogue_transcript)
+    summary_A, summary_B = await asyncio.gather(
+        call_llm_async(summary_system, summary_user_A, max_tokens=150),
+        call_llm_async(summary_system, summary_user_B, max_tokens=150),
+    )
+    return summary_A, summary_B
+
+async def _save_dialogue_turns(dialogue_id: str, dialogue_turns: List[Dict[str, str]], speaker_ids: Dict[str, str], start_min: int) -> None:
+    """Writes all turns with one multi-row insert and sets dialogue.end_min, concurrently.
+
+    Turns are spaced DIALOGUE_TURN_SIM_MINUTES apart so the transcript keeps its order.
+    """
+    turn_rows = [
+        {'dialogue_id': dialogue_id, 'speaker_id': speaker_ids.get(turn['speaker']), 'sim_min': start_min + index * DIALOGUE_TURN_SIM_MINUTES, 'text': turn['line']}
+        for index, turn in enumerate(dialogue_turns)
+    ]
+    end_min = start_min + len(dialogue_turns) * DIALOGUE_TURN_SIM_MINUTES
+    results = await asyncio.gather(
+        bulk_insert('dialogue_turn', turn_rows),
+        execute_supabase_query(lambda: supa.table('dialogue').update({'end_min': end_min}).eq('id', dialogue_id).execute()),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"    !!!! Failed to persist transcript for dialogue {dialogue_id}: {result}")
+    if not isinstance(results[0], Exception):
+        transcript_cache.put_written(dialogue_id, dialogue_turns, start_min, DIALOGUE_TURN_SIM_MINUTES)
+
+def _npc_lock(npc_id: str) -> asyncio.Lock:
+    lock = _npc_dialogue_locks.get(npc_id)
+    if lock is None:
+        lock = _npc_dialogue_locks[npc_id] = asyncio.Lock()
+    return lock
+
+async def _save_dialogue_summary(npc_id: str, npc_name: str, other_npc_name: str, summary: Optional[str], dialogue_id: str, current_sim_minutes_total: int) -> None:
+    if not summary:
+        print(f"    No dialogue summary to save for {npc_name} (dialogue {dialogue_id})")
+        return
+    emb = await get_embedding(summary)
+    if not emb:
+        return
+    mem_payload = {'npc_id': npc_id, 'sim_min': current_sim_minutes_total, 'kind': 'dialogue_summary', 'content': summary, 'importance': 3, 'embedding': emb, 'metadata': {'dialogue_id': dialogue_id, 'other_participant_name': other_npc_name}}
+    db_res_sum = await execute_supabase_query(lambda: supa.table('memory').insert(mem_payload).execute())
+    if db_res_sum.data:
+        print(f"    Saved dialogue summary for {npc_name}")
+        await broadcast_ws_message("dialogue_event", {"npc_id": npc_id, "npc_name": npc_name, "other_participant_name": other_npc_name, "summary": summary, "dialogue_id": dialogue_id, "sim_min_of_day": current_sim_minutes_total % 1440, "day": (current_sim_minutes_total // 1440) + 1 })
+
+def _release_dialogue(dialogue_pair: Tuple[str, str], locks: List[asyncio.Lock]) -> None:
+    # Clean up the active dialogue tracking
+    if dialogue_pair in active_dialogues_pending_completion:
+        active_dialogues_pending_completion[dialogue_pair] -= 1
+        if active_dialogues_pending_completion[dialogue_pair] <= 0:
+            del active_dialogues_pending_completion[dialogue_pair]
+    for lock in reversed(locks):
+        lock.release()
+
+async def _process_dialogue_request(request: Dict[str, Any], current_sim_minutes_total: int) -> None:
+    """Generates one dialogue, streaming its turns to the UI, then hands post-processing
+    (persistence, summaries, memories, replans) to a background task.
+
+    Both participants' locks are held until that task has persisted the transcript, taken
+    in id order so two in-flight dialogues sharing an NPC can never deadlock.
+    """
+    npc_a_id = request['npc_a_id']
+    npc_b_id = request['npc_b_id']
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+    trigger_event = request['trigger_event']
+
+    dialogue_pair = _get_canonical_npc_pair(npc_a_id, npc_b_id)
+    locks: List[asyncio.Lock] = []
+    for npc_id in dialogue_pair:
+        lock = _npc_lock(npc_id)
+        try:
+            await lock.acquire()
+        except BaseException:
+            for held_lock in reversed(locks):
+                held_lock.release()
+            raise
+        locks.append(lock)
+
+    # Track this dialogue as active
+    active_dialogues_pending_completion[dialogue_pair] = active_dialogues_pending_completion.get(dialogue_pair, 0) + 1
+    handed_off = False
+    try:
+        # Final cooldown safeguard, checked under the locks so a second request for the same
+        # pair in this batch sees the cooldown the first one set.
+        # The primary cooldown check and the 50% initiation chance are handled in scheduler.py
+        # *before* a dialogue request is added.
+        if are_npcs_on_cooldown(npc_a_id, npc_b_id, current_sim_minutes_total):
+            print(f"  [ProcessQueueDB] Dialogue for {npc_a_name} & {npc_b_name} skipped: Cooldown (final check).")
+            return
 
-        # Dialogue proceeds if not on cooldown (checked above).
-        # The initial 50% chance to attempt dialogue is in scheduler.py.
         print(f"  Dialogue processing for {npc_a_name} and {npc_b_name}")
-        
-        # Track this dialogue as active
-        dialogue_pair = _get_canonical_npc_pair(npc_a_id, npc_b_id)
-        if dialogue_pair not in active_dialogues_pending_completion:
-            active_dialogues_pending_completion[dialogue_pair] = 0
-        active_dialogues_pending_completion[dialogue_pair] += 1
-        
-        dialogue_insert_payload = {'npc_a': npc_a_id, 'npc_b': npc_b_id, 'start_min': current_sim_minutes_total}
-        dialogue_response = await execute_supabase_query(lambda: supa.table('dialogue').insert(dialogue_insert_payload).execute())
-        
-        if not (dialogue_response and dialogue_response.data and len(dialogue_response.data) > 0):
-            print(f"    !!!! Failed to insert dialogue row for {npc_a_name} & {npc_b_name}.")
-            processed_indices.append(i) # Mark as processed
-            continue # Skip to next request
-        
-        # If we reach here, dialogue row was inserted successfully
-        dialogue_id = dialogue_response.data[0]['id']
-        print(f"    Dialogue row inserted, ID: {dialogue_id}")
-
-        mem_a = await retrieve_memories(npc_a_id, trigger_event, "dialogue", current_sim_minutes_total)
-        # mem_b = await retrieve_memories(npc_b_id, trigger_event, "dialogue", current_sim_minutes_total) # mem_b not used in current prompts
-        dialogue_system_template_A = get_dialogue_system_prompt()
-        dialogue_user_template_A = get_dialogue_user_prompt()
-
-        system_prompt_A = dialogue_system_template_A.format(npc_name=npc_a_name, traits=format_traits(npc_a_traits))
-        user_prompt_A = dialogue_user_template_A.format(
-            other_npc_name=npc_b_name,
-            other_npc_traits=format_traits(npc_b_traits),
-            area_name=area_name,
-            memories=mem_a
-        )
 
-        raw_dialogue_text = call_llm(system_prompt_A, user_prompt_A, max_tokens=600)
-
-        if raw_dialogue_text:
-            print(f"    Raw dialogue:\n{raw_dialogue_text}")
-            parsed_dialogue_turns = _parse_dialogue_from_llm(raw_dialogue_text, npc_a_name, npc_b_name)
-
-            if not parsed_dialogue_turns:
-                print(f"DIALOGUE: Could not parse dialogue between {npc_a_name} and {npc_b_name}. Raw text: {raw_dialogue_text}")
-                await broadcast_ws_message("dialogue_event", {"status": "failed_parsing", "npc_a_name": npc_a_name, "npc_b_name": npc_b_name})
-                # Don't try to decrement if it doesn't exist
-                dialogue_pair = _get_canonical_npc_pair(npc_a_id, npc_b_id)
-                if dialogue_pair in active_dialogues_pending_completion:
-                    active_dialogues_pending_completion[dialogue_pair] -= 1
-                    if active_dialogues_pending_completion[dialogue_pair] <= 0:
-                        del active_dialogues_pending_completion[dialogue_pair]
-                processed_indices.append(i)  # Mark as processed even if parsing failed
-                continue  # Skip to next dialogue instead of returning
-
-            # 4. Summarize Dialogue from perspective of NPC A
-            dialogue_summary_system_template_A = get_dialogue_summary_system_prompt()
-            dialogue_summary_user_template_A = get_dialogue_summary_user_prompt()
-            
-            summary_system_A = dialogue_summary_system_template_A # No formatting needed for this system prompt
-            summary_user_A = dialogue_summary_user_template_A.format(
-                npc_name=npc_a_name,
-                other_npc_name=npc_b_name,
-                dialogue_transcript="\n".join([f"{turn['speaker']}: {turn['line']}" for turn in parsed_dialogue_turns])
-            )
-            summary_A = call_llm(summary_system_A, summary_user_A, max_tokens=150)
-
-            # 5. Summarize Dialogue from perspective of NPC B
-            # Retrieve relevant memories for NPC B about NPC A and the trigger event
-            query_context_for_B = f"Thoughts about {npc_a_name} regarding: {trigger_event}"
-            # For B's summary, we don't need B's memories for generating the summary of a transcript they just participated in.
-            # The transcript itself is the context.
-            dialogue_summary_system_template_B = get_dialogue_summary_system_prompt()
-            dialogue_summary_user_template_B = get_dialogue_summary_user_prompt()
-
-            summary_system_B = dialogue_summary_system_template_B # No formatting needed
-            summary_user_B = dialogue_summary_user_template_B.format(
-                npc_name=npc_b_name,
-                other_npc_name=npc_a_name,
-                dialogue_transcript="\n".join([f"{turn['speaker']}: {turn['line']}" for turn in parsed_dialogue_turns])
-            )
-            summary_B = call_llm(summary_system_B, summary_user_B, max_tokens=150)
-
-            print(f"  DIALOGUE SUMMARY - {npc_a_name}: {summary_A}")
-
-            # If we reach here, dialogue row was inserted successfully
+        async with _dialogue_semaphore:
+            dialogue_insert_payload = {'npc_a': npc_a_id, 'npc_b': npc_b_id, 'start_min': current_sim_minutes_total}
+            dialogue_response = await execute_supabase_query(lambda: supa.table('dialogue').insert(dialogue_insert_payload).execute())
+
+            if not (dialogue_response and dialogue_response.data and len(dialogue_response.data) > 0):
+                print(f"    !!!! Failed to insert dialogue row for {npc_a_name} & {npc_b_name}.")
+                return
+
             dialogue_id = dialogue_response.data[0]['id']
-            print(f"    Dialogue ID {dialogue_id} ended and recorded.")
-
-            # --- Update Cooldown in DB ---
-            id1_canon, id2_canon = _get_canonical_npc_pair(npc_a_id, npc_b_id)
-            new_cooldown_until = current_sim_minutes_total + DIALOGUE_COOLDOWN_MINUTES
-            try:
-                await execute_supabase_query(
-                    lambda: supa.table('npc_dialogue_cooldowns')
-                    .upsert({'npc_id_1': id1_canon, 'npc_id_2': id2_canon, 'cooldown_until_sim_min': new_cooldown_until})
-                    .execute()
-                )
-                print(f"    NPCs {npc_a_name} & {npc_b_name} on dialogue cooldown until sim_min {new_cooldown_until} (DB updated).")
-            except Exception as e_db_cooldown_set:
-                print(f"    !!!! Failed to set dialogue cooldown in DB for {npc_a_name} & {npc_b_name}: {e_db_cooldown_set}")
-            # --- End Update Cooldown in DB ---
-
-            # Dialogue summary saving and broadcast logic as before
-            emb_a = await get_embedding(summary_A)
-            if emb_a:
-                mem_payload_a = {'npc_id': npc_a_id, 'sim_min': current_sim_minutes_total, 'kind': 'dialogue_summary', 'content': summary_A, 'importance': 3, 'embedding': emb_a, 'metadata': {'dialogue_id': dialogue_id, 'other_participant_name': npc_b_name}}
-                db_res_sum_a = await execute_supabase_query(lambda: supa.table('memory').insert(mem_payload_a).execute())
-                if db_res_sum_a.data: print(f"    Saved dialogue summary for {npc_a_name}"); await broadcast_ws_message("dialogue_event", {"npc_id": npc_a_id, "npc_name": npc_a_name, "other_participant_name": npc_b_name, "summary": summary_A, "dialogue_id": dialogue_id, "sim_min_of_day": current_sim_minutes_total % 1440, "day": (current_sim_minutes_total // 1440) + 1 })
-
-            emb_b = await get_embedding(summary_B)
-            if emb_b:
-                mem_payload_b = {'npc_id': npc_b_id, 'sim_min': current_sim_minutes_total, 'kind': 'dialogue_summary', 'content': summary_B, 'importance': 3, 'embedding': emb_b, 'metadata': {'dialogue_id': dialogue_id, 'other_participant_name': npc_a_name}}
-                db_res_sum_b = await execute_supabase_query(lambda: supa.table('memory').insert(mem_payload_b).execute())
-                if db_res_sum_b.data: print(f"    Saved dialogue summary for {npc_b_name}"); await broadcast_ws_message("dialogue_event", {"npc_id": npc_b_id, "npc_name": npc_b_name, "other_participant_name": npc_a_name, "summary": summary_B, "dialogue_id": dialogue_id, "sim_min_of_day": current_sim_minutes_total % 1440, "day": (current_sim_minutes_total // 1440) + 1 })
-            
-            # Trigger replanning for both NPCs based on dialogue summary
-            from .planning_and_reflection import run_replanning
-            # Construct new event_info for replanning after dialogue
-            event_info_a = {
-                "source": "dialogue",
-                "partner_name": npc_b_name,
-                "original_description": summary_A # The dialogue summary is the detailed description
-            }
-            await run_replanning(npc_a_id, event_info_a, current_sim_minutes_total)
-
-            event_info_b = {
-                "source": "dialogue",
-                "partner_name": npc_a_name,
-                "original_description": summary_B # The dialogue summary is the detailed description
-            }
-            await run_replanning(npc_b_id, event_info_b, current_sim_minutes_total)
-        else: # No raw_dialogue_text
-             print(f"    LLM call for dialogue between {npc_a_name} & {npc_b_name} returned no text.")
-        
-        # Clean up the active dialogue tracking
-        if dialogue_pair in active_dialogues_pending_completion:
-            active_dialogues_pending_completion[dialogue_pair] -= 1
-            if active_dialogues_pending_completion[dialogue_pair] <= 0:
-                del active_dialogues_pending_completion[dialogue_pair]
-        
-        processed_indices.append(i) # Mark as processed after successful handling or if LLM failed
-    
-    for index in sorted(processed_indices, reverse=True):
-        pending_dialogue_requests.pop(index)
+            print(f"    Dialogue row inserted, ID: {dialogue_id}")
+
+            mem_a = await retrieve_memories(npc_a_id, trigger_event, "dialogue", current_sim_minutes_total)
+            # mem_b = await retrieve_memories(npc_b_id, trigger_event, "dialogue", current_sim_minutes_total) # mem_b not used in current prompts
+
+            generated = None
+            if settings.DIALOGUE_MODE == DIALOGUE_MODE_JOINT:
+                generated = await _generate_dialogue_joint(request, mem_a, dialogue_id, current_sim_minutes_total)
+                if generated is None:
+                    print(f"    Joint dialogue generation failed for {npc_a_name} & {npc_b_name}; falling back to separate calls.")
+                    await broadcast_ws_message("dialogue_event", {"status": "restarted", "dialogue_id": dialogue_id, "npc_a_id": npc_a_id, "npc_b_id": npc_b_id, "npc_a_name": npc_a_name, "npc_b_name": npc_b_name})
+            if generated is None:
+                separate_turns = await _generate_dialogue_separate(request, mem_a, dialogue_id, current_sim_minutes_total)
+                if separate_turns is None:
+                    return
+                generated = (separate_turns, None, None)
+
+        # --- Update Cooldown (in memory now, written through to the DB in the background) ---
+        new_cooldown_until = current_sim_minutes_total + DIALOGUE_COOLDOWN_MINUTES
+        dialogue_cooldowns.set_cooldown(npc_a_id, npc_b_id, new_cooldown_until)
+        print(f"    NPCs {npc_a_name} & {npc_b_name} on dialogue cooldown until sim_min {new_cooldown_until}.")
+
+        task = asyncio.create_task(_finish_dialogue(request, dialogue_id, generated, current_sim_minutes_total, dialogue_pair, locks))
+        _background_dialogue_tasks.add(task)
+        task.add_done_callback(_background_dialogue_tasks.discard)
+        handed_off = True
+    finally:
+        if not handed_off:
+            _release_dialogue(dialogue_pair, locks)
+
+async def _finish_dialogue(
+    request: Dict[str, Any], dialogue_id: str, generated: Tuple[List[Dict[str, str]], Optional[str], Optional[str]],
+    current_sim_minutes_total: int, dialogue_pair: Tuple[str, str], locks: List[asyncio.Lock],
+) -> None:
+    """Background half of a dialogue.
+
+    Releases the participants' locks as soon as the transcript is persisted; summaries,
+    memories and replans run after that, so they don't hold the NPCs back from new encounters.
+    """
+    npc_a_id = request['npc_a_id']
+    npc_b_id = request['npc_b_id']
+    npc_a_name = request['npc_a_name']
+    npc_b_name = request['npc_b_name']
+    parsed_dialogue_turns, summary_A, summary_B = generated
+    released = False
+    summary_task = None
+    try:
+        # Make the summaries, if the generation did not already produce them, while the
+        # transcript is persisted (every turn in one multi-row insert, alongside the end time)
+        if summary_A is None or summary_B is None:
+            summary_task = asyncio.create_task(_summarize_dialogue(request, parsed_dialogue_turns))
+        try:
+            await _save_dialogue_turns(dialogue_id, parsed_dialogue_turns, {npc_a_name: npc_a_id, npc_b_name: npc_b_id}, current_sim_minutes_total)
+        finally:
+            _release_dialogue(dialogue_pair, locks)
+            released = True
+        if summary_task is not None:
+            summary_A, summary_B = await summary_task
+
+        print(f"  DIALOGUE SUMMARY - {npc_a_name}: {summary_A}")
+        print(f"    Dialogue ID {dialogue_id} ended and recorded.")
+
+        # Embed, save and broadcast both summaries in parallel; one failing doesn't stop the other or the replans
+        results = await asyncio.gather(
+            _save_dialogue_summary(npc_a_id, npc_a_name, npc_b_name, summary_A, dialogue_id, current_sim_minutes_total),
+            _save_dialogue_summary(npc_b_id, npc_b_name, npc_a_name, summary_B, dialogue_id, current_sim_minutes_total),
+            return_exceptions=True,
+        )
+        for npc_name, result in zip((npc_a_name, npc_b_name), results):
+            if isinstance(result, Exception):
+                print(f"DIALOGUE: Error saving dialogue summary for {npc_name} (dialogue {dialogue_id}): {result}")
+
+        # Trigger replanning for both NPCs based on their dialogue summary; the coordinator
+        # merges it with any other trigger for the same NPC in the debounce window
+        event_info_a = {
+            "source": "dialogue",
+            "partner_name": npc_b_name,
+            "original_description": summary_A # The dialogue summary is the detailed description
+        }
+        event_info_b = {
+            "source": "dialogue",
+            "partner_name": npc_a_name,
+            "original_description": summary_B # The dialogue summary is the detailed description
+        }
+        replan_coordinator.request_replan(npc_a_id, event_info_a, current_sim_minutes_total)
+        replan_coordinator.request_replan(npc_b_id, event_info_b, current_sim_minutes_total)
+    except Exception as e:
+        print(f"DIALOGUE: Error finishing dialogue {dialogue_id} for {npc_a_name} & {npc_b_name}: {e}")
+    finally:
+        if summary_task is not None and not summary_task.done():
+            summary_task.cancel()
+        if not released:
+            _release_dialogue(dialogue_pair, locks)
+
+async def flush_background_dialogues() -> None:
+    """Waits for dialogues still being post-processed, e.g. before shutdown."""
+    if _background_dialogue_tasks:
+        await asyncio.gather(*list(_background_dialogue_tasks), return_exceptions=True)
+
+async def process_pending_dialogues(current_sim_minutes_total: int) -> None:
+    """Starts the queued dialogues this tick's budget allows and triggers replanning when appropriate.
+
+    The highest-priority requests run concurrently, bounded by the LLM concurrency budget;
+    dialogues sharing an NPC are serialized by per-NPC locks. Requests over budget stay
+    queued for a later tick until they go stale.
+    """
+    if not len(dialogue_queue):
+        return
+
+    selected_requests, dropped_requests = dialogue_queue.take_for_tick(current_sim_minutes_total, are_npcs_on_cooldown)
+    print(f"DEBUG: Starting {len(selected_requests)} dialogues at tick {current_sim_minutes_total} ({len(dialogue_queue)} deferred, {len(dropped_requests)} dropped).")
+
+    results = await asyncio.gather(
+        *(_process_dialogue_request(request, current_sim_minutes_total) for request in selected_requests),
+        return_exceptions=True,
+    )
+    for request, result in zip(selected_requests, results):
+        if isinstance(result, Exception):
+            print(f"DIALOGUE: Error processing dialogue for {request['npc_a_name']} & {request['npc_b_name']}: {result}")
+
+    if settings.LEADER_LEASE_ENABLED:
+        await _delete_persisted_dialogue_requests(selected_requests + dropped_requests)
 
     return None
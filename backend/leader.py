@@ -0,0 +1,100 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from .config import get_settings
+from .pubsub import PROCESS_ID
+from .services import supa, execute_supabase_query
+
+LEADER_LEASE_NAME = "tick_loop"
+
+
+class LeaderLease:
+    """Lease row (see the sim_leader_lease migration) that lets exactly one replica tick.
+
+    Every replica runs the lease loop; the holder renews the lease every ttl/3 seconds
+    and the others retry at the same rate, so a dead leader is replaced within one TTL.
+    A holder that cannot renew steps down as soon as its local copy of the lease runs
+    out, before anyone else can acquire it.
+    """
+
+    def __init__(self, ttl_sec: float, holder: str = PROCESS_ID, name: str = LEADER_LEASE_NAME):
+        self.ttl_sec = ttl_sec
+        self.holder = holder
+        self.name = name
+        self._valid_until = 0.0  # monotonic time our lease is known to be held until
+        self._is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader and time.monotonic() < self._valid_until
+
+    async def _try_acquire(self) -> bool:
+        requested_at = time.monotonic()
+        try:
+            res = await execute_supabase_query(
+                lambda: supa.rpc(
+                    "try_acquire_leader_lease",
+                    {"p_name": self.name, "p_holder": self.holder, "p_ttl_seconds": self.ttl_sec},
+                ).execute()
+            )
+        except Exception as e:
+            print(f"LEADER: Error renewing lease '{self.name}': {e}")
+            return False
+        acquired = bool(res and res.data)
+        if acquired:
+            # Measured from before the request, so we never believe the lease lasts longer than the DB does
+            self._valid_until = requested_at + self.ttl_sec
+        else:
+            # Another replica holds the lease
+            self._valid_until = 0.0
+        return acquired
+
+    async def release(self):
+        if not self._is_leader:
+            return
+        self._is_leader = False
+        self._valid_until = 0.0
+        try:
+            await execute_supabase_query(
+                lambda: supa.rpc("release_leader_lease", {"p_name": self.name, "p_holder": self.holder}).execute()
+            )
+        except Exception as e:
+            print(f"LEADER: Error releasing lease '{self.name}': {e}")
+
+    async def run(
+        self,
+        on_acquired: Callable[[], Awaitable[None]],
+        on_lost: Callable[[], Awaitable[None]],
+    ):
+        renew_interval = max(self.ttl_sec / 3, 0.5)
+        while True:
+            acquired = await self._try_acquire()
+            if acquired and not self._is_leader:
+                self._is_leader = True
+                print(f"LEADER: {self.holder} acquired lease '{self.name}'.")
+                try:
+                    await on_acquired()
+                except Exception as e:
+                    print(f"LEADER: Error in on_acquired: {e}")
+            elif self._is_leader and not self.is_leader:
+                # Renewal failed long enough that another replica may now hold the lease
+                self._is_leader = False
+                print(f"LEADER: {self.holder} lost lease '{self.name}'.")
+                try:
+                    await on_lost()
+                except Exception as e:
+                    print(f"LEADER: Error in on_lost: {e}")
+            await asyncio.sleep(renew_interval)
+
+    def start(self, on_acquired: Callable[[], Awaitable[None]], on_lost: Callable[[], Awaitable[None]]):
+        self._task = asyncio.create_task(self.run(on_acquired, on_lost))
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        await self.release()
+
+
+leader_lease = LeaderLease(ttl_sec=get_settings().LEADER_LEASE_TTL_SEC)
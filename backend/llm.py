@@ -1,5 +1,6 @@
+import asyncio
 import openai
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List, Dict
 from .config import get_settings
 
 settings = get_settings()
@@ -10,10 +11,33 @@ client = openai.OpenAI(
     api_key=settings.OPENAI_API_KEY
 )
 
+# Client for the Batch API (files + batches); BATCH_API_BASE_URL points it at a
+# compatible stand-in server instead of OpenAI
+batch_client = openai.OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.BATCH_API_BASE_URL or None
+)
+
 # The OpenAI v1.x client's chat.completions.create is synchronous by default.
 
-def call_llm(system_prompt: str, user_prompt: str, max_tokens: int = 150, model: str = "gpt-4o-mini") -> Optional[str]:
-    """Calls the OpenAI ChatCompletion API and returns the content of the first choice."""
+def chat_completion_body(system_prompt: str, user_prompt: str, max_tokens: int = 150, model: str = "gpt-4o-mini", response_format: Optional[Dict] = None) -> Dict:
+    """Request body for one chat completion, shared by call_llm() and Batch API job lines."""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.7, # A common default, can be tuned
+        **({"response_format": response_format} if response_format else {}),
+    }
+
+def call_llm(system_prompt: str, user_prompt: str, max_tokens: int = 150, model: str = "gpt-4o-mini", response_format: Optional[Dict] = None) -> Optional[str]:
+    """Calls the OpenAI ChatCompletion API and returns the content of the first choice.
+
+    Pass response_format={"type": "json_object"} to have the model return a JSON object.
+    """
     # print(f"--- Calling LLM ---")
     # print(f"SYSTEM: {system_prompt}")
     # print(f"USER: {user_prompt}")
@@ -21,13 +45,7 @@ def call_llm(system_prompt: str, user_prompt: str, max_tokens: int = 150, model:
     # print(f"-------------------")
     try:
         completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7, # A common default, can be tuned
+            **chat_completion_body(system_prompt, user_prompt, max_tokens, model, response_format)
         )
         
         if completion.choices and len(completion.choices) > 0:
@@ -51,9 +69,44 @@ def call_llm(system_prompt: str, user_prompt: str, max_tokens: int = 150, model:
     
     return None
 
-# For asyncio compatibility if needed later (e.g. if retry_with_backoff is made async)
-# import asyncio
-# async def call_llm_async(...):
-#    loop = asyncio.get_event_loop()
-#    return await loop.run_in_executor(None, call_llm, ...)
+# Bounds how many completions run at once across the whole process
+_llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+
+async def call_llm_async(system_prompt: str, user_prompt: str, max_tokens: int = 150, model: str = "gpt-4o-mini", response_format: Optional[Dict] = None) -> Optional[str]:
+    """call_llm() on a worker thread, so concurrent callers don't block the event loop."""
+    async with _llm_semaphore:
+        return await asyncio.to_thread(call_llm, system_prompt, user_prompt, max_tokens, model, response_format)
+
+_STREAM_END = object()
+
+async def stream_llm(system_prompt: str, user_prompt: str, max_tokens: int = 150, model: str = "gpt-4o-mini", response_format: Optional[Dict] = None) -> AsyncIterator[str]:
+    """Streams a completion, yielding text deltas as they arrive.
+
+    The blocking SDK stream is consumed on a worker thread and handed over through a queue.
+    Errors are logged and end the stream early, like call_llm() returning None.
+    """
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def _consume_stream():
+        try:
+            stream = client.chat.completions.create(
+                **chat_completion_body(system_prompt, user_prompt, max_tokens, model, response_format),
+                stream=True,
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.choices[0].delta.content)
+        except Exception as e:
+            print(f"Error while streaming LLM completion: {type(e).__name__} - {e}")
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, _STREAM_END)
 
+    async with _llm_semaphore:
+        consumer = loop.run_in_executor(None, _consume_stream)
+        while True:
+            chunk = await chunks.get()
+            if chunk is _STREAM_END:
+                break
+            yield chunk
+        await consumer
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi import FastAPI, WebSocket, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware # Import CORS middleware
 from typing import List, Optional # Added for type hinting if needed, though not in playbook snippet
 import json
@@ -12,14 +12,30 @@ logging.getLogger("fastapi").setLevel(logging.WARNING)
 logging.getLogger("uvicorn").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.access").setLevel(logging.CRITICAL) # Higher level to silence completely
 
-from .models import SeedPayload, NPCUIDetailData, DialogueTranscriptResponse # ADD DialogueTranscriptResponse
+from .models import SeedPayload, NPCUIDetailData, DialogueTranscriptResponse, DialogueTranscriptsResponse # ADD DialogueTranscriptResponse
 from .services import (
-    insert_npcs, get_state, get_npc_ui_details,
-    get_dialogue_transcript, # ADD THIS IMPORT
+    insert_npcs, get_npc_ui_details,
     supa, execute_supabase_query # Make sure these are available from services
 )
 from . import scheduler # For scheduler.start_loop()
-from backend.websocket_utils import broadcast_ws_message # ADD THIS IMPORT
+from .config import get_settings
+from .catalog import catalog
+from .state_cache import state_cache
+from backend.websocket_utils import (
+    broadcast_ws_message, send_state_snapshot, handle_ws_client_message, get_ws_stats,
+    start_ws_bridge, stop_ws_bridge, broadcast_cache_invalidation, CACHE_CATALOG, CACHE_STATE, CACHE_COOLDOWNS,
+    broadcast_simulation_reset,
+)
+from .cooldowns import dialogue_cooldowns
+from .transcript_cache import transcript_cache, TRANSCRIPT_CACHE_CONTROL
+from .leader import leader_lease
+from .replan_coordinator import replan_coordinator
+from .reflection_tracker import reflection_tracker
+from .replan_gate import replan_gate
+from .batch_cognition import batch_cognition
+from .sim_calendar import sim_calendar
+from .planning_and_reflection import run_nightly_reflection
+from .dialogue_service import load_pending_dialogue_requests, dialogue_queue, flush_background_dialogues, clear_dialogue_requests
 from backend.api import prompt_routes # Import the new prompt router
 
 app = FastAPI(title='Artificial Citizens API')
@@ -49,15 +65,24 @@ async def seed(payload: SeedPayload):
     # For now, sticking to playbook .dict(), but this might need to change
     npcs_to_insert = [npc.dict() for npc in payload.npcs]
     insert_npcs(npcs_to_insert)
+    await broadcast_cache_invalidation([CACHE_CATALOG, CACHE_STATE, CACHE_COOLDOWNS])
     return {'status': 'seeded', 'count': len(payload.npcs)}
 
+@app.post('/catalog/reload')
+async def reload_catalog():
+    """Reloads action_def, area and object after definitions were edited outside the API."""
+    await broadcast_cache_invalidation([CACHE_CATALOG])
+    await catalog.load()
+    return {'status': 'reloaded', 'action_defs': len(catalog.action_defs), 'areas': len(catalog.areas), 'objects': len(catalog.objects)}
+
 @app.get('/state')
-async def state():
-    # The playbook does get_state().data, implying get_state() returns an object with a .data attribute
-    # My services.get_state() returns the data list directly or an empty list on error.
-    # Adjusting to match my services.get_state() return type.
-    data = await get_state()
-    return data # Return the list of NPCs directly
+async def state(request: Request):
+    # Served from the per-tick snapshot shared by all viewers; the ETag is a hash of its body
+    snapshot = await state_cache.get_snapshot()
+    headers = {'ETag': snapshot.etag, 'Cache-Control': 'no-cache'}
+    if snapshot.etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type='application/json', headers=headers)
 
 @app.post('/tick')
 async def manual_tick():
@@ -68,11 +93,21 @@ async def manual_tick():
 async def ws_endpoint(ws: WebSocket):
     # Connection setup - no logging
     await ws.accept()
-    scheduler.register_ws(ws)
+    # Framing and initial topics are negotiated at connect time: /ws?batch=1&encoding=msgpack&topics=clock,npc:<id>
+    topics_param = ws.query_params.get('topics')
+    # Queues the ws_config frame first; everything is sent by the client's writer task
+    scheduler.register_ws(
+        ws,
+        batch=ws.query_params.get('batch') in ('1', 'true'),
+        encoding=ws.query_params.get('encoding', 'json'),
+        topics=[topic.strip() for topic in topics_param.split(',') if topic.strip()] if topics_param else None,
+    )
     try:
+        # Full state first; per-tick state_delta messages follow
+        await send_state_snapshot(ws)
         while True:
-            # Wait for messages (not expected in this app but handling anyway)
-            await ws.receive_text()
+            # Client control messages, e.g. {"type": "resync"} after a seq gap
+            await handle_ws_client_message(ws, await ws.receive_text())
     except Exception as e:
         # Only log critical WebSocket errors
         if not isinstance(e, (WebSocketDisconnect := type('WebSocketDisconnect', (), {}), ConnectionClosed := type('ConnectionClosed', (), {}))):
@@ -80,6 +115,37 @@ async def ws_endpoint(ws: WebSocket):
     finally:
         scheduler.unregister_ws(ws)
 
+@app.get('/dialogue_queue/stats')
+async def dialogue_queue_stats():
+    """Pending dialogue requests plus started/deferred/dropped counters."""
+    return dialogue_queue.stats()
+
+@app.get('/replan/stats')
+async def replan_stats():
+    """Replan triggers received vs. replans actually run after per-NPC merging."""
+    return {**replan_coordinator.stats(), "gate": replan_gate.stats()}
+
+@app.get('/reflection/stats')
+async def reflection_stats():
+    """Reflection mode, per-NPC high-water marks and incremental reflections run."""
+    return reflection_tracker.stats()
+
+@app.get('/sim_calendar/stats')
+async def sim_calendar_stats():
+    """Calendar jobs run/failed and occurrences skipped as already claimed."""
+    return sim_calendar.stats()
+
+@app.get('/batch_cognition/stats')
+async def batch_cognition_stats():
+    """Batch jobs submitted/failed, results applied and NPCs that fell back to inline calls."""
+    return batch_cognition.stats()
+
+@app.get('/ws_stats')
+async def ws_stats():
+    """Per-client WebSocket send queue depth, sent and dropped message counts."""
+    clients = get_ws_stats()
+    return {'client_count': len(clients), 'clients': clients}
+
 @app.get("/test_planning")
 async def test_planning_endpoint():
     print("TEST ENDPOINT: /test_planning called")
@@ -106,7 +172,7 @@ async def test_reflection_endpoint():
     sim_time_for_reflection_context = current_time_data.get('sim_min', 1439) # Use current time as context
 
     print(f"Triggering run_nightly_reflection for Day {day_to_reflect_on} using context time {sim_time_for_reflection_context}")
-    await scheduler.run_nightly_reflection(day_to_reflect_on, sim_time_for_reflection_context)
+    await run_nightly_reflection(day_to_reflect_on, sim_time_for_reflection_context)
     return {"status": "nightly reflection test triggered", "day": day_to_reflect_on}
 
 @app.get('/npc_details/{npc_id}')
@@ -123,19 +189,47 @@ async def get_npc_details(npc_id: str):
         raise HTTPException(status_code=404, detail=f"NPC with ID {npc_id} not found or details unavailable")
     return npc_details
 
+MAX_TRANSCRIPTS_PER_REQUEST = 50
+
+@app.get("/api/v1/dialogues/transcripts", response_model=DialogueTranscriptsResponse)
+async def get_dialogue_transcripts_batch(ids: str):
+    """Transcripts of several dialogues (comma-separated ids) in one request; misses share one DB query."""
+    dialogue_ids = [dialogue_id.strip() for dialogue_id in ids.split(',') if dialogue_id.strip()]
+    if len(dialogue_ids) > MAX_TRANSCRIPTS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TRANSCRIPTS_PER_REQUEST} dialogue ids per request")
+    transcripts = await transcript_cache.get_many(dialogue_ids)
+    if transcripts is None:
+        raise HTTPException(status_code=500, detail="Error fetching dialogue transcripts")
+    return DialogueTranscriptsResponse(transcripts=[
+        DialogueTranscriptResponse(dialogue_id=dialogue_id, turns=turns) for dialogue_id, turns in transcripts.items()
+    ])
+
 @app.get("/api/v1/dialogues/{dialogue_id}/transcript", response_model=DialogueTranscriptResponse)
-async def get_full_dialogue_transcript(dialogue_id: str):
-    """Endpoint to get the full transcript of a specific dialogue session."""
-    transcript_turns = await get_dialogue_transcript(dialogue_id)
-    if transcript_turns is None: # Check for None, which indicates an error in service layer
-        raise HTTPException(status_code=500, detail=f"Error fetching transcript for dialogue ID {dialogue_id}")
-    if not transcript_turns: # Empty list means dialogue found but no turns, or dialogue not found
-        # Distinguish between dialogue not found vs dialogue with no turns based on service layer logic if needed
-        # For now, if service returns empty list, assume it means no content to show.
-        # To be more precise, get_dialogue_transcript could raise specific errors.
-        pass # Allow returning empty list of turns if dialogue existed but had no turns processed for some reason
-
-    return DialogueTranscriptResponse(dialogue_id=dialogue_id, turns=transcript_turns)
+async def get_full_dialogue_transcript(dialogue_id: str, request: Request):
+    """Endpoint to get the full transcript of a specific dialogue session.
+
+    Finished transcripts never change: they are served from the transcript cache with a
+    strong ETag and an immutable Cache-Control header.
+    """
+    entry = transcript_cache.get(dialogue_id)
+    if entry is None:
+        transcripts = await transcript_cache.get_many([dialogue_id])
+        if transcripts is None: # None indicates an error in service layer
+            raise HTTPException(status_code=500, detail=f"Error fetching transcript for dialogue ID {dialogue_id}")
+        entry = transcript_cache.get(dialogue_id)
+    if entry is None:
+        # Dialogue not found or no turns written yet - not final, so not cacheable
+        return Response(
+            content=json.dumps({'dialogue_id': dialogue_id, 'turns': []}),
+            media_type='application/json',
+            headers={'Cache-Control': 'no-cache'},
+        )
+
+    headers = {'ETag': entry.etag, 'Cache-Control': TRANSCRIPT_CACHE_CONTROL}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and entry.etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type='application/json', headers=headers)
 
 @app.post("/reset_simulation_to_end_of_day1") # Changed to POST as it modifies state
 async def reset_sim_day1_end():
@@ -163,11 +257,22 @@ async def reset_sim_day1_end():
         
         # Clear current_action_id for all NPCs to prevent stale references after reset
         await execute_supabase_query(lambda: supa.table('npc').update({'current_action_id': None}).neq('id', '00000000-0000-0000-0000-000000000000').execute())
+
+        # Scheduled jobs after the new clock time have to run again
+        reset_from_sim_min = (day_to_set - 1) * 24 * 60 + sim_min_to_set + 1
+        await sim_calendar.reset(reset_from_sim_min)
+        # Queued encounters and replans refer to the old clock
+        await clear_dialogue_requests()
+        await replan_coordinator.clear_persisted()
+        # Every replica drops its calendar claims, reflection marks (reflect memories are
+        # gone), dialogue/replan queues and night pipelines
+        await broadcast_simulation_reset(reset_from_sim_min)
         
         # Log what we're preserving for clarity
         print(f"Simulation reset: Day set to {day_to_set}, SimMin set to {sim_min_to_set}")
         print("Note: Completed actions (status='done') are preserved for history")
         
+        await broadcast_cache_invalidation([CACHE_STATE])
         # Optional: Force an immediate state broadcast
         await broadcast_ws_message("tick_update", {'new_sim_min': sim_min_to_set, 'new_day': day_to_set})
 
@@ -197,6 +302,8 @@ async def trigger_seed_script():
         # It helps with complex commands like cd && ...
         process = subprocess.Popen(command_to_run, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=project_root)
         stdout, stderr = process.communicate(timeout=60) # Add a timeout
+        # The seed script rewrites areas, objects and action defs (and the NPCs cooldowns refer to)
+        await broadcast_cache_invalidation([CACHE_CATALOG, CACHE_STATE, CACHE_COOLDOWNS])
         
         if process.returncode == 0:
             print("Seed script executed successfully.")
@@ -317,7 +424,6 @@ Add appropriate emoji if relevant."""
                             await execute_supabase_query(lambda: supa.table('memory').insert(mem_payload).execute())
                             affected_npcs.append(npc_id)
 
-            from .planning_and_reflection import run_replanning
             for npc_id in affected_npcs:
                 event_info = {
                     "source": "user_event",
@@ -327,7 +433,7 @@ Add appropriate emoji if relevant."""
                     "user_event_type": "general_user_event", 
                     "original_description": final_message 
                 }
-                await run_replanning(npc_id, event_info, current_sim_minutes_total)
+                replan_coordinator.request_replan(npc_id, event_info, current_sim_minutes_total)
             
             return {
                 "status": "success",
@@ -384,8 +490,50 @@ async def set_simulation_speed(payload: SpeedPayload):
 # Ensure scheduler loop is started when the app starts
 @app.on_event("startup")
 async def startup_event():
+    await catalog.load()
+    await dialogue_cooldowns.load()
+    await start_ws_bridge()
+    settings = get_settings()
+    if not settings.RUN_SCHEDULER:
+        print("STARTUP: RUN_SCHEDULER is off - serving API/WebSocket traffic only.")
+    elif settings.LEADER_LEASE_ENABLED:
+        # Every replica competes for the lease; only the holder runs the tick loop
+        leader_lease.start(on_acquired=_on_leader_acquired, on_lost=_on_leader_lost)
+    else:
+        scheduler.start_loop()
+
+async def _on_leader_acquired():
+    # Another replica may have ticked, reseeded or edited definitions since we last looked
+    catalog.invalidate()
+    state_cache.invalidate()
+    dialogue_cooldowns.invalidate()
+    # Rebuild the tick-side state the previous leader held in memory
+    sim_calendar.recover()
+    reflection_tracker.reset()
+    queued = await load_pending_dialogue_requests()
+    replans = await replan_coordinator.load_pending()
+    if get_settings().COGNITION_MODE == scheduler.COGNITION_MODE_BATCH:
+        time_data = await scheduler.get_current_sim_time_and_day()
+        batch_cognition.resume_night((time_data["day"] - 1) * scheduler.SIM_DAY_MINUTES + time_data["sim_min"])
+    print(f"STARTUP: Leader lease acquired - resuming {queued} queued dialogue requests and {replans} replan requests, starting the tick loop.")
     scheduler.start_loop()
 
+async def _on_leader_lost():
+    # The loop checks the lease before every tick and exits on its own; never cancel mid-tick
+    print("Leader lease lost - the tick loop will stop before its next tick.")
+    # The new leader resumes the persisted pending replans
+    replan_coordinator.reset()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await flush_background_dialogues()
+    await replan_coordinator.flush()
+    await reflection_tracker.flush()
+    await dialogue_cooldowns.flush()
+    if get_settings().LEADER_LEASE_ENABLED:
+        await leader_lease.stop()
+    await stop_ws_bridge()
+
 @app.get('/debug_memory_types/{npc_id}')
 async def debug_memory_types(npc_id: str):
     """Debugging endpoint to check if reflect and plan memories exist in the database."""
@@ -44,12 +44,32 @@ async def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> Optional[Lis
         print(f"Error getting embedding for text '{text[:50]}...': {e}")
         return None
 
+async def get_embeddings(texts: List[str], model: str = EMBEDDING_MODEL) -> List[Optional[List[float]]]:
+    """Embeds several texts with one request; identical texts are embedded once."""
+    unique_texts = list(dict.fromkeys(text.strip() for text in texts))
+    if not unique_texts:
+        return []
+    try:
+        response = await asyncio.to_thread(
+            openai_client.embeddings.create,
+            input=unique_texts,
+            model=model
+        )
+        by_text = {unique_texts[item.index]: item.embedding for item in response.data}
+    except Exception as e:
+        print(f"Error getting embeddings for {len(unique_texts)} texts: {e}")
+        return [None] * len(texts)
+    return [by_text.get(text.strip()) for text in texts]
+
 async def retrieve_memories(
     npc_id: str,
     query_text: str,
     query_type: Literal["planning", "reflection", "dialogue"],
-    current_sim_time_minutes: int
+    current_sim_time_minutes: int,
+    before_sim_min: Optional[int] = None,
+    top_k: int = TOP_K_MEMORIES
 ) -> str:
+    """Top-scored memories for a query as one string; before_sim_min limits them to older ones."""
     weights = QUERY_WEIGHTS.get(query_type)
     if not weights:
         # Simplified log message
@@ -57,9 +77,10 @@ async def retrieve_memories(
     w_recency, w_importance, w_similarity = weights
 
     try:
-        memories_response_obj = await execute_supabase_query(lambda: supa.table("memory")
-            .select("id, npc_id, sim_min, kind, content, importance, embedding")
-            .eq("npc_id", npc_id)
+        query = supa.table("memory").select("id, npc_id, sim_min, kind, content, importance, embedding").eq("npc_id", npc_id)
+        if before_sim_min is not None:
+            query = query.lte("sim_min", before_sim_min)
+        memories_response_obj = await execute_supabase_query(lambda: query
             .order("sim_min", desc=True)
             .limit(MAX_MEMORIES_TO_FETCH)
             .execute())
@@ -113,7 +134,7 @@ async def retrieve_memories(
         )
         scored_memories.append({"content": mem['content'], "score": total_score, "sim_min": mem['sim_min'], "kind": mem['kind']})
     
-    top_memories = sorted(scored_memories, key=lambda x: x["score"], reverse=True)[:TOP_K_MEMORIES]
+    top_memories = sorted(scored_memories, key=lambda x: x["score"], reverse=True)[:top_k]
     
     formatted_memory_strings = [f"{mem_item['content']}" for mem_item in top_memories]
 
@@ -55,4 +55,7 @@ class DialogueTurnResponse(BaseModel):
 class DialogueTranscriptResponse(BaseModel):
     dialogue_id: str
     turns: List[DialogueTurnResponse]
+
+class DialogueTranscriptsResponse(BaseModel):
+    transcripts: List[DialogueTranscriptResponse]
 # --- END DIALOGUE TRANSCRIPT MODELS ---
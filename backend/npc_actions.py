@@ -2,8 +2,9 @@ import random
 from typing import List, Dict
 
 from .services import supa, execute_supabase_query
-from .memory_service import get_embedding
+from .memory_service import get_embedding, get_embeddings
 from .websocket_utils import broadcast_ws_message
+from .catalog import catalog
 
 # Local constants replicated from scheduler
 SIM_DAY_MINUTES = 24 * 60
@@ -23,13 +24,7 @@ async def update_npc_actions_and_state(
     if not all_npcs_data:
         return
 
-    action_defs_res = await execute_supabase_query(
-        lambda: supa.table("action_def").select("id, title, emoji").execute()
-    )
-    action_defs_map = {
-        ad["id"]: {"title": ad["title"], "emoji": ad["emoji"]}
-        for ad in (action_defs_res.data or [])
-    }
+    await catalog.ensure_loaded()
 
     for npc_snapshot in all_npcs_data:
         npc_id = npc_snapshot["id"]
@@ -126,11 +121,9 @@ async def update_npc_actions_and_state(
                 new_action_instance_id = next_action_to_start["id"]
                 new_action_def_id = next_action_to_start.get("def_id")
                 object_id_for_new_action = next_action_to_start.get("object_id")
-                action_details = action_defs_map.get(
-                    new_action_def_id, {"title": "Unknown Action", "emoji": "❓"}
-                )
-                action_title_log = action_details["title"]
-                action_emoji_log = action_details["emoji"]
+                action_details = catalog.action_def(new_action_def_id) or {}
+                action_title_log = action_details.get("title", "Unknown Action")
+                action_emoji_log = action_details.get("emoji", "❓")
 
                 await execute_supabase_query(
                     lambda: supa.table("action_instance")
@@ -143,15 +136,8 @@ async def update_npc_actions_and_state(
                 action_moved_npc = False
 
                 if object_id_for_new_action:
-                    obj_res = await execute_supabase_query(
-                        lambda: supa.table("object")
-                        .select("area_id, name")
-                        .eq("id", object_id_for_new_action)
-                        .maybe_single()
-                        .execute()
-                    )
-                    if obj_res and obj_res.data and obj_res.data.get("area_id"):
-                        obj_data = obj_res.data
+                    obj_data = catalog.object(object_id_for_new_action)
+                    if obj_data and obj_data.get("area_id"):
                         target_area_id_for_action = obj_data["area_id"]
 
                         effective_movable_width = (
@@ -213,6 +199,7 @@ async def update_npc_actions_and_state(
                 await broadcast_ws_message(
                     "action_start",
                     {
+                        "npc_id": npc_id,
                         "npc_name": npc_name,
                         "action_title": action_title_log,
                         "emoji": action_emoji_log,
@@ -301,30 +288,11 @@ async def create_area_change_observations(
 ):
     """Create observation memories when NPCs change areas or notice others in their area."""
     try:
-        from_area_name = "an area"
-        to_area_name = "an area"
-
         sim_min_of_day = current_sim_minutes_total % SIM_DAY_MINUTES
 
-        area_res_from = await execute_supabase_query(
-            lambda: supa.table("area")
-            .select("name")
-            .eq("id", from_area_id)
-            .maybe_single()
-            .execute()
-        )
-        if area_res_from and area_res_from.data:
-            from_area_name = area_res_from.data.get("name", "an area")
-
-        area_res_to = await execute_supabase_query(
-            lambda: supa.table("area")
-            .select("name")
-            .eq("id", to_area_id)
-            .maybe_single()
-            .execute()
-        )
-        if area_res_to and area_res_to.data:
-            to_area_name = area_res_to.data.get("name", "an area")
+        await catalog.ensure_loaded()
+        from_area_name = catalog.area_name(from_area_id, "an area")
+        to_area_name = catalog.area_name(to_area_id, "an area")
 
         npcs_in_new_area = [
             npc
@@ -452,126 +420,116 @@ async def create_area_change_observations(
         print(f"Error creating area change observations or broadcasting: {e}")
 
 
+PLAN_ADHERENCE_WINDOW_MIN = 60  # A planned action counts as scheduled now if it starts within this many minutes
+
+
+def _action_title(instance, default):
+    action_def = catalog.action_def(instance.get("def_id")) if instance else None
+    return (action_def or {}).get("title", default)
+
+
+def _plan_adherence_observation(time_label, current_min_of_day, current_action_id, plan_action_ids, instances_by_id):
+    """(content, importance) of one NPC's adherence observation, from already-loaded rows."""
+    if not plan_action_ids:
+        return f"[Periodic] At {time_label}, I realized I don't have a plan for today.", 2
+
+    time_window_start = max(0, current_min_of_day - PLAN_ADHERENCE_WINDOW_MIN)
+    time_window_end = min(SIM_DAY_MINUTES - 1, current_min_of_day + PLAN_ADHERENCE_WINDOW_MIN)
+    scheduled = sorted(
+        (
+            instances_by_id[action_id]
+            for action_id in plan_action_ids
+            if action_id in instances_by_id
+            and time_window_start <= (instances_by_id[action_id].get("start_min") or 0) <= time_window_end
+        ),
+        key=lambda instance: instance.get("start_min") or 0,
+    )
+    current_action = instances_by_id.get(current_action_id) if current_action_id else None
+
+    if not scheduled:
+        if not current_action_id:
+            return f"[Periodic] At {time_label}, I had nothing scheduled and was idle as expected.", 1
+        if current_action:
+            actual_action_title = _action_title(current_action, "something unplanned")
+            return f"[Periodic] At {time_label}, I was doing {actual_action_title} which wasn't part of my original plan.", 2
+        return f"[Periodic] At {time_label}, I was doing something unplanned.", 2
+
+    scheduled_action = scheduled[0]
+    current_action_title = _action_title(scheduled_action, "an activity")
+    if current_action_id and current_action_id == scheduled_action.get("id"):
+        return f"[Periodic] At {time_label}, I was following my plan by doing {current_action_title}.", 1
+    if current_action_id:
+        if current_action:
+            actual_action_title = _action_title(current_action, "something different")
+            return f"[Periodic] At {time_label}, I was supposed to be {current_action_title} according to my plan, but instead I was doing {actual_action_title}.", 3
+        return f"[Periodic] At {time_label}, I was supposed to be {current_action_title}, but I was doing something else.", 3
+    return f"[Periodic] At {time_label}, I was supposed to be {current_action_title}, but I wasn't doing anything.", 3
+
+
 async def create_plan_adherence_observations(
     all_npcs_data, current_sim_minutes_total, current_day, current_min_of_day
 ):
-    """Create observations about whether NPCs are following their plans or have unexpected deviations."""
+    """Create observations about whether NPCs are following their plans or have unexpected deviations.
+
+    Runs in a fixed number of round trips whatever the NPC count: one query for the
+    day's plans, one for their action instances and the current actions, one embedding
+    request and one memory insert.
+    """
+    if not all_npcs_data:
+        return
     try:
+        await catalog.ensure_loaded()
         time_label = "noon" if current_min_of_day == 720 else "midnight"
 
-        for npc in all_npcs_data:
-            npc_id = npc.get("id")
-            npc_name = npc.get("name", "Unknown")
-            current_action_id = npc.get("current_action_id")
+        plans_res = await execute_supabase_query(
+            lambda: supa.table("plan").select("npc_id, actions").eq("sim_day", current_day).execute()
+        )
+        plan_action_ids_by_npc = {
+            row["npc_id"]: row.get("actions") or [] for row in ((plans_res.data if plans_res else None) or [])
+        }
 
-            plan_res = await execute_supabase_query(
-                lambda: supa.table("plan")
-                .select("actions")
-                .eq("npc_id", npc_id)
-                .eq("sim_day", current_day)
-                .maybe_single()
+        action_ids = {npc.get("current_action_id") for npc in all_npcs_data if npc.get("current_action_id")}
+        for npc in all_npcs_data:
+            action_ids.update(plan_action_ids_by_npc.get(npc.get("id"), []))
+        instances_by_id = {}
+        if action_ids:
+            instances_res = await execute_supabase_query(
+                lambda: supa.table("action_instance")
+                .select("id, def_id, start_min, status")
+                .in_("id", list(action_ids))
                 .execute()
             )
-
-            if not (plan_res and plan_res.data and plan_res.data.get("actions")):
-                observation_content = f"[Periodic] At {time_label}, I realized I don't have a plan for today."
-                importance = 2
-            else:
-                plan_action_ids = plan_res.data.get("actions", [])
-                current_action_title = "nothing scheduled"
-                scheduled_action_found = False
-
-                if plan_action_ids:
-                    time_window_start = max(0, current_min_of_day - 60)
-                    time_window_end = min(1439, current_min_of_day + 60)
-                    scheduled_actions_res = await execute_supabase_query(
-                        lambda: supa.table("action_instance")
-                        .select("id, def_id(title), start_min, status")
-                        .in_("id", plan_action_ids)
-                        .gte("start_min", time_window_start)
-                        .lte("start_min", time_window_end)
-                        .order("start_min")
-                        .execute()
-                    )
-
-                    if scheduled_actions_res and scheduled_actions_res.data:
-                        scheduled_action = None
-                        for action in scheduled_actions_res.data:
-                            if (
-                                abs(action.get("start_min", 0) - current_min_of_day)
-                                <= 60
-                            ):
-                                scheduled_action = action
-                                break
-
-                        if scheduled_action:
-                            scheduled_action_found = True
-                            current_action_title = scheduled_action.get(
-                                "def_id", {}
-                            ).get("title", "an activity")
-                            scheduled_action_id = scheduled_action.get("id")
-                            scheduled_action_status = scheduled_action.get(
-                                "status", "unknown"
-                            )
-
-                if not scheduled_action_found:
-                    if current_action_id:
-                        action_res = await execute_supabase_query(
-                            lambda: supa.table("action_instance")
-                            .select("def_id(title)")
-                            .eq("id", current_action_id)
-                            .maybe_single()
-                            .execute()
-                        )
-                        if action_res and action_res.data:
-                            actual_action_title = action_res.data.get("def_id", {}).get(
-                                "title", "something unplanned"
-                            )
-                            observation_content = f"[Periodic] At {time_label}, I was doing {actual_action_title} which wasn't part of my original plan."
-                            importance = 2
-                        else:
-                            observation_content = f"[Periodic] At {time_label}, I was doing something unplanned."
-                            importance = 2
-                    else:
-                        observation_content = f"[Periodic] At {time_label}, I had nothing scheduled and was idle as expected."
-                        importance = 1
-                else:
-                    if current_action_id and current_action_id == scheduled_action_id:
-                        observation_content = f"[Periodic] At {time_label}, I was following my plan by doing {current_action_title}."
-                        importance = 1
-                    elif current_action_id:
-                        action_res = await execute_supabase_query(
-                            lambda: supa.table("action_instance")
-                            .select("def_id(title)")
-                            .eq("id", current_action_id)
-                            .maybe_single()
-                            .execute()
-                        )
-                        if action_res and action_res.data:
-                            actual_action_title = action_res.data.get("def_id", {}).get(
-                                "title", "something different"
-                            )
-                            observation_content = f"[Periodic] At {time_label}, I was supposed to be {current_action_title} according to my plan, but instead I was doing {actual_action_title}."
-                            importance = 3
-                        else:
-                            observation_content = f"[Periodic] At {time_label}, I was supposed to be {current_action_title}, but I was doing something else."
-                            importance = 3
-                    else:
-                        observation_content = f"[Periodic] At {time_label}, I was supposed to be {current_action_title}, but I wasn't doing anything."
-                        importance = 3
-
-            observation_embedding = await get_embedding(observation_content)
-            if observation_embedding:
-                mem_payload = {
-                    "npc_id": npc_id,
-                    "sim_min": current_sim_minutes_total,
-                    "kind": "obs",
-                    "content": observation_content,
-                    "importance": importance,
-                    "embedding": observation_embedding,
-                }
-                await execute_supabase_query(
-                    lambda: supa.table("memory").insert(mem_payload).execute()
-                )
+            instances_by_id = {row["id"]: row for row in ((instances_res.data if instances_res else None) or [])}
+
+        observations = [
+            (
+                npc.get("id"),
+                *_plan_adherence_observation(
+                    time_label,
+                    current_min_of_day,
+                    npc.get("current_action_id"),
+                    plan_action_ids_by_npc.get(npc.get("id"), []),
+                    instances_by_id,
+                ),
+            )
+            for npc in all_npcs_data
+        ]
+        embeddings = await get_embeddings([content for _, content, _ in observations])
+        mem_payloads = [
+            {
+                "npc_id": npc_id,
+                "sim_min": current_sim_minutes_total,
+                "kind": "obs",
+                "content": content,
+                "importance": importance,
+                "embedding": embedding,
+            }
+            for (npc_id, content, importance), embedding in zip(observations, embeddings)
+            if embedding
+        ]
+        if mem_payloads:
+            await execute_supabase_query(
+                lambda: supa.table("memory").insert(mem_payloads).execute()
+            )
     except Exception as e:
         print(f"Error creating plan adherence observations: {e}")
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional
+
+from postgrest.exceptions import APIError
+
+from .services import supa, execute_supabase_query, bulk_insert
+
+# PostgREST's "function not found" code: the create_plan_with_actions migration is not applied
+PGRST_FUNCTION_NOT_FOUND = "PGRST202"
+
+
+class PlanStore:
+    """Writes plans with their action instances in O(1) round trips.
+
+    Prefers the create_plan_with_actions / apply_plan_diff RPCs, which write
+    everything in one transaction. If the migration is missing it falls back to one
+    multi-row action_instance insert followed by the plan write, and stops trying the
+    RPCs for the rest of the process.
+    """
+
+    def __init__(self):
+        self._rpc_available = True
+
+    async def _rpc(self, name: str, params: Dict[str, Any]) -> Optional[List[Any]]:
+        """Runs a plan RPC. Returns the new action ids, or None if the caller should fall back."""
+        if not self._rpc_available:
+            return None
+        try:
+            res = await execute_supabase_query(lambda: supa.rpc(name, params).execute())
+        except APIError as e:
+            if str(e.code) == PGRST_FUNCTION_NOT_FOUND:
+                print(f"PLAN_STORE: RPC '{name}' not found; using multi-row inserts from now on.")
+                self._rpc_available = False
+            else:
+                print(f"PLAN_STORE: RPC '{name}' failed ({e.code}): {e.message}. Falling back to multi-row insert.")
+            return None
+        return list((res.data if res else None) or [])
+
+    async def _insert_actions(self, action_rows: List[Dict[str, Any]]) -> List[Any]:
+        inserted = await bulk_insert('action_instance', action_rows)
+        return [row.get('id') for row in inserted if row.get('id')]
+
+    async def create_plan(self, npc_id: str, sim_day: int, action_rows: List[Dict[str, Any]]) -> Optional[List[Any]]:
+        """Inserts a day's action instances and the plan row listing them. Returns the new action ids."""
+        action_ids = await self._rpc('create_plan_with_actions', {'p_npc_id': npc_id, 'p_sim_day': sim_day, 'p_actions': action_rows})
+        if action_ids is not None:
+            return action_ids
+        action_ids = await self._insert_actions(action_rows)
+        if not action_ids:
+            return None
+        plan_data = {'npc_id': npc_id, 'sim_day': sim_day, 'actions': action_ids}
+        await execute_supabase_query(lambda: supa.table('plan').insert(plan_data).execute())
+        return action_ids
+
+    async def apply_diff(
+        self, plan_id: str, plan_action_ids: List[Any], delete_action_ids: List[Any],
+        update_rows: List[Dict[str, Any]], insert_rows: List[Dict[str, Any]],
+    ) -> Optional[List[Any]]:
+        """Applies a replan diff: updates changed instances in place, inserts new ones, deletes
+        removed ones and sets the plan to plan_action_ids + the new ids. Returns the new ids."""
+        if not (delete_action_ids or update_rows or insert_rows):
+            return []  # Same schedule as before; nothing to write
+        action_ids = await self._rpc('apply_plan_diff', {
+            'p_plan_id': plan_id, 'p_plan_action_ids': plan_action_ids, 'p_delete_action_ids': delete_action_ids,
+            'p_update_actions': update_rows, 'p_insert_actions': insert_rows,
+        })
+        if action_ids is not None:
+            return action_ids
+        action_ids = []
+        if insert_rows:
+            action_ids = await self._insert_actions(insert_rows)
+            if not action_ids:
+                return None
+        if update_rows:
+            # One upsert on id updates every changed row
+            await execute_supabase_query(lambda: supa.table('action_instance').upsert(update_rows).execute())
+        if delete_action_ids:
+            await execute_supabase_query(lambda: supa.table('action_instance').delete().in_('id', delete_action_ids).execute())
+        updated_ids = plan_action_ids + action_ids
+        await execute_supabase_query(lambda: supa.table('plan').update({'actions': updated_ids}).eq('id', plan_id).execute())
+        return action_ids
+
+plan_store = PlanStore()
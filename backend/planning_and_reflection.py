@@ -1,25 +1,46 @@
 import asyncio
+import json
 import re
+import time
 import traceback
-from typing import List, Dict, Optional, Any # Added Any for supa functions if not more specific types are available
+from typing import List, Dict, Optional, Any, Set, Tuple # Added Any for supa functions if not more specific types are available
 
 # Imports from the 'backend' package
-from .llm import call_llm
+from .config import get_settings
+from .llm import call_llm_async
 from .prompts import (
     get_plan_system_prompt, get_plan_user_prompt,
-    get_reflection_system_prompt, get_reflection_user_prompt, format_traits
+    get_reflection_system_prompt, get_reflection_user_prompt, format_traits,
+    get_plan_batch_system_prompt, get_plan_batch_user_prompt
 )
 from .memory_service import retrieve_memories, get_embedding
 from .services import supa, execute_supabase_query # supa is used directly
 from .websocket_utils import broadcast_ws_message # Import from the new utils file
+from .catalog import catalog
+from .plan_store import plan_store
+from .replan_gate import replan_gate, GATE_ASK, GATE_REPLAN, GATE_SKIP
+from .reflection_tracker import reflection_tracker, EXPERIENCE_MEMORY_KINDS
+
+settings = get_settings()
 
 SIM_DAY_MINUTES = 24 * 60
 
+PLANNING_MODE_BATCHED = "batched"
+PLAN_BATCH_TOKENS_PER_NPC = 250
+PLAN_MAX_TOKENS = 400
+REFLECTION_MODEL = "gpt-4o"
+REFLECTION_MAX_TOKENS = 500 # Increased max_tokens for richer reflection
+REFLECTION_MAX_NEW_MEMORIES = 50
+REFLECTION_QUERY_MEMORIES = 5  # Most important new experiences used to look up related older memories
+
+# NPCs planned at once during the daily planning window
+_planning_semaphore = asyncio.Semaphore(settings.PLANNING_MAX_CONCURRENCY)
+
 # It's good practice to define constants if they are specific to this module,
 # or import them if they are global settings.
 # For now, assuming no new constants are needed here beyond what's imported.
 
-async def run_daily_planning(current_day: int, current_sim_minutes_total: int, specific_npc_id: Optional[str] = None):
+async def run_daily_planning(current_day: int, current_sim_minutes_total: int, specific_npc_id: Optional[str] = None, exclude_npc_ids: Optional[Set[str]] = None):
     print(f"PLANNING: Day {current_day} (5:00 AM) {'for NPC ' + specific_npc_id if specific_npc_id else 'for ALL NPCs'}")
     try:
         if specific_npc_id:
@@ -31,120 +52,225 @@ async def run_daily_planning(current_day: int, current_sim_minutes_total: int, s
             print(f"PLANNING: No NPC(s) found {'with ID ' + specific_npc_id if specific_npc_id else ''}.")
             return
         npcs_data = npcs_response_obj.data if isinstance(npcs_response_obj.data, list) else [npcs_response_obj.data] 
-        sim_date_str = f"Day {current_day}"
+        if exclude_npc_ids:
+            # Already planned, e.g. by the overnight batch job
+            npcs_data = [npc for npc in npcs_data if npc['id'] not in exclude_npc_ids]
+            if not npcs_data:
+                print(f"PLANNING: Every NPC already has a plan for Day {current_day}.")
+                return
         
-        all_action_defs_response = await execute_supabase_query(lambda: supa.table('action_def').select('id, title, base_minutes').execute())
-        action_defs_data = all_action_defs_response.data or []
-        action_defs_map_title_to_id = {ad['title']: ad['id'] for ad in action_defs_data if ad.get('title')}
-        action_defs_map_id_to_duration = {ad['id']: ad.get('base_minutes', 30) for ad in action_defs_data if ad.get('id')}
-
-        all_objects_response = await execute_supabase_query(lambda: supa.table('object').select('id, name, area_id').execute())
-        all_objects_data = all_objects_response.data or []
-
-        for npc in npcs_data:
-            npc_id = npc['id']; npc_name = npc['name']
-            await broadcast_ws_message("planning_event", {"npc_name": npc_name, "status": "started_planning", "day": current_day})
-            npc_traits_summary = format_traits(npc.get('traits', []))
-            print(f"  PLANNING for {npc_name} (ID: {npc_id})...")
-
-            planning_query_text = f"What are important considerations for {npc_name} for planning {sim_date_str}?"
-            retrieved_memories_str = await retrieve_memories(npc_id, planning_query_text, "planning", current_sim_minutes_total)
-            
-            system_prompt_template = get_plan_system_prompt()
-            user_prompt_template = get_plan_user_prompt() # This will handle dynamic actions
-
-            system_prompt = system_prompt_template.format(name=npc_name, sim_date=sim_date_str, traits_summary=npc_traits_summary)
-            # PLAN_USER_PROMPT_TEMPLATE now expects {retrieved_memories} as a formatting key
-            user_prompt = user_prompt_template.format(retrieved_memories=retrieved_memories_str)
-            raw_plan_text = call_llm(system_prompt, user_prompt, max_tokens=400)
-
-            if not raw_plan_text:
-                print(f"    PLANNING - LLM failed to generate a plan for {npc_name}.")
-                await broadcast_ws_message("planning_event", {"npc_name": npc_name, "status": "failed_planning", "day": current_day})
-                continue
-
-            plan_action_instance_ids = []
-            parsed_actions_for_log = []
-            for line in raw_plan_text.strip().split('\n'):
-                match = re.fullmatch(r"(?:\d+\.\s*)?(\d{2}):(\d{2})\s*[-—–]\s*(.+)", line.strip())
-                if match:
-                    hh, mm, action_title_raw = match.groups(); action_title = action_title_raw.strip()
-                    action_start_sim_min_of_day = int(hh) * 60 + int(mm)
-                    action_def_id = action_defs_map_title_to_id.get(action_title)
-
-                    if not action_def_id:
-                        print(f"      Warning: Action title '{action_title}' not found in action_def. Skipping.")
-                        continue
-                    
-                    duration_min = action_defs_map_id_to_duration.get(action_def_id, 30)
-                    
-                    object_id_for_action = None
-                    if action_title == "Work":
-                        pc_objects = [obj for obj in all_objects_data if obj.get('name') == "PC"]
-                        if pc_objects: object_id_for_action = pc_objects[0]['id'] 
-                    elif action_title == "Sleep":
-                        bed_objects = [obj for obj in all_objects_data if obj.get('name') == "Bed"]
-                        if bed_objects: object_id_for_action = bed_objects[0]['id'] 
-                    elif action_title == "Brush Teeth":
-                        toothbrush_objects = [obj for obj in all_objects_data if obj.get('name') == "Toothbrush"]
-                        if toothbrush_objects: object_id_for_action = toothbrush_objects[0]['id']
-                    elif action_title == "Watch TV":
-                        tv_objects = [obj for obj in all_objects_data if obj.get('name') == "TV"]
-                        if tv_objects: object_id_for_action = tv_objects[0]['id']
-                    elif action_title == "Relax on Couch":
-                        couch_objects = [obj for obj in all_objects_data if obj.get('name') == "Couch"]
-                        if couch_objects: object_id_for_action = couch_objects[0]['id']
-                    elif action_title == "Have Coffee":
-                        coffee_table_objects = [obj for obj in all_objects_data if obj.get('name') == "Coffee Table"]
-                        if coffee_table_objects: object_id_for_action = coffee_table_objects[0]['id']
-
-                    action_instance_data = {
-                        'npc_id': npc_id,
-                        'def_id': action_def_id,
-                        'object_id': object_id_for_action,
-                        'start_min': action_start_sim_min_of_day,
-                        'duration_min': duration_min,
-                        'status': 'queued'
-                    }
-                    action_instance_data_list = [action_instance_data]
-                    
-                    def _insert_action_sync(data_list: List[Dict[str, Any]]) -> Any: # Added typing
-                        return supa.table('action_instance').insert(data_list).execute()
-                    insert_response_obj = await execute_supabase_query(lambda: _insert_action_sync(action_instance_data_list))
-
-                    action_instance_id = None
-                    if insert_response_obj.data and len(insert_response_obj.data) > 0:
-                        action_instance_id = insert_response_obj.data[0].get('id')
-                        if action_instance_id:
-                            plan_action_instance_ids.append(action_instance_id)
-                            parsed_actions_for_log.append(f"{hh}:{mm} - {action_title}")
-                        else:
-                            print(f"        !!!! Inserted '{action_title}' but ID not in response: {insert_response_obj.data}")
-                    else:
-                        db_error = getattr(insert_response_obj, 'error', None)
-                        print(f"        !!!! Failed to insert '{action_title}'. Error: {db_error}. Data: {insert_response_obj.data}")
-            
-            if plan_action_instance_ids:
-                print(f"    PLANNING - Successfully created plan for {npc_name} with {len(parsed_actions_for_log)} actions.")
-                plan_data = {'npc_id': npc_id, 'sim_day': current_day, 'actions': plan_action_instance_ids}
-                await execute_supabase_query(lambda: supa.table('plan').insert(plan_data).execute())
-                
-                plan_memory_content = f"Planned for {sim_date_str}: {len(parsed_actions_for_log)} actions. Details: {'; '.join(parsed_actions_for_log)}"
-                plan_memory_embedding = await get_embedding(plan_memory_content)
-                if plan_memory_embedding:
-                    plan_memory_payload = {'npc_id': npc_id, 'sim_min': current_sim_minutes_total, 'kind': 'plan','content': plan_memory_content, 'importance': 3, 'embedding': plan_memory_embedding}
-                    await execute_supabase_query(lambda: supa.table('memory').insert(plan_memory_payload).execute())
-
-                await broadcast_ws_message("planning_event", {"npc_name": npc_name, "status": "completed_planning", "day": current_day, "num_actions": len(parsed_actions_for_log)})
-            else:
-                print(f"    PLANNING - No valid action instances for {npc_name}, plan not created.")
-                await broadcast_ws_message("planning_event", {"npc_name": npc_name, "status": "failed_planning", "day": current_day})
+        await catalog.ensure_loaded()
+
+        # Every NPC (or, in batched mode, every group of NPCs) plans concurrently, bounded by
+        # _planning_semaphore; each NPC reports its own planning_event as it finishes and a
+        # failure only affects that NPC's plan.
+        started_at = time.monotonic()
+        if settings.PLANNING_MODE == PLANNING_MODE_BATCHED and len(npcs_data) > 1:
+            batch_size = max(settings.PLANNING_BATCH_SIZE, 1)
+            batch_results = await asyncio.gather(*[
+                _plan_batch(npcs_data[start:start + batch_size], current_day, current_sim_minutes_total)
+                for start in range(0, len(npcs_data), batch_size)
+            ])
+            results = [result for batch in batch_results for result in batch]
+        else:
+            results = await asyncio.gather(*[
+                _plan_for_npc_bounded(npc, current_day, current_sim_minutes_total) for npc in npcs_data
+            ])
+        print(f"PLANNING: Day {current_day} planned {sum(results)}/{len(results)} NPCs in {time.monotonic() - started_at:.1f}s.")
 
     except Exception as e:
         print(f"ERROR in run_daily_planning: {e}")
         traceback.print_exc()
 
-async def run_nightly_reflection(day_being_reflected: int, current_sim_minutes_total: int):
+async def run_planning_for_npc(npc: Dict[str, Any], current_day: int, current_sim_minutes_total: int) -> bool:
+    """Plans one NPC's day (e.g. ahead of time, during its night hours). Returns True if a plan was created."""
+    await catalog.ensure_loaded()
+    return await _plan_for_npc_bounded(npc, current_day, current_sim_minutes_total)
+
+async def get_planned_npc_ids(sim_day: int) -> Set[str]:
+    """NPCs that already have a plan row for sim_day."""
+    res = await execute_supabase_query(lambda: supa.table('plan').select('npc_id').eq('sim_day', sim_day).execute())
+    return {row['npc_id'] for row in ((res.data if res else None) or [])}
+
+async def _plan_for_npc_bounded(npc: Dict[str, Any], current_day: int, current_sim_minutes_total: int, retrieved_memories_str: Optional[str] = None) -> bool:
+    async with _planning_semaphore:
+        try:
+            return await _plan_for_npc(npc, current_day, current_sim_minutes_total, retrieved_memories_str)
+        except Exception as e:
+            print(f"ERROR in daily planning for NPC {npc.get('name', 'UNKNOWN')}: {e}")
+            traceback.print_exc()
+            await broadcast_ws_message("planning_event", {"npc_id": npc.get('id'), "npc_name": npc.get('name'), "status": "failed_planning", "day": current_day})
+            return False
+
+async def _plan_for_npc(npc: Dict[str, Any], current_day: int, current_sim_minutes_total: int, retrieved_memories_str: Optional[str] = None) -> bool:
+    """Plans one NPC's day with its own LLM call. Returns True if a plan was created.
+
+    retrieved_memories_str is passed when a failed batch hands the NPC back, so its
+    memories are not retrieved (and started_planning not sent) twice.
+    """
+    sim_date_str = f"Day {current_day}"
+    npc_id = npc['id']; npc_name = npc['name']
+    if retrieved_memories_str is None:
+        await broadcast_ws_message("planning_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "started_planning", "day": current_day})
+        print(f"  PLANNING for {npc_name} (ID: {npc_id})...")
+        retrieved_memories_str = await _retrieve_planning_memories(npc, sim_date_str, current_sim_minutes_total)
+    
+    system_prompt, user_prompt = _build_plan_prompts(npc, sim_date_str, retrieved_memories_str)
+    raw_plan_text = await call_llm_async(system_prompt, user_prompt, max_tokens=PLAN_MAX_TOKENS)
+
+    if not raw_plan_text:
+        print(f"    PLANNING - LLM failed to generate a plan for {npc_name}.")
+        await broadcast_ws_message("planning_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "failed_planning", "day": current_day})
+        return False
+
+    action_rows, parsed_actions_for_log = _parse_daily_plan(npc_id, raw_plan_text)
+    return await _commit_daily_plan(npc, current_day, current_sim_minutes_total, action_rows, parsed_actions_for_log)
+
+def _build_plan_prompts(npc: Dict[str, Any], sim_date_str: str, retrieved_memories_str: str) -> Tuple[str, str]:
+    system_prompt_template = get_plan_system_prompt()
+    user_prompt_template = get_plan_user_prompt() # This will handle dynamic actions
+
+    system_prompt = system_prompt_template.format(name=npc['name'], sim_date=sim_date_str, traits_summary=format_traits(npc.get('traits', [])))
+    # PLAN_USER_PROMPT_TEMPLATE now expects {retrieved_memories} as a formatting key
+    user_prompt = user_prompt_template.format(retrieved_memories=retrieved_memories_str)
+    return system_prompt, user_prompt
+
+async def _retrieve_planning_memories(npc: Dict[str, Any], sim_date_str: str, current_sim_minutes_total: int) -> str:
+    planning_query_text = f"What are important considerations for {npc['name']} for planning {sim_date_str}?"
+    return await retrieve_memories(npc['id'], planning_query_text, "planning", current_sim_minutes_total)
+
+def _parse_daily_plan(npc_id: str, raw_plan_text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Turns "HH:MM — Action" lines into action_instance rows. Returns (rows, log lines)."""
+    action_rows = []
+    parsed_actions_for_log = []
+    for line in raw_plan_text.strip().split('\n'):
+        match = re.fullmatch(r"(?:\d+\.\s*)?(\d{2}):(\d{2})\s*[-—–]\s*(.+)", line.strip())
+        if match:
+            hh, mm, action_title_raw = match.groups(); action_title = action_title_raw.strip()
+            action_start_sim_min_of_day = int(hh) * 60 + int(mm)
+            action_def = catalog.action_def_by_title(action_title)
+
+            if not action_def:
+                print(f"      Warning: Action title '{action_title}' not found in action_def. Skipping.")
+                continue
+            action_def_id = action_def['id']
+            
+            duration_min = catalog.action_duration(action_def_id)
+            
+            action_object = catalog.object_for_action_title(action_title)
+            object_id_for_action = action_object['id'] if action_object else None
+
+            action_rows.append({
+                'npc_id': npc_id,
+                'def_id': action_def_id,
+                'object_id': object_id_for_action,
+                'start_min': action_start_sim_min_of_day,
+                'duration_min': duration_min,
+                'status': 'queued'
+            })
+            parsed_actions_for_log.append(f"{hh}:{mm} - {action_title}")
+    return action_rows, parsed_actions_for_log
+
+async def _commit_daily_plan(
+    npc: Dict[str, Any], current_day: int, current_sim_minutes_total: int,
+    action_rows: List[Dict[str, Any]], parsed_actions_for_log: List[str],
+) -> bool:
+    """Stores a parsed daily plan and its plan memory and reports the outcome. Returns True if a plan was created."""
+    npc_id = npc['id']; npc_name = npc['name']
+    sim_date_str = f"Day {current_day}"
+    # All instances and the plan row in one round trip (see plan_store)
+    plan_action_instance_ids = await plan_store.create_plan(npc_id, current_day, action_rows) if action_rows else None
+    if plan_action_instance_ids:
+        print(f"    PLANNING - Successfully created plan for {npc_name} with {len(parsed_actions_for_log)} actions.")
+        plan_memory_content = f"Planned for {sim_date_str}: {len(parsed_actions_for_log)} actions. Details: {'; '.join(parsed_actions_for_log)}"
+        plan_memory_embedding = await get_embedding(plan_memory_content)
+        if plan_memory_embedding:
+            plan_memory_payload = {'npc_id': npc_id, 'sim_min': current_sim_minutes_total, 'kind': 'plan','content': plan_memory_content, 'importance': 3, 'embedding': plan_memory_embedding}
+            await execute_supabase_query(lambda: supa.table('memory').insert(plan_memory_payload).execute())
+
+        await broadcast_ws_message("planning_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "completed_planning", "day": current_day, "num_actions": len(parsed_actions_for_log)})
+        return True
+    print(f"    PLANNING - No valid action instances for {npc_name}, plan not created.")
+    await broadcast_ws_message("planning_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "failed_planning", "day": current_day})
+    return False
+
+def _parse_batch_plans(raw_response: str, npcs: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Maps npc_id -> schedule text from a batched planning response.
+
+    Sections may be keyed by id or, if the model slipped, by name; a schedule may be a
+    list of lines or one string. Anything unreadable is left out.
+    """
+    try:
+        plans = json.loads(raw_response).get("plans")
+    except (json.JSONDecodeError, AttributeError):
+        return {}
+    if not isinstance(plans, dict):
+        return {}
+    npc_ids_by_key = {}
+    for npc in npcs:
+        npc_ids_by_key[str(npc['id'])] = str(npc['id'])
+        npc_ids_by_key[npc['name'].lower()] = str(npc['id'])
+    schedules = {}
+    for key, schedule in plans.items():
+        npc_id = npc_ids_by_key.get(str(key).strip()) or npc_ids_by_key.get(str(key).strip().lower())
+        if npc_id is None:
+            continue
+        if isinstance(schedule, list):
+            schedule = "\n".join(str(line) for line in schedule)
+        if isinstance(schedule, str) and schedule.strip():
+            schedules[npc_id] = schedule
+    return schedules
+
+async def _plan_batch(npcs: List[Dict[str, Any]], current_day: int, current_sim_minutes_total: int) -> List[bool]:
+    """Plans several NPCs with one structured LLM call; NPCs whose section is missing or
+    invalid are planned individually afterwards."""
+    sim_date_str = f"Day {current_day}"
+    results: List[Optional[bool]] = [None] * len(npcs)
+    memories: List[Optional[str]] = [None] * len(npcs)
+    async with _planning_semaphore:
+        try:
+            for npc in npcs:
+                await broadcast_ws_message("planning_event", {"npc_id": npc['id'], "npc_name": npc['name'], "status": "started_planning", "day": current_day})
+            print(f"  PLANNING (batched) for {', '.join(npc['name'] for npc in npcs)}...")
+            memories = list(await asyncio.gather(*[
+                _retrieve_planning_memories(npc, sim_date_str, current_sim_minutes_total) for npc in npcs
+            ]))
+            npc_sections = "\n\n".join(
+                f"### NPC {npc['id']}: {npc['name']}\nTraits: {format_traits(npc.get('traits', []))}\n"
+                f"CONTEXT (recent memories, reflections, and relevant observations):\n{npc_memories}"
+                for npc, npc_memories in zip(npcs, memories)
+            )
+            system_prompt = get_plan_batch_system_prompt().format(sim_date=sim_date_str)
+            user_prompt = get_plan_batch_user_prompt().format(npc_sections=npc_sections)
+            raw_response = await call_llm_async(
+                system_prompt, user_prompt, max_tokens=PLAN_BATCH_TOKENS_PER_NPC * len(npcs),
+                response_format={"type": "json_object"},
+            )
+            schedules = _parse_batch_plans(raw_response, npcs) if raw_response else {}
+
+            commits = {}
+            for index, npc in enumerate(npcs):
+                action_rows, parsed_actions_for_log = _parse_daily_plan(npc['id'], schedules.get(str(npc['id']), ""))
+                if action_rows:
+                    commits[index] = _commit_daily_plan(npc, current_day, current_sim_minutes_total, action_rows, parsed_actions_for_log)
+            for index, result in zip(commits, await asyncio.gather(*commits.values(), return_exceptions=True)):
+                results[index] = result is True
+        except Exception as e:
+            print(f"ERROR in batched planning for {', '.join(npc['name'] for npc in npcs)}: {e}")
+            traceback.print_exc()
+
+    fallback = [index for index, result in enumerate(results) if result is None]
+    if fallback:
+        print(f"  PLANNING (batched): falling back to individual calls for {', '.join(npcs[index]['name'] for index in fallback)}.")
+        fallback_results = await asyncio.gather(*[
+            _plan_for_npc_bounded(npcs[index], current_day, current_sim_minutes_total, memories[index]) for index in fallback
+        ])
+        for index, result in zip(fallback, fallback_results):
+            results[index] = result
+    return results
+
+async def run_nightly_reflection(day_being_reflected: int, current_sim_minutes_total: int, npc_ids: Optional[Set[str]] = None):
+    """Reflects for every NPC (or only npc_ids, e.g. those a reflection batch job missed)."""
     print(f"REFLECTION: Day {day_being_reflected} (12:00 AM Midnight) ...")
     try:
         npcs_response_obj = await execute_supabase_query(lambda: supa.table('npc').select('id, name, traits').execute())
@@ -153,98 +279,174 @@ async def run_nightly_reflection(day_being_reflected: int, current_sim_minutes_t
             return
         
         npcs_data = npcs_response_obj.data # Expecting a list from .execute()
-        sim_date_str = f"Day {day_being_reflected}"
+        if npc_ids is not None:
+            npcs_data = [npc for npc in npcs_data if npc['id'] in npc_ids]
 
         for npc in npcs_data:
-            npc_id = npc['id']; npc_name = npc['name']
-            await broadcast_ws_message("reflection_event", {"npc_name": npc_name, "status": "started_reflection", "day": day_being_reflected})
-            npc_traits_summary = format_traits(npc.get('traits', []))
-            print(f"  REFLECTING for {npc_name} (ID: {npc_id})...")
-            
-            # The original code had a memory check here, which I'm keeping
-            await execute_supabase_query(lambda: supa.table('memory')
-                .select('id, kind') # Minimal select
-                .eq('npc_id', npc_id)
-                .eq('kind', 'obs') # Filter for observations
-                .order('sim_min', desc=True) # Most recent first
-                .limit(50) # Increased limit for better context for reflection
-                .execute())
-            
-            reflection_query_text = f"Key events and main thoughts for {npc_name} on {sim_date_str}? What are 1-3 most salient high-level questions I can answer about my experiences today?"
-            retrieved_memories_str = await retrieve_memories(npc_id, reflection_query_text, "reflection", current_sim_minutes_total)
-            
-            system_prompt_template = get_reflection_system_prompt()
-            user_prompt_template = get_reflection_user_prompt()
-            
-            system_prompt = system_prompt_template.format(npc_name=npc_name, sim_date=sim_date_str)
-            user_prompt = user_prompt_template.format(traits_summary=npc_traits_summary, retrieved_memories=retrieved_memories_str)
-            
-            raw_reflection_text = call_llm(system_prompt, user_prompt, max_tokens=500, model="gpt-4o") # Increased max_tokens for richer reflection
-            
-            if not raw_reflection_text:
-                print(f"  ERROR: LLM returned empty or null response for {npc_name}'s reflection!")
-                await broadcast_ws_message("reflection_event", {"npc_name": npc_name, "status": "failed_reflection_llm", "day": day_being_reflected})
-                continue
-            
-            # Attempt to parse bullet points, allowing for variations
-            reflection_points = []
-            lines = raw_reflection_text.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                if not line: continue
-                # More robust bullet point detection
-                if re.match(r"^[•*-]\s*", line): # Matches •, *, -
-                    reflection_points.append(line[re.match(r"^[•*-]\s*", line).end():].strip())
-                elif re.match(r"^\d+\.\s*", line): # Matches "1. "
-                     reflection_points.append(line[re.match(r"^\d+\.\s*", line).end():].strip())
-                else: # If no clear bullet, treat the line as a point (might be a paragraph)
-                    reflection_points.append(line)
-
-            if not reflection_points:
-                print(f"  ERROR: No reflection points could be parsed for {npc_name}. Raw text: {raw_reflection_text}")
-                await broadcast_ws_message("reflection_event", {"npc_name": npc_name, "status": "failed_reflection_parsing", "day": day_being_reflected})
-                continue
-
-            print(f"  REFLECTION - Successfully generated {len(reflection_points)} reflection points for {npc_name}.")
-
-            memories_to_insert = []
-            for point_content in reflection_points:
-                if not point_content: continue # Skip empty points
-
-                # For reflection, let's make importance slightly higher than observations
-                importance = 2 
-                # Heuristic: if question mark in point, could be a question/insight, raise importance
-                if '?' in point_content: importance = 3
-                # Heuristic: Longer reflections might be more insightful
-                if len(point_content) > 150: importance = 3 
-                if len(point_content) > 250: importance = 4
-
-
-                reflection_embedding = await get_embedding(point_content)
-                if reflection_embedding:
-                    memories_to_insert.append({
-                        'npc_id': npc_id,
-                        'sim_min': current_sim_minutes_total,
-                        'kind': 'reflect',
-                        'content': point_content,
-                        'importance': importance,
-                        'embedding': reflection_embedding
-                    })
-            
-            if memories_to_insert:
-                await execute_supabase_query(lambda: supa.table('memory').insert(memories_to_insert).execute())
-                print(f"    -> REFLECTION - Saved {len(memories_to_insert)} reflection memories for {npc_name}.")
-                await broadcast_ws_message("reflection_event", {"npc_name": npc_name, "status": "completed_reflection", "day": day_being_reflected, "num_reflections": len(memories_to_insert)})
-            else:
-                print(f"    -> REFLECTION - No valid reflection memories to save for {npc_name}.")
-                await broadcast_ws_message("reflection_event", {"npc_name": npc_name, "status": "no_reflections_saved", "day": day_being_reflected})
+            await run_reflection_for_npc(npc, day_being_reflected, current_sim_minutes_total)
 
     except Exception as e:
         print(f"ERROR in run_nightly_reflection for NPC {npc.get('name', 'UNKNOWN') if 'npc' in locals() else 'N/A'}: {e}")
         traceback.print_exc()
         if 'npc' in locals() and npc: # Check if npc is defined
-             await broadcast_ws_message("reflection_event", {"npc_name": npc.get('name', 'UNKNOWN'), "status": "error_reflection", "day": day_being_reflected})
+             await broadcast_ws_message("reflection_event", {"npc_id": npc.get('id'), "npc_name": npc.get('name', 'UNKNOWN'), "status": "error_reflection", "day": day_being_reflected})
+
+async def run_reflection_for_npc(npc: Dict[str, Any], day_being_reflected: int, current_sim_minutes_total: int) -> bool:
+    """Reflects on one NPC's day with its own LLM call. Returns True if reflections were saved."""
+    await broadcast_ws_message("reflection_event", {"npc_id": npc['id'], "npc_name": npc['name'], "status": "started_reflection", "day": day_being_reflected})
+    print(f"  REFLECTING for {npc['name']} (ID: {npc['id']})...")
+    system_prompt, user_prompt = await _build_reflection_prompts(npc, day_being_reflected, current_sim_minutes_total)
+    raw_reflection_text = await call_llm_async(system_prompt, user_prompt, max_tokens=REFLECTION_MAX_TOKENS, model=REFLECTION_MODEL)
+    return await _apply_reflection(npc, day_being_reflected, current_sim_minutes_total, raw_reflection_text)
+
+async def _build_reflection_prompts(npc: Dict[str, Any], day_being_reflected: int, current_sim_minutes_total: int) -> Tuple[str, str]:
+    """Returns the (system, user) reflection prompts.
+
+    The prompt holds the experiences since the NPC's last reflection (or since the start
+    of the day being reflected) plus the top related older memories.
+    """
+    npc_id = npc['id']; npc_name = npc['name']
+    npc_traits_summary = format_traits(npc.get('traits', []))
+    sim_date_str = f"Day {day_being_reflected}"
+    since_sim_min = reflection_tracker.since(npc_id)
+    if since_sim_min is None:
+        since_sim_min = (day_being_reflected - 1) * SIM_DAY_MINUTES - 1
+
+    new_memories_res = await execute_supabase_query(lambda: supa.table('memory')
+        .select('content, importance')
+        .eq('npc_id', npc_id)
+        .in_('kind', EXPERIENCE_MEMORY_KINDS)
+        .gt('sim_min', since_sim_min)
+        .lte('sim_min', current_sim_minutes_total)
+        .order('sim_min')
+        .limit(REFLECTION_MAX_NEW_MEMORIES)
+        .execute())
+    new_memories = [mem for mem in ((new_memories_res.data if new_memories_res else None) or []) if mem.get('content')]
+
+    reflection_query_text = f"Key events and main thoughts for {npc_name} on {sim_date_str}? What are 1-3 most salient high-level questions I can answer about my experiences today?"
+    most_important = sorted(new_memories, key=lambda mem: mem.get('importance') or 1, reverse=True)[:REFLECTION_QUERY_MEMORIES]
+    if most_important:
+        reflection_query_text += " " + " ".join(mem['content'] for mem in most_important)
+    related_memories_str = await retrieve_memories(
+        npc_id, reflection_query_text, "reflection", current_sim_minutes_total,
+        before_sim_min=since_sim_min, top_k=settings.REFLECTION_RELATED_TOP_K
+    )
+    new_memories_str = "\n".join(mem['content'] for mem in new_memories) or "Nothing new."
+    retrieved_memories_str = f"Since your last reflection:\n{new_memories_str}\n\nRelated earlier memories:\n{related_memories_str}"
+    
+    system_prompt_template = get_reflection_system_prompt()
+    user_prompt_template = get_reflection_user_prompt()
+    
+    system_prompt = system_prompt_template.format(npc_name=npc_name, sim_date=sim_date_str)
+    user_prompt = user_prompt_template.format(traits_summary=npc_traits_summary, retrieved_memories=retrieved_memories_str)
+    return system_prompt, user_prompt
+
+async def _apply_reflection(npc: Dict[str, Any], day_being_reflected: int, current_sim_minutes_total: int, raw_reflection_text: Optional[str]) -> bool:
+    """Parses a reflection completion, stores its points as reflect memories and reports the outcome."""
+    npc_id = npc['id']; npc_name = npc['name']
+    if not raw_reflection_text:
+        print(f"  ERROR: LLM returned empty or null response for {npc_name}'s reflection!")
+        await broadcast_ws_message("reflection_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "failed_reflection_llm", "day": day_being_reflected})
+        return False
+    # The experiences up to now have been reflected on, even if nothing could be parsed
+    reflection_tracker.mark_reflected(npc_id, current_sim_minutes_total)
+    
+    # Attempt to parse bullet points, allowing for variations
+    reflection_points = []
+    lines = raw_reflection_text.strip().split('\n')
+    for line in lines:
+        line = line.strip()
+        if not line: continue
+        # More robust bullet point detection
+        if re.match(r"^[•*-]\s*", line): # Matches •, *, -
+            reflection_points.append(line[re.match(r"^[•*-]\s*", line).end():].strip())
+        elif re.match(r"^\d+\.\s*", line): # Matches "1. "
+             reflection_points.append(line[re.match(r"^\d+\.\s*", line).end():].strip())
+        else: # If no clear bullet, treat the line as a point (might be a paragraph)
+            reflection_points.append(line)
+
+    if not reflection_points:
+        print(f"  ERROR: No reflection points could be parsed for {npc_name}. Raw text: {raw_reflection_text}")
+        await broadcast_ws_message("reflection_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "failed_reflection_parsing", "day": day_being_reflected})
+        return False
+
+    print(f"  REFLECTION - Successfully generated {len(reflection_points)} reflection points for {npc_name}.")
+
+    memories_to_insert = []
+    for point_content in reflection_points:
+        if not point_content: continue # Skip empty points
+
+        # For reflection, let's make importance slightly higher than observations
+        importance = 2 
+        # Heuristic: if question mark in point, could be a question/insight, raise importance
+        if '?' in point_content: importance = 3
+        # Heuristic: Longer reflections might be more insightful
+        if len(point_content) > 150: importance = 3 
+        if len(point_content) > 250: importance = 4
+
+
+        reflection_embedding = await get_embedding(point_content)
+        if reflection_embedding:
+            memories_to_insert.append({
+                'npc_id': npc_id,
+                'sim_min': current_sim_minutes_total,
+                'kind': 'reflect',
+                'content': point_content,
+                'importance': importance,
+                'embedding': reflection_embedding
+            })
+    
+    if memories_to_insert:
+        await execute_supabase_query(lambda: supa.table('memory').insert(memories_to_insert).execute())
+        print(f"    -> REFLECTION - Saved {len(memories_to_insert)} reflection memories for {npc_name}.")
+        await broadcast_ws_message("reflection_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "completed_reflection", "day": day_being_reflected, "num_reflections": len(memories_to_insert)})
+        return True
+    print(f"    -> REFLECTION - No valid reflection memories to save for {npc_name}.")
+    await broadcast_ws_message("reflection_event", {"npc_id": npc_id, "npc_name": npc_name, "status": "no_reflections_saved", "day": day_being_reflected})
+    return False
+
+
+def _diff_plan_actions(
+    remaining_instances: List[Dict[str, Any]], new_action_rows: List[Dict[str, Any]]
+) -> Tuple[List[Any], List[Dict[str, Any]], List[Dict[str, Any]], List[Any]]:
+    """Diffs the not-yet-done part of a plan against a new schedule, keyed on (start_min, def_id).
+
+    Returns (unchanged ids, rows to update in place, rows to insert, ids to delete). A
+    remaining action matching a new one on start time and def is kept (and updated only
+    if its object or duration changed); an unmatched queued action at the same start
+    time as an unmatched new one is reused for it, so its id stays stable. An unmatched
+    active action is left alone (returned with the unchanged ids): it is neither reused
+    for a different action nor deleted while it is the NPC's current action.
+    """
+    remaining_by_key = {(inst["start_min"], inst["def_id"]): inst for inst in remaining_instances}
+    unchanged_ids: List[Any] = []
+    update_rows: List[Dict[str, Any]] = []
+    unmatched_rows: List[Dict[str, Any]] = []
+    for row in new_action_rows:
+        inst = remaining_by_key.pop((row["start_min"], row["def_id"]), None)
+        if inst is None:
+            unmatched_rows.append(row)
+        elif inst.get("object_id") == row["object_id"] and inst.get("duration_min") == row["duration_min"]:
+            unchanged_ids.append(inst["id"])
+        else:
+            update_rows.append({**row, "id": inst["id"], "status": inst["status"]})
 
+    unmatched_by_start = {}
+    for inst in remaining_by_key.values():
+        if inst["status"] == "queued":
+            unmatched_by_start.setdefault(inst["start_min"], []).append(inst)
+        else:
+            unchanged_ids.append(inst["id"])
+    insert_rows: List[Dict[str, Any]] = []
+    for row in unmatched_rows:
+        same_start = unmatched_by_start.get(row["start_min"])
+        if same_start:
+            inst = same_start.pop()
+            update_rows.append({**row, "id": inst["id"]})
+        else:
+            insert_rows.append(row)
+    delete_ids = [inst["id"] for insts in unmatched_by_start.values() for inst in insts]
+    return unchanged_ids, update_rows, insert_rows, delete_ids
 
 async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) -> None:
     """Replan the remainder of the day for a single NPC based on an event."""
@@ -269,16 +471,13 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
         npc_traits = npc_res.data.get("traits", [])
         print(f"REPLANNING: Fetched NPC details for {npc_name}.")
 
-        # Fetch all available action definitions to guide the LLM
-        all_action_defs_response = await execute_supabase_query(lambda: supa.table('action_def').select('id, title, base_minutes').execute())
-        if not (all_action_defs_response and all_action_defs_response.data):
+        # Action definitions come from the reference catalog to guide the LLM
+        await catalog.ensure_loaded()
+        if not catalog.action_defs:
             print(f"REPLANNING: Could not fetch action definitions for {npc_name}. Aborting replan.")
             return
-        action_defs_data = all_action_defs_response.data
-        # For matching LLM output to action_def IDs later
-        defs_by_id = {d["id"]: d for d in action_defs_data}
         # For providing LLM with a list of valid action titles
-        valid_action_titles = [ad['title'] for ad in action_defs_data if ad.get('title')]
+        valid_action_titles = catalog.action_titles()
         if not valid_action_titles:
             print(f"REPLANNING: No valid action titles found in action_def table for {npc_name}. Aborting replan.")
             return
@@ -306,18 +505,22 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
         if existing_action_ids:
             action_instances_res = await execute_supabase_query(
                 lambda: supa.table("action_instance")
-                .select("id, def_id, start_min, status")
+                .select("id, npc_id, def_id, object_id, start_min, duration_min, status")
                 .in_("id", existing_action_ids)
                 .order("start_min")
                 .execute()
             )
 
         keep_action_ids = []
+        remaining_instances = []
+        remaining_titles = []
         remaining_action_lines = []
         if action_instances_res and action_instances_res.data:
             for inst in action_instances_res.data:
                 if inst["start_min"] >= sim_min_of_day and inst["status"] != "done":
-                    title = defs_by_id.get(inst["def_id"], {}).get("title", "?")
+                    remaining_instances.append(inst)
+                    title = (catalog.action_def(inst["def_id"]) or {}).get("title", "?")
+                    remaining_titles.append(title)
                     remaining_action_lines.append(
                         f"{inst['start_min'] // 60:02d}:{inst['start_min'] % 60:02d} - {title}"
                     )
@@ -335,14 +538,25 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
             "Should you create a new plan for the rest of the day? Answer Yes or No."
         )
 
-        print(f"REPLANNING: Asking LLM if {npc_name} should replan. Event details: {original_event_description}")
-        decision_raw = call_llm(decision_system, decision_user, max_tokens=10)
-
-        if not decision_raw or not decision_raw.strip().lower().startswith("y"):
-            print(f"REPLANNING: LLM decided NOT to replan for {npc_name}. LLM response: '{decision_raw}'. Aborting replan.")
+        # Clear cases are decided locally; only ambiguous ones cost the yes/no LLM call
+        gate_decision = GATE_ASK
+        if settings.REPLAN_GATE_ENABLED:
+            gate_decision = await replan_gate.decide(event_info, original_event_description, remaining_titles)
+        if gate_decision == GATE_SKIP:
+            print(f"REPLANNING: Gate decided NOT to replan for {npc_name}; event does not affect the remaining plan. Aborting replan.")
+            replan_gate.maybe_audit_skip(decision_system, decision_user)
             return
-        
-        print(f"REPLANNING: LLM decided YES to replan for {npc_name}. LLM response: '{decision_raw}'. Proceeding to generate new plan.")
+        if gate_decision == GATE_REPLAN:
+            print(f"REPLANNING: Gate decided YES to replan for {npc_name}. Proceeding to generate new plan.")
+        else:
+            print(f"REPLANNING: Asking LLM if {npc_name} should replan. Event details: {original_event_description}")
+            decision_raw = await call_llm_async(decision_system, decision_user, max_tokens=10)
+
+            if not decision_raw or not decision_raw.strip().lower().startswith("y"):
+                print(f"REPLANNING: LLM decided NOT to replan for {npc_name}. LLM response: '{decision_raw}'. Aborting replan.")
+                return
+
+            print(f"REPLANNING: LLM decided YES to replan for {npc_name}. LLM response: '{decision_raw}'. Proceeding to generate new plan.")
 
         memory_query = original_event_description 
         retrieved = await retrieve_memories(npc_id, memory_query, "planning", current_sim_min)
@@ -370,7 +584,7 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
         )
 
         print(f"REPLANNING: Calling LLM to generate new plan for {npc_name}. Context based on: '{memory_query}'. Valid actions provided: {valid_actions_list_str}")
-        raw_plan_text = call_llm(system_prompt, user_prompt, max_tokens=400) # Increased max_tokens slightly for longer action list
+        raw_plan_text = await call_llm_async(system_prompt, user_prompt, max_tokens=400) # Increased max_tokens slightly for longer action list
 
         if not raw_plan_text:
             print(f"REPLANNING: LLM failed to generate a new plan for {npc_name}. Aborting replan.")
@@ -378,11 +592,8 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
         
         print(f"REPLANNING: LLM generated raw plan for {npc_name}:\n{raw_plan_text}")
 
-        new_action_ids = []
+        new_action_rows = []
         parsed_actions_for_log = []
-        # Retrieve action_defs_map_title_to_id for parsing, similar to run_daily_planning
-        action_defs_map_title_to_id = {ad['title']: ad['id'] for ad in action_defs_data if ad.get('title')}
-
         # Use splitlines() for more robust line splitting from LLM output
         for line in raw_plan_text.splitlines():
             # Simpler regex focusing on the em-dash, and ensuring spaces are handled flexibly.
@@ -398,17 +609,15 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
             # Attempt to strip leading/trailing quotes that LLM might have included from the prompt examples
             action_title_cleaned = action_title_from_llm.strip('"').strip("'")
             
-            action_def_id = action_defs_map_title_to_id.get(action_title_cleaned) 
+            action_def = catalog.action_def_by_title(action_title_cleaned)
 
-            if not action_def_id:
+            if not action_def:
                 # Log both the raw and cleaned versions for debugging
                 print(f"      REPLANNING Warning ({npc_name}): Action title '{action_title_cleaned}' (raw: '{action_title_from_llm}') not found in action_def_map or is invalid. Skipping.")
                 continue
+            action_def_id = action_def['id']
             
-            # Get duration from the initially fetched defs_by_id or action_defs_data
-            # We need a map from ID to duration if not already present
-            action_defs_map_id_to_duration = {ad['id']: ad.get('base_minutes', 30) for ad in action_defs_data if ad.get('id')}
-            duration_min = action_defs_map_id_to_duration.get(action_def_id, 30)
+            duration_min = catalog.action_duration(action_def_id)
             
             start_min = int(hh) * 60 + int(mm)
             if start_min < sim_min_of_day:
@@ -420,51 +629,28 @@ async def run_replanning(npc_id: str, event_info: Dict, current_sim_min: int) ->
             # Example: if action_title == "Work": find PC object_id
             # This part might need to be more robust if replanned actions often require specific objects
 
-            action_payload = {
+            new_action_rows.append({
                 "npc_id": npc_id,
                 "def_id": action_def_id,
                 "object_id": object_id_for_action, 
                 "start_min": start_min,
                 "duration_min": duration_min,
                 "status": "queued",
-            }
-            insert_res = await execute_supabase_query(
-                lambda: supa.table("action_instance").insert(action_payload).execute()
-            )
-            if insert_res and insert_res.data and len(insert_res.data) > 0:
-                new_id = insert_res.data[0].get("id")
-                if new_id:
-                    new_action_ids.append(new_id)
-                    parsed_actions_for_log.append(f"{hh}:{mm} - {action_title_cleaned}")
-                else:
-                    print(f"        REPLANNING: Inserted action '{action_title_cleaned}' for {npc_name} but ID not in response: {insert_res.data}")
-            else:
-                db_error = getattr(insert_res, 'error', None)
-                print(f"        REPLANNING: Failed to insert action '{action_title_cleaned}' for {npc_name}. Error: {db_error}. Data: {insert_res.data}")
+            })
+            parsed_actions_for_log.append(f"{hh}:{mm} - {action_title_cleaned}")
 
-        if new_action_ids:
+        new_action_ids = None
+        if new_action_rows:
             print(f"REPLANNING: Successfully parsed {len(parsed_actions_for_log)} new actions for {npc_name}.")
-            if remaining_action_lines: 
-                actions_to_delete = [inst_id for inst_id in existing_action_ids if inst_id not in keep_action_ids]
-                if actions_to_delete:
-                    print(f"REPLANNING: Deleting {len(actions_to_delete)} old actions for {npc_name}.")
-                    await execute_supabase_query(
-                        lambda: supa.table("action_instance")
-                        .delete()
-                        .in_("id", actions_to_delete)
-                        .execute()
-                    )
-                else:
-                    print(f"REPLANNING: No old actions to delete for {npc_name} as new plan starts after previous one or previous was empty.")
-
-            updated_ids = keep_action_ids + new_action_ids
-            await execute_supabase_query(
-                lambda: supa.table("plan")
-                .update({"actions": updated_ids})
-                .eq("id", plan_id)
-                .execute()
+            # Only the difference to the remaining plan is written; unchanged actions keep their ids
+            unchanged_ids, update_rows, insert_rows, delete_ids = _diff_plan_actions(remaining_instances, new_action_rows)
+            print(f"REPLANNING: Plan diff for {npc_name}: {len(unchanged_ids)} unchanged, {len(update_rows)} updated, {len(insert_rows)} new, {len(delete_ids)} removed.")
+            new_action_ids = await plan_store.apply_diff(
+                plan_id, keep_action_ids + unchanged_ids + [row["id"] for row in update_rows],
+                delete_ids, update_rows, insert_rows,
             )
 
+        if new_action_ids is not None:
             replan_reason_display = "[Unspecified Event]"
             event_source = event_info.get("source")
 
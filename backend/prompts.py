@@ -150,6 +150,58 @@ Conversation:
 Your one-sentence summary:''' # Fallback
 
 
+def get_dialogue_joint_system_prompt() -> str:
+    return get_prompt_from_db("DIALOGUE_JOINT_SYSTEM_PROMPT_TEMPLATE") or \
+           (
+            "You are an AI generating a brief, natural dialogue between two NPCs in a simulation, "
+            "and summarizing it from each participant's point of view. "
+            "{npc_name} has the following traits: {traits}. {other_npc_name} has the following traits: {other_npc_traits}. "
+            "Always answer with a single JSON object and nothing else."
+        ) # Fallback
+
+def get_dialogue_joint_user_prompt() -> str:
+    return get_prompt_from_db("DIALOGUE_JOINT_USER_PROMPT_TEMPLATE") or \
+           (
+            "{npc_name} is talking with {other_npc_name} in the {area_name}.\n"
+            "CONTEXT ({npc_name}'s relevant memories):\n{memories}\n"
+            "Write a brief, natural dialogue with just 3-4 exchanges between {npc_name} and {other_npc_name}, "
+            "appropriate to both their personalities. Then summarize it once from each participant's perspective "
+            "in a single, concise first-person sentence focusing on the main topic or outcome.\n"
+            "Respond with JSON in exactly this shape:\n"
+            '{{"turns": [{{"speaker": "{npc_name}", "line": "..."}}, {{"speaker": "{other_npc_name}", "line": "..."}}], '
+            '"summary_a": "{npc_name}\'s one-sentence summary", "summary_b": "{other_npc_name}\'s one-sentence summary"}}'
+        ) # Fallback
+
+
+def get_plan_batch_system_prompt() -> str:
+    return get_prompt_from_db("PLAN_BATCH_SYSTEM_PROMPT_TEMPLATE") or \
+           (
+            "You plan the day for several NPCs in a simulation. Today is {sim_date}. "
+            "Each NPC's schedule must fit their own traits and memories. "
+            "Always answer with a single JSON object and nothing else."
+        ) # Fallback
+
+def get_plan_batch_user_prompt() -> str:
+    """
+    Fetches the PLAN_BATCH_USER_PROMPT_TEMPLATE; like get_plan_user_prompt(),
+    '{{AVAILABLE_ACTIONS_AS_STRING}}' is replaced with the current action list.
+    """
+    plan_batch_user_raw = get_prompt_from_db("PLAN_BATCH_USER_PROMPT_TEMPLATE")
+    actions_list_str = ", ".join(get_available_actions_list())
+    if not plan_batch_user_raw:
+        return (
+            f"For each NPC below, produce an ordered list of actions (max 8) for today, based on that NPC's personality and memories.\n"
+            f"You MUST choose actions EXCLUSIVELY from the following list: {actions_list_str}.\n"
+            f"Do NOT invent new actions. If you want to do something like 'Eat Breakfast', use the action 'Eat'.\n"
+            f"Format each action as: HH:MM — <ACTION_TITLE_FROM_LIST>\n"
+            f"The day starts at 00:00 and ends at 23:59. Schedule a reasonable number of actions per NPC.\n"
+            f"\n{{npc_sections}}\n\n"
+            f"Respond with JSON in exactly this shape, with one entry per NPC id:\n"
+            f'{{{{"plans": {{{{"<npc id>": ["09:00 — Work", "12:00 — Eat"]}}}}}}}}'
+        ) # Fallback
+    return plan_batch_user_raw.replace("{{AVAILABLE_ACTIONS_AS_STRING}}", actions_list_str)
+
+
 # Helper to format traits for prompts (can remain as is, or be moved if not prompt-specific)
 def format_traits(traits_list: list[str]) -> str:
     if not traits_list:
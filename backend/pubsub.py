@@ -0,0 +1,119 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Optional: only needed when WS_PUBSUB_BACKEND=redis
+    aioredis = None
+
+from .config import get_settings
+
+# Identifies this process in published envelopes, so a worker can tell its own
+# broadcasts apart from those of the ticking process.
+PROCESS_ID = uuid.uuid4().hex
+
+PUBSUB_BACKEND_INPROCESS = "inprocess"
+PUBSUB_BACKEND_REDIS = "redis"
+
+EnvelopeHandler = Callable[[Dict], Awaitable[None]]
+
+
+class InProcessBridge:
+    """Default bridge: publish() hands the envelope straight to this process's handler."""
+
+    name = PUBSUB_BACKEND_INPROCESS
+
+    def __init__(self):
+        self._handler: Optional[EnvelopeHandler] = None
+
+    async def start(self, handler: EnvelopeHandler):
+        self._handler = handler
+
+    async def publish(self, envelope: Dict):
+        if self._handler:
+            await self._handler(envelope)
+
+    async def stop(self):
+        self._handler = None
+
+
+class RedisBridge:
+    """Publishes envelopes on a Redis (or Redis-compatible) channel.
+
+    Every process, including the publisher, subscribes to the channel and fans the
+    envelopes out to its own sockets, so N web workers can share one ticking process.
+    """
+
+    name = PUBSUB_BACKEND_REDIS
+
+    def __init__(self, url: str, channel: str):
+        self.url = url
+        self.channel = channel
+        self._redis: Any = None
+        self._pubsub: Any = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._handler: Optional[EnvelopeHandler] = None
+
+    async def start(self, handler: EnvelopeHandler):
+        self._handler = handler
+        self._redis = aioredis.from_url(self.url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener_task = asyncio.create_task(self._listen())
+        print(f"PUBSUB: Subscribed to Redis channel '{self.channel}' at {self.url}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async for raw_message in self._pubsub.listen():
+                    if raw_message.get("type") != "message":
+                        continue
+                    try:
+                        envelope = json.loads(raw_message["data"])
+                    except (json.JSONDecodeError, TypeError) as e:
+                        print(f"PUBSUB: Dropping undecodable envelope: {e}")
+                        continue
+                    await self._handler(envelope)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"PUBSUB: Redis listener error: {e} - resubscribing in 1s.")
+                await asyncio.sleep(1)
+                try:
+                    await self._pubsub.subscribe(self.channel)
+                except Exception as resubscribe_error:
+                    print(f"PUBSUB: Resubscribe failed: {resubscribe_error}")
+
+    async def publish(self, envelope: Dict):
+        try:
+            await self._redis.publish(self.channel, json.dumps(envelope))
+        except Exception as e:
+            print(f"PUBSUB: Error publishing to Redis channel '{self.channel}': {e}")
+
+    async def stop(self):
+        if self._listener_task and not self._listener_task.done():
+            self._listener_task.cancel()
+        try:
+            if self._pubsub is not None:
+                await self._pubsub.unsubscribe(self.channel)
+                await self._pubsub.close()
+            if self._redis is not None:
+                await self._redis.close()
+        except Exception as e:
+            print(f"PUBSUB: Error closing Redis connection: {e}")
+
+
+def create_bridge():
+    """Builds the bridge selected by WS_PUBSUB_BACKEND, falling back to in-process."""
+    settings = get_settings()
+    backend = (settings.WS_PUBSUB_BACKEND or PUBSUB_BACKEND_INPROCESS).lower()
+    if backend == PUBSUB_BACKEND_REDIS:
+        if aioredis is None:
+            print("PUBSUB: WS_PUBSUB_BACKEND=redis but the redis package is not installed - using in-process bridge.")
+        else:
+            return RedisBridge(settings.WS_PUBSUB_URL, settings.WS_PUBSUB_CHANNEL)
+    elif backend != PUBSUB_BACKEND_INPROCESS:
+        print(f"PUBSUB: Unknown WS_PUBSUB_BACKEND '{backend}' - using in-process bridge.")
+    return InProcessBridge()
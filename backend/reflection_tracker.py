@@ -0,0 +1,120 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from .config import get_settings
+from .services import supa, execute_supabase_query
+
+settings = get_settings()
+
+SIM_DAY_MINUTES = 24 * 60
+REFLECTION_MODE_INCREMENTAL = "incremental"
+# Memory kinds that are experiences; plans, replans and reflections are the NPC's own output
+EXPERIENCE_MEMORY_KINDS = ["obs", "dialogue_summary"]
+
+
+class ReflectionTracker:
+    """Per-NPC reflection high-water marks and importance-triggered reflection.
+
+    The high-water mark is the sim minute an NPC last reflected up to; the next
+    reflection only considers experiences after it (plus related older memories). check()
+    sums the importance of each NPC's experiences since its mark and reflects, in the
+    background, for every NPC at or above `threshold`, so busy NPCs reflect several
+    times a day and idle ones not at all. Marks start from the latest reflect memory
+    within the last sim day and never lag more than a day behind.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self._high_water: Dict[str, int] = {}
+        self._loaded = False
+        self._reflecting: Set[str] = set()
+        self._running: Set[asyncio.Task] = set()
+        self.metrics: Dict[str, int] = {"checks": 0, "reflections": 0}
+
+    def since(self, npc_id: str) -> Optional[int]:
+        """Sim minute the NPC last reflected up to, if known."""
+        return self._high_water.get(npc_id)
+
+    def mark_reflected(self, npc_id: str, sim_min: int) -> None:
+        self._high_water[npc_id] = max(sim_min, self._high_water.get(npc_id, sim_min))
+
+    def reset(self) -> None:
+        """Forgets every high-water mark; they are reloaded from reflect memories on the next check."""
+        self._high_water.clear()
+        self._loaded = False
+
+    async def _load(self, current_sim_minutes_total: int) -> None:
+        res = await execute_supabase_query(
+            lambda: supa.table("memory")
+            .select("npc_id, sim_min")
+            .eq("kind", "reflect")
+            .gte("sim_min", current_sim_minutes_total - SIM_DAY_MINUTES)
+            .execute()
+        )
+        for row in (res.data if res else None) or []:
+            self.mark_reflected(row["npc_id"], row["sim_min"])
+        self._loaded = True
+
+    async def check(self, npcs: List[Dict[str, Any]], current_day: int, current_sim_minutes_total: int) -> None:
+        """Starts a reflection for every NPC whose new experiences crossed the threshold."""
+        try:
+            if not self._loaded:
+                await self._load(current_sim_minutes_total)
+            floor = current_sim_minutes_total - SIM_DAY_MINUTES
+            marks = {npc["id"]: max(self._high_water.get(npc["id"], floor), floor) for npc in npcs}
+            if not marks:
+                return
+            # One query for every NPC's experiences since the oldest mark
+            res = await execute_supabase_query(
+                lambda: supa.table("memory")
+                .select("npc_id, sim_min, importance")
+                .in_("kind", EXPERIENCE_MEMORY_KINDS)
+                .gt("sim_min", min(marks.values()))
+                .lte("sim_min", current_sim_minutes_total)
+                .execute()
+            )
+        except Exception as e:
+            print(f"REFLECTION: Error checking reflection triggers: {e}")
+            return
+        self.metrics["checks"] += 1
+        accumulated: Dict[str, int] = {}
+        for row in (res.data if res else None) or []:
+            npc_id = row["npc_id"]
+            if npc_id in marks and row["sim_min"] > marks[npc_id]:
+                accumulated[npc_id] = accumulated.get(npc_id, 0) + (row.get("importance") or 1)
+        for npc in npcs:
+            if npc["id"] in self._reflecting or accumulated.get(npc["id"], 0) < self.threshold:
+                continue
+            print(f"REFLECTION: {npc['name']} crossed the importance threshold ({accumulated[npc['id']]} >= {self.threshold}).")
+            self._high_water.setdefault(npc["id"], marks[npc["id"]])
+            self._reflecting.add(npc["id"])
+            task = asyncio.create_task(self._reflect(npc, current_day, current_sim_minutes_total))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _reflect(self, npc: Dict[str, Any], current_day: int, current_sim_minutes_total: int) -> None:
+        from .planning_and_reflection import run_reflection_for_npc
+        try:
+            await run_reflection_for_npc(npc, current_day, current_sim_minutes_total)
+            self.metrics["reflections"] += 1
+        except Exception as e:
+            print(f"REFLECTION: Error reflecting for {npc.get('name', npc.get('id'))}: {e}")
+        finally:
+            self._reflecting.discard(npc["id"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": settings.REFLECTION_MODE,
+            "threshold": self.threshold,
+            "reflecting": len(self._reflecting),
+            "high_water_marks": dict(self._high_water),
+            **self.metrics,
+        }
+
+    async def flush(self) -> None:
+        """Waits for running reflections, e.g. before shutdown."""
+        if self._running:
+            await asyncio.gather(*list(self._running), return_exceptions=True)
+
+
+reflection_tracker = ReflectionTracker(threshold=settings.REFLECTION_IMPORTANCE_THRESHOLD)
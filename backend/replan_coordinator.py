@@ -0,0 +1,217 @@
+import asyncio
+from typing import Any, Dict, List, Set
+
+from .config import get_settings
+from .services import supa, execute_supabase_query
+
+settings = get_settings()
+
+
+def merge_replan_events(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combines the event_infos of one debounce window into a single run_replanning event.
+
+    The newest event supplies the source fields (partner, challenge code, ...); the
+    description lists every distinct event in arrival order.
+    """
+    merged = dict(events[-1])
+    descriptions = []
+    for event_info in events:
+        description = event_info.get("original_description", event_info.get("description"))
+        if description and description not in descriptions:
+            descriptions.append(description)
+    if len(descriptions) > 1:
+        merged["original_description"] = "; ".join(descriptions)
+    # The replan gate's challenge rules only hold if every merged event carries them
+    for rule_field in ("priority_action", "affected_action_title"):
+        if len({event_info.get(rule_field) for event_info in events}) > 1:
+            merged.pop(rule_field, None)
+    merged["merged_events"] = len(events)
+    return merged
+
+
+class _PendingReplan:
+    def __init__(self, first_sim_min: int):
+        self.first_sim_min = first_sim_min
+        self.latest_sim_min = first_sim_min
+        self.events: List[Dict[str, Any]] = []
+        self.due = False  # Window closed; start as soon as no replan for this NPC is running
+        self.request_ids: List[Any] = []  # replan_request rows (leader only)
+        self.persisting: Set[asyncio.Task] = set()
+
+
+class ReplanCoordinator:
+    """Per-NPC debounce in front of run_replanning.
+
+    Events for an NPC are collected from the first one until the sim clock passes it by
+    window_min, then replanned once with a combined description. Only one replan per NPC
+    runs at a time; events arriving meanwhile wait for it and then go out together.
+    Windows are closed by on_tick(); max_wait_sec is a real-time backstop for processes
+    that don't run the tick loop.
+
+    With LEADER_LEASE_ENABLED the leader writes its pending events through to the
+    replan_request table until their replan ran, so a new leader resumes them with
+    load_pending(). Other replicas run their few requests themselves via the backstop.
+    """
+
+    def __init__(self, window_min: int, max_wait_sec: float):
+        self.window_min = window_min
+        self.max_wait_sec = max_wait_sec
+        self._pending: Dict[str, _PendingReplan] = {}
+        self._in_flight: Set[str] = set()
+        self._backstops: Set[asyncio.Task] = set()
+        self._running: Set[asyncio.Task] = set()
+        self.metrics: Dict[str, int] = {"requested": 0, "merged": 0, "replans": 0, "resumed": 0}
+
+    def request_replan(self, npc_id: str, event_info: Dict[str, Any], current_sim_min: int) -> None:
+        """Queues a replan for npc_id; returns immediately."""
+        self.metrics["requested"] += 1
+        pending = self._pending.get(npc_id)
+        if pending is None:
+            pending = self._pending[npc_id] = _PendingReplan(current_sim_min)
+            self._spawn(self._backstops, self._backstop(npc_id, pending))
+        else:
+            self.metrics["merged"] += 1
+        pending.events.append(event_info)
+        pending.latest_sim_min = max(pending.latest_sim_min, current_sim_min)
+        if self._persist_requests():
+            self._spawn(pending.persisting, self._persist(npc_id, pending, event_info, current_sim_min))
+        if self.window_min <= 0:
+            pending.due = True
+            self._start_if_idle(npc_id)
+
+    @staticmethod
+    def _persist_requests() -> bool:
+        if not settings.LEADER_LEASE_ENABLED:
+            return False
+        from .leader import leader_lease
+        return leader_lease.is_leader
+
+    async def _persist(self, npc_id: str, pending: _PendingReplan, event_info: Dict[str, Any], current_sim_min: int) -> None:
+        try:
+            res = await execute_supabase_query(
+                lambda: supa.table("replan_request")
+                .insert({"npc_id": npc_id, "event_info": event_info, "sim_min": current_sim_min})
+                .execute()
+            )
+            if res and res.data:
+                pending.request_ids.append(res.data[0]["id"])
+        except Exception as e:
+            print(f"REPLAN_COORDINATOR: Error persisting replan request for NPC {npc_id}: {e}")
+
+    async def _delete_persisted(self, pending: _PendingReplan) -> None:
+        if pending.persisting:
+            await asyncio.gather(*list(pending.persisting), return_exceptions=True)
+        if not pending.request_ids:
+            return
+        try:
+            await execute_supabase_query(
+                lambda: supa.table("replan_request").delete().in_("id", pending.request_ids).execute()
+            )
+        except Exception as e:
+            print(f"REPLAN_COORDINATOR: Error deleting {len(pending.request_ids)} processed replan requests: {e}")
+
+    async def load_pending(self) -> int:
+        """Resumes the replan requests a previous leader left pending. Called when this process becomes leader."""
+        try:
+            res = await execute_supabase_query(
+                lambda: supa.table("replan_request").select("*").order("created_at").execute()
+            )
+        except Exception as e:
+            print(f"REPLAN_COORDINATOR: Error loading pending replan requests: {e}")
+            return 0
+        resumed = 0
+        for row in (res.data if res else None) or []:
+            npc_id = row["npc_id"]
+            pending = self._pending.get(npc_id)
+            if pending is None:
+                pending = self._pending[npc_id] = _PendingReplan(row["sim_min"])
+                self._spawn(self._backstops, self._backstop(npc_id, pending))
+            elif row["id"] in pending.request_ids:
+                continue
+            pending.events.append(row["event_info"] or {})
+            pending.request_ids.append(row["id"])
+            pending.first_sim_min = min(pending.first_sim_min, row["sim_min"])
+            pending.latest_sim_min = max(pending.latest_sim_min, row["sim_min"])
+            resumed += 1
+        self.metrics["resumed"] += resumed
+        return resumed
+
+    async def clear_persisted(self) -> None:
+        """Deletes every persisted replan request, e.g. when the simulation is reset."""
+        if not settings.LEADER_LEASE_ENABLED:
+            return
+        try:
+            await execute_supabase_query(
+                lambda: supa.table("replan_request").delete().gte("sim_min", 0).execute()
+            )
+        except Exception as e:
+            print(f"REPLAN_COORDINATOR: Error clearing replan requests: {e}")
+
+    def reset(self) -> None:
+        """Drops every pending replan; replans already running finish."""
+        for task in list(self._backstops):
+            task.cancel()
+        self._pending.clear()
+
+    def on_tick(self, current_sim_min: int) -> None:
+        """Starts the replans whose debounce window has passed."""
+        for npc_id, pending in list(self._pending.items()):
+            if current_sim_min >= pending.first_sim_min + self.window_min:
+                pending.due = True
+                self._start_if_idle(npc_id)
+
+    @staticmethod
+    def _spawn(tasks: Set[asyncio.Task], coro) -> None:
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _backstop(self, npc_id: str, pending: _PendingReplan) -> None:
+        await asyncio.sleep(self.max_wait_sec)
+        if self._pending.get(npc_id) is pending:
+            pending.due = True
+            self._start_if_idle(npc_id)
+
+    def _start_if_idle(self, npc_id: str) -> None:
+        pending = self._pending.get(npc_id)
+        if npc_id in self._in_flight or pending is None or not pending.due:
+            return
+        del self._pending[npc_id]
+        self._in_flight.add(npc_id)
+        self._spawn(self._running, self._run(npc_id, pending))
+
+    async def _run(self, npc_id: str, pending: _PendingReplan) -> None:
+        from .planning_and_reflection import run_replanning
+        event_info = merge_replan_events(pending.events)
+        if len(pending.events) > 1:
+            print(f"REPLAN_COORDINATOR: Merged {len(pending.events)} events into one replan for NPC {npc_id}.")
+        self.metrics["replans"] += 1
+        try:
+            await run_replanning(npc_id, event_info, pending.latest_sim_min)
+        except Exception as e:
+            print(f"REPLAN_COORDINATOR: Replan failed for NPC {npc_id}: {e}")
+        finally:
+            self._in_flight.discard(npc_id)
+        await self._delete_persisted(pending)
+        # Events whose window closed while this replan ran go out now
+        self._start_if_idle(npc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_min": self.window_min,
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            **self.metrics,
+        }
+
+    async def flush(self) -> None:
+        """Waits for running replans, e.g. before shutdown."""
+        for task in list(self._backstops):
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*list(self._running), return_exceptions=True)
+
+
+replan_coordinator = ReplanCoordinator(
+    window_min=settings.REPLAN_DEBOUNCE_SIM_MIN, max_wait_sec=settings.REPLAN_DEBOUNCE_MAX_WAIT_SEC
+)
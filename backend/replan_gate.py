@@ -0,0 +1,126 @@
+import asyncio
+import random
+from typing import Any, Dict, List, Optional, Set
+
+from .config import get_settings
+from .llm import call_llm_async
+from .memory_service import cosine_similarity, get_embedding
+
+settings = get_settings()
+
+GATE_SKIP = "skip"
+GATE_REPLAN = "replan"
+GATE_ASK = "ask"
+
+
+class ReplanGate:
+    """Decides clear replan cases locally so only ambiguous ones cost a yes/no LLM call.
+
+    Rules first: a challenge that disrupts one action (e.g. wifi_down -> "Work") matters
+    only if that action is still upcoming, and one with a priority action (e.g. fire_alarm
+    -> "Evacuate") needs a replan unless that action is already planned. Other events are
+    compared with each upcoming action title by embedding similarity: clearly unrelated
+    events are skipped, clearly related ones replanned, the rest go to the LLM.
+
+    A sample of local skips is re-asked to the LLM in the background (audit_rate), so
+    false negatives show up in the metrics without affecting the simulation.
+    """
+
+    def __init__(self, skip_below: float, replan_above: float, audit_rate: float):
+        self.skip_below = skip_below
+        self.replan_above = replan_above
+        self.audit_rate = audit_rate
+        self._title_embeddings: Dict[str, List[float]] = {}
+        self._audits: Set[asyncio.Task] = set()
+        self.metrics: Dict[str, int] = {
+            "skip_rule": 0,
+            "replan_rule": 0,
+            "skip_similarity": 0,
+            "replan_similarity": 0,
+            "ask_llm": 0,
+            "audited_skips": 0,
+            "audit_false_negatives": 0,
+        }
+
+    async def _title_embedding(self, title: str) -> Optional[List[float]]:
+        # Action titles come from the small action_def catalog, so each is embedded once
+        if title not in self._title_embeddings:
+            embedding = await get_embedding(title)
+            if embedding is None:
+                return None
+            self._title_embeddings[title] = embedding
+        return self._title_embeddings[title]
+
+    def _rule_decision(self, event_info: Dict[str, Any], upcoming_titles: List[str]) -> Optional[str]:
+        upcoming = {title.lower() for title in upcoming_titles}
+        affected_title = event_info.get("affected_action_title")
+        if affected_title:
+            return GATE_REPLAN if affected_title.lower() in upcoming else GATE_SKIP
+        priority_action = event_info.get("priority_action")
+        if priority_action:
+            return GATE_SKIP if priority_action.lower() in upcoming else GATE_REPLAN
+        return None
+
+    async def _similarity_decision(self, description: str, upcoming_titles: List[str]) -> str:
+        event_embedding = await get_embedding(description)
+        if event_embedding is None:
+            return GATE_ASK
+        best = None
+        for title in dict.fromkeys(upcoming_titles):
+            title_embedding = await self._title_embedding(title)
+            if title_embedding is not None:
+                similarity = float(cosine_similarity(event_embedding, title_embedding))
+                best = similarity if best is None else max(best, similarity)
+        if best is None:
+            return GATE_ASK
+        if best < self.skip_below:
+            return GATE_SKIP
+        if best > self.replan_above:
+            return GATE_REPLAN
+        return GATE_ASK
+
+    async def decide(self, event_info: Dict[str, Any], description: str, upcoming_titles: List[str]) -> str:
+        """Returns GATE_SKIP, GATE_REPLAN, or GATE_ASK (let the LLM decide)."""
+        decision = self._rule_decision(event_info, upcoming_titles)
+        if decision is not None:
+            self.metrics[f"{decision}_rule"] += 1
+            return decision
+        if not upcoming_titles:
+            # Nothing left to disrupt; whether to fill the rest of the day is the LLM's call
+            self.metrics["ask_llm"] += 1
+            return GATE_ASK
+        decision = await self._similarity_decision(description, upcoming_titles)
+        self.metrics["ask_llm" if decision == GATE_ASK else f"{decision}_similarity"] += 1
+        return decision
+
+    def maybe_audit_skip(self, decision_system: str, decision_user: str) -> None:
+        """Re-asks the LLM about a sample of local skips in the background and counts disagreements."""
+        if random.random() >= self.audit_rate:
+            return
+        task = asyncio.create_task(self._audit(decision_system, decision_user))
+        self._audits.add(task)
+        task.add_done_callback(self._audits.discard)
+
+    async def _audit(self, decision_system: str, decision_user: str) -> None:
+        decision_raw = await call_llm_async(decision_system, decision_user, max_tokens=10)
+        if decision_raw is None:
+            return
+        self.metrics["audited_skips"] += 1
+        if decision_raw.strip().lower().startswith("y"):
+            self.metrics["audit_false_negatives"] += 1
+            print(f"REPLAN_GATE: Audit disagrees with a local skip. Prompt: {decision_user!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "skip_below": self.skip_below,
+            "replan_above": self.replan_above,
+            "audit_rate": self.audit_rate,
+            **self.metrics,
+        }
+
+
+replan_gate = ReplanGate(
+    skip_below=settings.REPLAN_GATE_SKIP_BELOW,
+    replan_above=settings.REPLAN_GATE_REPLAN_ABOVE,
+    audit_rate=settings.REPLAN_GATE_AUDIT_RATE,
+)
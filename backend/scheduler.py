@@ -13,8 +13,29 @@ from .llm import call_llm
 from .prompts import format_traits
 from .memory_service import retrieve_memories, get_embedding
 from .services import supa, execute_supabase_query, get_area_details
-from .websocket_utils import register_ws, unregister_ws, broadcast_ws_message
-from .planning_and_reflection import run_daily_planning, run_nightly_reflection
+from .websocket_utils import (
+    register_ws,
+    unregister_ws,
+    broadcast_ws_message,
+    broadcast_state_update,
+    begin_tick_batch,
+    flush_tick_batch,
+)
+from .catalog import catalog
+from .state_cache import state_cache
+from .leader import leader_lease
+from .cooldowns import dialogue_cooldowns
+from .dialogue_queue import relationship_strength, encounter_importance
+from .replan_coordinator import replan_coordinator
+from .batch_cognition import batch_cognition
+from .sim_calendar import sim_calendar
+from .reflection_tracker import reflection_tracker, REFLECTION_MODE_INCREMENTAL
+from .planning_and_reflection import (
+    run_daily_planning,
+    run_reflection_for_npc,
+    run_planning_for_npc,
+    get_planned_npc_ids,
+)
 from .dialogue_service import (
     process_pending_dialogues as process_dialogues_ext,
     add_pending_dialogue_request as add_dialogue_request_ext,
@@ -33,6 +54,11 @@ from .scheduler_events import (
 settings = get_settings()
 # _ws_clients: List[Any] = [] # Renamed _ws to _ws_clients for clarity # REMOVE THIS LINE
 SIM_DAY_MINUTES = 24 * 60
+COGNITION_MODE_BATCH = "batch"
+DAILY_PLANNING_MIN_OF_DAY = 300  # 05:00
+NIGHTLY_REFLECTION_WINDOW_MIN = 60  # Inline reflections are spread over 00:00-01:00
+SPECULATIVE_PLANNING_WINDOW = (90, 180)  # (start, length): 01:30-04:30
+REFLECTION_CHECK_INTERVAL_MIN = 60  # How often incremental reflection triggers are checked
 MAX_CONCURRENT_DB_OPS = 5  # Tune this value
 db_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DB_OPS)
 # --- End Semaphore ---
@@ -97,7 +123,87 @@ async def get_current_sim_time_and_day() -> Dict[str, int]:
 # --- End cooldown dict ---
 
 
+def _day_of(sim_minutes_total: int) -> int:
+    return sim_minutes_total // SIM_DAY_MINUTES + 1
+
+
+def _tick_npcs(ctx: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return ctx["all_npcs_data"]
+
+
+async def _nightly_reflection_batch(occurrence: int, ctx: Dict[str, Any]) -> None:
+    if settings.COGNITION_MODE != COGNITION_MODE_BATCH or _day_of(occurrence) <= 1:
+        return
+    # Off the tick path: submitted now, applied when the batch job completes
+    day = _day_of(occurrence)
+    print(f"Submitting nightly reflection batch at start of Day {day}")
+    batch_cognition.start_night(day - 1, occurrence - 1, day, occurrence)
+
+
+async def _nightly_reflection(occurrence: int, ctx: Dict[str, Any], npc: Dict[str, Any]) -> None:
+    if settings.COGNITION_MODE == COGNITION_MODE_BATCH or _day_of(occurrence) <= 1:
+        return
+    if settings.REFLECTION_MODE == REFLECTION_MODE_INCREMENTAL:
+        return  # Reflection follows activity instead (see _reflection_check)
+    day = _day_of(occurrence)
+    # Reflect as of the effective end of the day that just ended
+    day_start = (day - 1) * SIM_DAY_MINUTES
+    await run_reflection_for_npc(npc, day - 1, day_start - 1)
+
+
+async def _reflection_check(occurrence: int, ctx: Dict[str, Any]) -> None:
+    if settings.COGNITION_MODE == COGNITION_MODE_BATCH or settings.REFLECTION_MODE != REFLECTION_MODE_INCREMENTAL:
+        return
+    await reflection_tracker.check(ctx["all_npcs_data"], _day_of(occurrence), occurrence)
+
+
+async def _speculative_planning(occurrence: int, ctx: Dict[str, Any], npc: Dict[str, Any]) -> None:
+    if not settings.SPECULATIVE_PLANNING_ENABLED:
+        return
+    if settings.COGNITION_MODE == COGNITION_MODE_BATCH and settings.BATCH_PLANNING_ENABLED:
+        return  # The night's batch job plans the day
+    day = _day_of(occurrence)
+    if npc["id"] in await get_planned_npc_ids(day):
+        return
+    await run_planning_for_npc(npc, day, occurrence)
+
+
+async def _daily_planning(occurrence: int, ctx: Dict[str, Any]) -> None:
+    day = _day_of(occurrence)
+    print(f"Running daily planning at 5 AM of Day {day}")
+    already_planned: Set[str] = set()
+    if settings.COGNITION_MODE == COGNITION_MODE_BATCH:
+        already_planned |= batch_cognition.claim_planned_npcs(day)
+    if settings.SPECULATIVE_PLANNING_ENABLED:
+        already_planned |= await get_planned_npc_ids(day)
+    await run_daily_planning(day, occurrence, exclude_npc_ids=already_planned or None)
+
+
+async def _plan_adherence(occurrence: int, ctx: Dict[str, Any]) -> None:
+    await create_plan_adherence_observations(
+        ctx["all_npcs_data"], occurrence, _day_of(occurrence), occurrence % SIM_DAY_MINUTES
+    )
+
+
+def _register_sim_jobs() -> None:
+    """Sim-clock jobs, in the order they run when one tick covers several of them."""
+    sim_calendar.every_day("nightly_reflection_batch", [0], _nightly_reflection_batch)
+    sim_calendar.spread_daily("nightly_reflection", 0, NIGHTLY_REFLECTION_WINDOW_MIN, _tick_npcs, _nightly_reflection)
+    sim_calendar.every_day(
+        "reflection_check", list(range(0, SIM_DAY_MINUTES, REFLECTION_CHECK_INTERVAL_MIN)), _reflection_check
+    )
+    sim_calendar.spread_daily("speculative_planning", *SPECULATIVE_PLANNING_WINDOW, _tick_npcs, _speculative_planning)
+    sim_calendar.every_day("daily_planning", [DAILY_PLANNING_MIN_OF_DAY], _daily_planning)
+    sim_calendar.every_day("plan_adherence", [0, 720], _plan_adherence)  # 00:00 and 12:00
+
+
+_register_sim_jobs()
+
+
 async def advance_tick():
+    # Everything broadcast during this tick goes out as one frame to batch clients
+    begin_tick_batch()
+    current_sim_minutes_total = None
     try:
         # REMOVED: current_time_data = await get_current_sim_time_and_day()
         # REMOVED: print(f"ADVANCE_TICK: === Called === Current sim time: Day {current_time_data['day']}, Min {current_time_data['sim_min']}")
@@ -159,14 +265,13 @@ async def advance_tick():
         # These are used by update_npc_actions_and_state and encounter_detection
         all_npcs_res = await execute_supabase_query(
             lambda: supa.table("npc")
-            .select("id, name, current_action_id, spawn, traits, wander_probability")
+            .select("id, name, current_action_id, spawn, traits, wander_probability, relationships")
             .execute()
         )
         all_npcs_data = all_npcs_res.data or []
-        all_areas_res = await execute_supabase_query(
-            lambda: supa.table("area").select("id, bounds").execute()
-        )
-        all_areas_data_for_tick = all_areas_res.data or []
+        await catalog.ensure_loaded()
+        await dialogue_cooldowns.ensure_loaded()
+        all_areas_data_for_tick = catalog.areas
 
         # REMOVED: print(f"ADVANCE_TICK: Before update_npc_actions_and_state. Current Time: Day {actual_current_day}, Min {new_sim_min_of_day}")
         await update_npc_actions_and_state(
@@ -205,7 +310,7 @@ async def advance_tick():
                 if distance < 10000:  # Effectively same-area check now
                     # REMOVED: print(f"ADVANCE_TICK: NPCs {npc1_name} and {npc2_name} are close enough (dist: {distance:.2f}).")
                     # REMOVED: print(f"ADVANCE_TICK: Checking cooldown for {npc1_name} and {npc2_name}.")
-                    if await are_npcs_on_cooldown(
+                    if are_npcs_on_cooldown(
                         npc1_id, npc2_id, current_sim_minutes_total
                     ):
                         # REMOVED: print(f"ADVANCE_TICK: NPCs {npc1_name} & {npc2_name} on cooldown. Skipping dialogue attempt.")
@@ -230,7 +335,12 @@ async def advance_tick():
                                 npc_b_traits=npc2_data.get("traits", []),
                                 trigger_event=f"saw {npc2_name} in {current_area_name}", # Use fetched area name
                                 current_tick=current_sim_minutes_total,
-                                area_name=current_area_name # Pass area_name
+                                area_name=current_area_name, # Pass area_name
+                                relationship=max(
+                                    relationship_strength(npc1_data.get("relationships"), npc2_id),
+                                    relationship_strength(npc2_data.get("relationships"), npc1_id),
+                                ),
+                                importance=encounter_importance(npc1_data, npc2_data),
                             )
                             # REMOVED: print(f"ADVANCE_TICK: After add_dialogue_request_ext for {npc1_name} and {npc2_name}.")
                         else:
@@ -252,48 +362,28 @@ async def advance_tick():
         await process_dialogues_ext(current_sim_minutes_total)
         # REMOVED: print(f"ADVANCE_TICK: After process_dialogues_ext. Current Time: Day {actual_current_day}, Min {new_sim_min_of_day}")
 
-        # MODIFIED: Split reflection and planning into separate conditions
-        # Run reflections at midnight (start of day)
-        if (
-            new_sim_min_of_day < settings.TICK_SIM_MIN
-        ):  # True at start of day (00:00 to 00:14 for TICK_SIM_MIN=15)
-            if actual_current_day > 1:  # Reflection for previous day
-                day_that_just_ended = actual_current_day - 1
-                reflection_context_time = (
-                    (day_that_just_ended - 1) * SIM_DAY_MINUTES
-                ) + (
-                    SIM_DAY_MINUTES - 1
-                )  # Effective end of day
-                print(
-                    f"Running nightly reflection at start of Day {actual_current_day}"
-                )
-                await run_nightly_reflection(
-                    day_that_just_ended, reflection_context_time
-                )
-
-        # MODIFIED: Run planning at 5 AM (300 minutes into the day)
-        # Using a range to ensure it triggers even with different tick intervals
-        if 300 <= new_sim_min_of_day < (300 + settings.TICK_SIM_MIN):
-            print(f"Running daily planning at 5 AM of Day {actual_current_day}")
-            await run_daily_planning(actual_current_day, current_sim_minutes_total)
-
-        # Create plan adherence observations at 12:00 and 00:00
-        if new_sim_min_of_day == 720 or new_sim_min_of_day == 0:  # 12:00 or 00:00
-            await create_plan_adherence_observations(
-                all_npcs_data,
-                current_sim_minutes_total,
-                actual_current_day,
-                new_sim_min_of_day,
-            )
+        # Nightly reflection, daily planning and plan adherence, each exactly once per
+        # occurrence whatever the tick size (see _register_sim_jobs)
+        await sim_calendar.run_due(
+            current_sim_minutes_total - increment_value,
+            current_sim_minutes_total,
+            {"all_npcs_data": all_npcs_data},
+        )
 
         # REMOVED: print(f"ADVANCE_TICK: Before spawn_random_challenge. Current Time: Day {actual_current_day}, Min {new_sim_min_of_day}")
         await spawn_random_challenge(current_sim_minutes_total, actual_current_day)
+
+        # Start the replans whose debounce window closed (dialogues, challenges, user events)
+        replan_coordinator.on_tick(current_sim_minutes_total)
         # REMOVED: print(f"ADVANCE_TICK: After spawn_random_challenge. Current Time: Day {actual_current_day}, Min {new_sim_min_of_day}")
 
         # Observation Logging (simplified log for now)
         # print(f"  Observation logging for Day {actual_current_day} - {new_sim_min_of_day // 60:02d}:{new_sim_min_of_day % 60:02d}") # REMOVE
 
-        # 5. WebSocket broadcast
+        # 5. Rebuild the shared /state snapshot once for this tick, then stream the changes
+        snapshot = await state_cache.refresh()
+        await broadcast_state_update(snapshot)
+
         # REMOVED: print(f"ADVANCE_TICK: Before broadcast_ws_message. Current Time: Day {actual_current_day}, Min {new_sim_min_of_day}")
         await broadcast_ws_message(
             "tick_update",
@@ -305,6 +395,11 @@ async def advance_tick():
         import traceback
 
         traceback.print_exc()
+    finally:
+        await flush_tick_batch(current_sim_minutes_total)
+
+
+_loop_task: Optional[asyncio.Task] = None
 
 
 # Modify _loop to call spawn_random_challenge
@@ -316,6 +411,9 @@ async def _loop():
         # REMOVED: print(f"SCHEDULER_LOOP: Iteration {loop_count} START")
         try:
             await asyncio.sleep(settings.TICK_REAL_SEC)
+            if settings.LEADER_LEASE_ENABLED and not leader_lease.is_leader:
+                print("Scheduler _loop STOPPED: leader lease no longer held.")
+                break
             await advance_tick()
             # if loop_count % NPC_ACTION_LOG_INTERVAL == 0: # Temporarily disable periodic status log to backend console
             #     print(f"--- NPC Status Update (Tick {loop_count}) ---")
@@ -331,5 +429,15 @@ async def _loop():
 
 
 def start_loop():
+    global _loop_task
     print("Scheduler start_loop CALLED")
-    asyncio.create_task(_loop())
+    if _loop_task is None or _loop_task.done():
+        _loop_task = asyncio.create_task(_loop())
+
+
+def stop_loop():
+    global _loop_task
+    if _loop_task is not None and not _loop_task.done():
+        print("Scheduler stop_loop CALLED")
+        _loop_task.cancel()
+    _loop_task = None
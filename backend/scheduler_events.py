@@ -4,6 +4,7 @@ from typing import Dict
 from .services import supa, execute_supabase_query
 from .memory_service import get_embedding
 from .websocket_utils import broadcast_ws_message
+from .catalog import catalog
 
 RANDOM_CHALLENGE_PROBABILITY = 0.05
 
@@ -78,15 +79,18 @@ async def spawn_random_challenge(current_sim_minutes_total: int, current_day: in
             await broadcast_ws_message("sim_event", ws_event_data)
             affected = await create_event_observations(challenge, current_sim_minutes_total)
             if affected:
-                from .planning_and_reflection import run_replanning
+                from .replan_coordinator import replan_coordinator
                 for npc_id in affected:
                     # Construct new event_info for replanning after a challenge
                     event_info = {
                         "source": "challenge",
                         "challenge_code": challenge.get("code", "unknown_challenge"), # e.g., "pizza_drop"
-                        "original_description": challenge.get("effect_desc", "A challenge occurred!")
+                        "original_description": challenge.get("effect_desc", "A challenge occurred!"),
+                        # Lets the replan gate decide without an LLM call
+                        "priority_action": challenge.get("priority_action"),
+                        "affected_action_title": challenge.get("metadata", {}).get("affected_action_title"),
                     }
-                    await run_replanning(npc_id, event_info, current_sim_minutes_total)
+                    replan_coordinator.request_replan(npc_id, event_info, current_sim_minutes_total)
         else:
             error_info = "No data returned from insert"
             if hasattr(event_response_obj, "error") and event_response_obj.error:
@@ -112,15 +116,10 @@ async def create_event_observations(event_data: Dict, current_sim_minutes_total:
         target_area_id = None
 
         if target_area_name:
-            area_res = await execute_supabase_query(
-                lambda: supa.table("area")
-                .select("id")
-                .eq("name", target_area_name)
-                .maybe_single()
-                .execute()
-            )
-            if area_res and area_res.data:
-                target_area_id = area_res.data.get("id")
+            await catalog.ensure_loaded()
+            target_area = catalog.area_by_name(target_area_name)
+            if target_area:
+                target_area_id = target_area.get("id")
 
         event_desc = event_data.get(
             "effect_desc",
@@ -83,11 +83,24 @@ async def execute_supabase_query(query_executable_lambda):
 # --- End Semaphore and DB Execution Helper ---
 
 # --- Core Generic Service Functions ---
+BULK_INSERT_CHUNK_SIZE = 500
+
+async def bulk_insert(table: str, rows: List[Dict], chunk_size: int = BULK_INSERT_CHUNK_SIZE) -> List[Dict]:
+    """Inserts rows as multi-row INSERTs (one request per chunk) and returns the inserted rows."""
+    inserted: List[Dict] = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        res = await execute_supabase_query(lambda: supa.table(table).insert(chunk).execute())
+        if res and res.data:
+            inserted.extend(res.data)
+    return inserted
+
 async def get_area_details(area_id: str) -> Optional[Dict]:
-    """Fetches area details by area ID."""
+    """Fetches area details by area ID from the reference catalog."""
+    from .catalog import catalog
     try:
-        response = await execute_supabase_query(lambda: supa.table('area').select('*').eq('id', area_id).maybe_single().execute())
-        return response.data if response else None
+        await catalog.ensure_loaded()
+        return catalog.area(area_id)
     except Exception as e:
         print(f"Error in get_area_details for {area_id}: {e}")
         return None
@@ -118,20 +131,9 @@ async def get_npc_ui_details(npc_id_to_fetch: str, current_day_from_env: int) ->
             return None
         npc_name = npc_info_res.data['name']
 
-        # Cache of area IDs to names for quick lookup
-        area_cache = {}
-        areas_res = await execute_supabase_query(lambda: supa.table('area').select('id, name').execute())
-        if areas_res and areas_res.data:
-            for area in areas_res.data:
-                area_cache[area['id']] = area['name']
-
-        # Cache of object IDs to area names
-        object_to_area_cache = {}
-        objects_res = await execute_supabase_query(lambda: supa.table('object').select('id, area_id').execute())
-        if objects_res and objects_res.data:
-            for obj in objects_res.data:
-                if obj['area_id'] in area_cache:
-                    object_to_area_cache[obj['id']] = area_cache[obj['area_id']]
+        # Object -> area name lookups come from the reference catalog
+        from .catalog import catalog
+        await catalog.ensure_loaded()
 
         # Get the last completed action (for backward compatibility)
         last_completed_action_info = None
@@ -169,9 +171,7 @@ async def get_npc_ui_details(npc_id_to_fetch: str, current_day_from_env: int) ->
             for idx, ad in enumerate(unique_actions.values()):
                 sm = ad.get('start_min')
                 t = f"{sm // 60:02d}:{sm % 60:02d}" if sm is not None else ""
-                area_name = None
-                if ad.get('object_id') and ad['object_id'] in object_to_area_cache:
-                    area_name = object_to_area_cache[ad['object_id']]
+                area_name = catalog.object_area_name(ad.get('object_id'))
                 action_info = ActionInfo(
                     time=t, 
                     title=ad.get('def_id',{}).get('title','?'), 
@@ -206,9 +206,7 @@ async def get_npc_ui_details(npc_id_to_fetch: str, current_day_from_env: int) ->
                         status_str = act_detail.get('status', 'unknown')
                         
                         # Get area name if object_id is available
-                        area_name = None
-                        if act_detail.get('object_id') and act_detail['object_id'] in object_to_area_cache:
-                            area_name = object_to_area_cache[act_detail['object_id']]
+                        area_name = catalog.object_area_name(act_detail.get('object_id'))
                         
                         # Populate Current Day's Plan Summary
                         location_str = f" in {area_name}" if area_name else ""
@@ -286,78 +284,88 @@ async def get_npc_ui_details(npc_id_to_fetch: str, current_day_from_env: int) ->
         import traceback; traceback.print_exc()
         return None
 
-async def get_dialogue_transcript(dialogue_id_str: str) -> Optional[List[Dict]]:
-    """Fetches all turns for a given dialogue_id, along with speaker names."""
+def format_dialogue_turn(speaker_name: str, text: str, sim_min: int) -> Dict:
+    """Shapes one dialogue turn the way DialogueTurnResponse expects it."""
+    day_num = sim_min // 1440 + 1
+    min_of_day = sim_min % 1440
+    hour = min_of_day // 60
+    minute = min_of_day % 60
+    return {
+        "speaker_name": speaker_name,
+        "text": text,
+        "sim_min_of_turn": sim_min,
+        "timestamp_str": f"Day {day_num}, {hour:02d}:{minute:02d}"
+    }
+
+async def get_dialogue_transcripts(dialogue_ids: List[str]) -> Optional[Dict[str, List[Dict]]]:
+    """Fetches the turns of several dialogues in one query, keyed by dialogue_id.
+
+    Dialogues without turns map to an empty list; returns None on a DB error.
+    """
+    if not dialogue_ids:
+        return {}
     try:
         turns_res = await execute_supabase_query(
             lambda: supa.table('dialogue_turn')
-            .select('text, sim_min, speaker_id, npc:speaker_id ( name )' ) # Fetch speaker's name via relationship
-            .eq('dialogue_id', dialogue_id_str)
+            .select('dialogue_id, text, sim_min, speaker_id, npc:speaker_id ( name )' ) # Fetch speaker's name via relationship
+            .in_('dialogue_id', dialogue_ids)
             .order('sim_min', desc=False) # Order turns chronologically
             .execute()
         )
 
-        if not (turns_res and turns_res.data):
-            print(f"No turns found for dialogue_id: {dialogue_id_str}")
-            return [] # Return empty list if no turns
-
-        formatted_turns = []
-        for turn_data in turns_res.data:
+        transcripts: Dict[str, List[Dict]] = {dialogue_id: [] for dialogue_id in dialogue_ids}
+        for turn_data in ((turns_res.data if turns_res else None) or []):
             speaker_name = "Unknown"
             # The foreign table join with Supabase Python client might nest the speaker name
             if turn_data.get('npc') and isinstance(turn_data['npc'], dict):
                 speaker_name = turn_data['npc'].get('name', "Unknown")
-            elif turn_data.get('speaker_id'): # Fallback if join didn't populate as expected
-                # This would require another query per turn, less efficient.
-                # The join 'npc:speaker_id ( name )' should handle this.
-                # For now, rely on the join.
-                pass
-            
-            sim_min = turn_data.get('sim_min', 0)
-            day_num = sim_min // 1440 + 1
-            min_of_day = sim_min % 1440
-            hour = min_of_day // 60
-            minute = min_of_day % 60
-            timestamp_str = f"Day {day_num}, {hour:02d}:{minute:02d}"
-
-            formatted_turns.append({
-                "speaker_name": speaker_name,
-                "text": turn_data.get('text', ""),
-                "sim_min_of_turn": sim_min,
-                "timestamp_str": timestamp_str
-            })
-        
-        return formatted_turns
+            transcripts.setdefault(turn_data['dialogue_id'], []).append(
+                format_dialogue_turn(speaker_name, turn_data.get('text', ""), turn_data.get('sim_min', 0) or 0)
+            )
+        return transcripts
     except Exception as e:
-        print(f"Error in get_dialogue_transcript for {dialogue_id_str}: {e}")
+        print(f"Error in get_dialogue_transcripts for {len(dialogue_ids)} dialogues: {e}")
         import traceback; traceback.print_exc()
         return None
 
+async def get_dialogue_transcript(dialogue_id_str: str) -> Optional[List[Dict]]:
+    """Fetches all turns for a given dialogue_id, along with speaker names."""
+    transcripts = await get_dialogue_transcripts([dialogue_id_str])
+    if transcripts is None:
+        return None
+    if not transcripts.get(dialogue_id_str):
+        print(f"No turns found for dialogue_id: {dialogue_id_str}")
+    return transcripts.get(dialogue_id_str, [])
+
 # Ensure get_state also uses the local execute_supabase_query for all its direct supa calls.
 async def get_state():
+    from .catalog import catalog
     try:
+        await catalog.ensure_loaded()
         npcs_res = await execute_supabase_query(lambda: supa.table('npc').select('id, name, traits, backstory, relationships, spawn, energy, current_action_id').execute())
-        areas_res = await execute_supabase_query(lambda: supa.table('area').select('*').execute())
         sim_clock_res = await execute_supabase_query(lambda: supa.table('sim_clock').select('sim_min').eq('id', 1).maybe_single().execute())
         environment_res = await execute_supabase_query(lambda: supa.table('environment').select('day').eq('id', 1).maybe_single().execute())
-        action_defs_res = await execute_supabase_query(lambda: supa.table('action_def').select('id, emoji, title').execute())
         
-        def_id_to_emoji_title = { ad['id']: {'emoji': ad.get('emoji', '❓'), 'title': ad.get('title', 'Unknown')} for ad in (action_defs_res.data or []) }
         processed_npcs = []
         if npcs_res and npcs_res.data:
+            # One lookup for every NPC's current action instead of one query per NPC
+            current_action_ids = list({npc['current_action_id'] for npc in npcs_res.data if npc.get('current_action_id')})
+            current_actions_by_id = {}
+            if current_action_ids:
+                action_inst_res = await execute_supabase_query(lambda: supa.table('action_instance').select('id, def_id, status').in_('id', current_action_ids).execute())
+                current_actions_by_id = {inst['id']: inst for inst in ((action_inst_res.data if action_inst_res else None) or [])}
             for npc_data in npcs_res.data:
                 current_action_instance_id = npc_data.get('current_action_id')
-                emoji = "🧍"; action_title_for_log = "Idle"
-                if current_action_instance_id:
-                    action_inst_res = await execute_supabase_query(lambda: supa.table('action_instance').select('def_id, status').eq('id', current_action_instance_id).maybe_single().execute())
-                    if action_inst_res and action_inst_res.data and action_inst_res.data.get('status') == 'active':
-                        action_def_id = action_inst_res.data.get('def_id')
-                        if action_def_id and action_def_id in def_id_to_emoji_title:
-                            emoji = def_id_to_emoji_title[action_def_id]['emoji']
+                emoji = "🧍"
+                action_inst = current_actions_by_id.get(current_action_instance_id) if current_action_instance_id else None
+                if action_inst and action_inst.get('status') == 'active':
+                    action_def = catalog.action_def(action_inst.get('def_id'))
+                    if action_def:
+                        emoji = action_def.get('emoji', '❓')
                 processed_npcs.append({**npc_data, 'x': npc_data.get('spawn', {}).get('x'), 'y': npc_data.get('spawn', {}).get('y'), 'emoji': emoji })
         
         return {
-            "npcs": processed_npcs, "areas": (areas_res.data if areas_res else []),
+            "npcs": processed_npcs, "areas": catalog.areas,
             "sim_clock": (sim_clock_res.data if sim_clock_res else {"sim_min": 0}), 
             "environment": (environment_res.data if environment_res else {"day": 1})
         }
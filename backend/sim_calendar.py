@@ -0,0 +1,271 @@
+import asyncio
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from postgrest.exceptions import APIError
+
+from .services import supa, execute_supabase_query
+
+SIM_DAY_MINUTES = 24 * 60
+
+# (occurrence sim minute total, tick context) -> None
+DailyHandler = Callable[[int, Dict[str, Any]], Awaitable[None]]
+# (occurrence sim minute total, tick context, item) -> None
+SpreadHandler = Callable[[int, Dict[str, Any], Dict[str, Any]], Awaitable[None]]
+# tick context -> items to spread (e.g. the tick's NPC rows)
+ItemsProvider = Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+
+
+class _DailyJob:
+    def __init__(self, name: str, minutes_of_day: List[int], handler: DailyHandler):
+        self.name = name
+        self.minutes_of_day = minutes_of_day
+        self.handler = handler
+
+
+class _SpreadJob:
+    def __init__(self, name: str, window_start_min: int, window_len_min: int, items: ItemsProvider, handler: SpreadHandler):
+        self.name = name
+        self.window_start_min = window_start_min
+        self.window_len_min = window_len_min
+        self.items = items
+        self.handler = handler
+
+    def offset(self, item_key: str) -> int:
+        """Stable per-item minute within the window, so the work is spread but reproducible."""
+        return zlib.crc32(item_key.encode("utf-8")) % max(self.window_len_min, 1)
+
+
+def _occurrences(minute_of_day: int, after_total: int, up_to_total: int) -> List[int]:
+    """Sim-minute totals in (after_total, up_to_total] that fall on minute_of_day."""
+    first_day = after_total // SIM_DAY_MINUTES
+    last_day = up_to_total // SIM_DAY_MINUTES
+    return [
+        day * SIM_DAY_MINUTES + minute_of_day
+        for day in range(first_day, last_day + 1)
+        if after_total < day * SIM_DAY_MINUTES + minute_of_day <= up_to_total
+    ]
+
+
+SimJobKey = Tuple[str, int, str]  # (job name, occurrence sim minute total, item key)
+
+# Status of a claimed occurrence in sim_job_run
+SIM_JOB_RUNNING = "running"
+SIM_JOB_DONE = "done"
+SIM_JOB_RETRY = "retry"
+SIM_JOB_FAILED = "failed"
+SIM_JOB_MAX_ATTEMPTS = 3
+
+
+class SimCalendar:
+    """Cron-like jobs on the sim clock that run exactly once, whatever the tick size.
+
+    Each tick passes the sim-minute interval it advanced over, (previous, current]; every
+    job occurrence inside it is due, so a 12:00 job still fires when /set_speed makes
+    ticks skip over 12:00. Daily jobs fire at fixed minutes of the day. Spread jobs fire
+    once per item (e.g. per NPC) at a stable offset inside a window, so per-NPC work is
+    spread over the window instead of landing on one tick.
+
+    Occurrences are claimed in the sim_job_run table before they run and marked done only
+    once their handler succeeded, so a restart or a new leader re-running the same tick
+    does not repeat them. A failed occurrence is retried on the following ticks (up to
+    SIM_JOB_MAX_ATTEMPTS runs); occurrences left running or awaiting a retry by a crashed
+    process are picked up by the next run_due() after start-up or recover(). Without the
+    table (the create_sim_job_run migration) claims are kept in memory for this process only.
+    """
+
+    def __init__(self):
+        self._daily: List[_DailyJob] = []
+        self._spread: List[_SpreadJob] = []
+        self._claimed: Set[SimJobKey] = set()
+        self._attempts: Dict[SimJobKey, int] = {}  # Occurrences that failed and wait for a retry
+        self._recover_pending = True
+        self._persist_claims = True
+        self.metrics: Dict[str, int] = {"runs": 0, "skipped_already_claimed": 0, "failed": 0, "retried": 0, "given_up": 0}
+
+    def every_day(self, name: str, minutes_of_day: List[int], handler: DailyHandler) -> None:
+        self._daily.append(_DailyJob(name, minutes_of_day, handler))
+
+    def spread_daily(self, name: str, window_start_min: int, window_len_min: int, items: ItemsProvider, handler: SpreadHandler) -> None:
+        self._spread.append(_SpreadJob(name, window_start_min, window_len_min, items, handler))
+
+    def _due(self, after_total: int, up_to_total: int, context: Dict[str, Any]) -> List[Tuple[str, int, str, Callable[[], Awaitable[None]]]]:
+        due = []
+        for job in self._daily:
+            for minute_of_day in job.minutes_of_day:
+                for occurrence in _occurrences(minute_of_day, after_total, up_to_total):
+                    due.append((job.name, occurrence, "", lambda job=job, occurrence=occurrence: job.handler(occurrence, context)))
+        for job in self._spread:
+            for item in job.items(context):
+                item_key = str(item["id"])
+                for occurrence in _occurrences(job.window_start_min + job.offset(item_key), after_total, up_to_total):
+                    due.append((job.name, occurrence, item_key, lambda job=job, occurrence=occurrence, item=item: job.handler(occurrence, context, item)))
+        return due
+
+    def _retries(self, context: Dict[str, Any]) -> List[Tuple[str, int, str, Callable[[], Awaitable[None]]]]:
+        """Runs for the occurrences waiting for a retry, bound to this tick's context."""
+        retries = []
+        for job in self._daily:
+            for name, occurrence, item_key in sorted(key for key in self._attempts if key[0] == job.name):
+                retries.append((name, occurrence, item_key, lambda job=job, occurrence=occurrence: job.handler(occurrence, context)))
+        for job in self._spread:
+            keys = sorted(key for key in self._attempts if key[0] == job.name)
+            if not keys:
+                continue
+            items_by_key = {str(item["id"]): item for item in job.items(context)}
+            for key in keys:
+                item = items_by_key.get(key[2])
+                if item is None:  # The item (e.g. the NPC) is gone
+                    del self._attempts[key]
+                    continue
+                retries.append((*key, lambda job=job, occurrence=key[1], item=item: job.handler(occurrence, context, item)))
+        return retries
+
+    async def _claim(self, keys: List[SimJobKey]) -> Set[SimJobKey]:
+        """Claims occurrences in one round trip; returns the ones this call now owns."""
+        keys = [key for key in keys if key not in self._claimed]
+        if not keys:
+            return set()
+        claimed = set(keys)
+        if self._persist_claims:
+            rows = [
+                {"job_name": name, "occurrence_sim_min": occurrence, "item_key": item_key, "status": SIM_JOB_RUNNING, "attempts": 1}
+                for name, occurrence, item_key in keys
+            ]
+            try:
+                res = await execute_supabase_query(
+                    lambda: supa.table("sim_job_run")
+                    .upsert(rows, on_conflict="job_name,occurrence_sim_min,item_key", ignore_duplicates=True)
+                    .execute()
+                )
+                claimed = {
+                    (row["job_name"], row["occurrence_sim_min"], row.get("item_key") or "")
+                    for row in ((res.data if res else None) or [])
+                }
+            except APIError as e:
+                print(f"SIM_CALENDAR: Cannot persist job claims ({e.code}: {e.message}); claiming in memory only.")
+                self._persist_claims = False
+        self._claimed.update(keys)
+        return claimed
+
+    async def _record(self, outcomes: Dict[SimJobKey, Tuple[str, int]]) -> None:
+        """Writes the (status, attempts) of finished runs in one round trip."""
+        if not outcomes or not self._persist_claims:
+            return
+        rows = [
+            {"job_name": name, "occurrence_sim_min": occurrence, "item_key": item_key, "status": status, "attempts": attempts}
+            for (name, occurrence, item_key), (status, attempts) in outcomes.items()
+        ]
+        try:
+            await execute_supabase_query(
+                lambda: supa.table("sim_job_run").upsert(rows, on_conflict="job_name,occurrence_sim_min,item_key").execute()
+            )
+        except APIError as e:
+            print(f"SIM_CALENDAR: Could not record job outcomes ({e.code}: {e.message}).")
+
+    def recover(self) -> None:
+        """Makes the next run_due() pick up occurrences a previous process left unfinished, e.g. on becoming leader."""
+        self._recover_pending = True
+
+    async def _recover(self, up_to_total: int) -> None:
+        self._recover_pending = False
+        if not self._persist_claims:
+            return
+        try:
+            res = await execute_supabase_query(
+                lambda: supa.table("sim_job_run")
+                .select("job_name, occurrence_sim_min, item_key, attempts")
+                .in_("status", [SIM_JOB_RUNNING, SIM_JOB_RETRY])
+                .gt("occurrence_sim_min", up_to_total - 2 * SIM_DAY_MINUTES)
+                .lte("occurrence_sim_min", up_to_total)
+                .execute()
+            )
+        except APIError as e:
+            print(f"SIM_CALENDAR: Cannot load unfinished jobs ({e.code}: {e.message}).")
+            return
+        for row in (res.data if res else None) or []:
+            key = (row["job_name"], row["occurrence_sim_min"], row.get("item_key") or "")
+            self._claimed.add(key)
+            self._attempts[key] = row.get("attempts") or 1
+        if self._attempts:
+            print(f"SIM_CALENDAR: Resuming {len(self._attempts)} unfinished job occurrence(s).")
+
+    async def run_due(self, after_total: int, up_to_total: int, context: Dict[str, Any]) -> None:
+        """Runs every job occurrence in (after_total, up_to_total] not run before, after
+        retrying the occurrences that failed on earlier ticks.
+
+        Jobs run in registration order; the items of one spread job run concurrently.
+        """
+        # Claims older than two sim days can no longer come due
+        self._claimed = {key for key in self._claimed if key[1] > up_to_total - 2 * SIM_DAY_MINUTES}
+        if self._recover_pending:
+            await self._recover(up_to_total)
+        runs = self._retries(context)
+        self.metrics["retried"] += len(runs)
+        due = self._due(after_total, up_to_total, context)
+        if due:
+            claimed = await self._claim([(name, occurrence, item_key) for name, occurrence, item_key, _ in due])
+            self.metrics["skipped_already_claimed"] += len(due) - len(claimed)
+            runs += [run for run in due if run[:3] in claimed]
+        if not runs:
+            return
+        outcomes: Dict[SimJobKey, Tuple[str, int]] = {}
+        batch: List[Tuple[str, int, str, Callable[[], Awaitable[None]]]] = []
+        for run in runs + [(None, 0, "", None)]:
+            if batch and run[0] != batch[0][0]:
+                outcomes.update(await self._run_batch(batch))
+                batch = []
+            if run[3] is not None:
+                batch.append(run)
+        await self._record(outcomes)
+
+    async def _run_batch(self, batch: List[Tuple[str, int, str, Callable[[], Awaitable[None]]]]) -> Dict[SimJobKey, Tuple[str, int]]:
+        """Runs one job's occurrences concurrently; returns each one's (status, attempts)."""
+        results = await asyncio.gather(*[run() for *_, run in batch], return_exceptions=True)
+        outcomes = {}
+        for (name, occurrence, item_key, _), result in zip(batch, results):
+            key = (name, occurrence, item_key)
+            attempts = self._attempts.pop(key, 0) + 1
+            if not isinstance(result, Exception):
+                self.metrics["runs"] += 1
+                outcomes[key] = (SIM_JOB_DONE, attempts)
+                continue
+            self.metrics["failed"] += 1
+            if attempts < SIM_JOB_MAX_ATTEMPTS:
+                print(f"SIM_CALENDAR: Job '{name}' at sim minute {occurrence} failed (attempt {attempts}), retrying next tick: {result}")
+                self._attempts[key] = attempts
+                outcomes[key] = (SIM_JOB_RETRY, attempts)
+            else:
+                print(f"SIM_CALENDAR: Job '{name}' at sim minute {occurrence} failed {attempts} times, giving up: {result}")
+                self.metrics["given_up"] += 1
+                outcomes[key] = (SIM_JOB_FAILED, attempts)
+        return outcomes
+
+    def forget(self, from_sim_min: int) -> None:
+        """Forgets this process's claims and retries of occurrences at or after from_sim_min."""
+        self._claimed = {key for key in self._claimed if key[1] < from_sim_min}
+        self._attempts = {key: attempts for key, attempts in self._attempts.items() if key[1] < from_sim_min}
+
+    async def reset(self, from_sim_min: int) -> None:
+        """Forgets claims of occurrences at or after from_sim_min, e.g. after the clock is set back."""
+        self.forget(from_sim_min)
+        if not self._persist_claims:
+            return
+        try:
+            await execute_supabase_query(
+                lambda: supa.table("sim_job_run").delete().gte("occurrence_sim_min", from_sim_min).execute()
+            )
+        except APIError as e:
+            print(f"SIM_CALENDAR: Could not delete job claims from sim minute {from_sim_min} ({e.code}: {e.message}).")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "daily_jobs": [job.name for job in self._daily],
+            "spread_jobs": [job.name for job in self._spread],
+            "persist_claims": self._persist_claims,
+            "awaiting_retry": len(self._attempts),
+            **self.metrics,
+        }
+
+
+sim_calendar = SimCalendar()
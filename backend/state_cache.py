@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import json
+from typing import Dict, Optional
+
+from .services import get_state
+
+SIM_DAY_MINUTES = 24 * 60
+
+# NPC fields that make an NPC part of a per-tick state_delta when they change
+DELTA_NPC_FIELDS = ("x", "y", "spawn", "current_action_id", "emoji")
+
+
+def tick_of_state(state: Dict) -> int:
+    """Absolute sim minute (the tick number) a get_state() payload was taken at."""
+    sim_min = (state.get("sim_clock") or {}).get("sim_min", 0) or 0
+    day = (state.get("environment") or {}).get("day", 1) or 1
+    return (day - 1) * SIM_DAY_MINUTES + sim_min
+
+
+def compute_state_delta(previous: Dict, current: Dict) -> Dict:
+    """Returns only the NPCs whose position, current action or emoji changed.
+
+    NPCs that appeared are sent in full, NPCs that disappeared are listed by id.
+    """
+    previous_npcs = {npc["id"]: npc for npc in previous.get("npcs", [])}
+    changed_npcs = []
+    for npc in current.get("npcs", []):
+        old_npc = previous_npcs.pop(npc["id"], None)
+        if old_npc is None:
+            changed_npcs.append(npc)
+        elif any(old_npc.get(field) != npc.get(field) for field in DELTA_NPC_FIELDS):
+            changed_npcs.append({"id": npc["id"], **{field: npc.get(field) for field in DELTA_NPC_FIELDS}})
+    return {
+        "npcs": changed_npcs,
+        "removed_npc_ids": list(previous_npcs.keys()),
+        "sim_clock": current.get("sim_clock"),
+        "environment": current.get("environment"),
+    }
+
+
+class StateSnapshot:
+    """A get_state() payload pre-serialized once and shared by every /state reader.
+
+    seq increases by one for every snapshot built; delta holds the changes against
+    the snapshot with seq - 1, or None when there was no previous snapshot.
+    """
+
+    def __init__(self, seq: int, tick: int, state: Dict, delta: Optional[Dict] = None):
+        self.seq = seq
+        self.tick = tick
+        self.state = state
+        self.delta = delta
+        self.body: bytes = json.dumps(state, separators=(",", ":")).encode("utf-8")
+        # Over the content, not the tick: a reset or reseed revisits tick numbers with other bodies
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def snapshot_message_data(self) -> Dict:
+        return {"seq": self.seq, "tick": self.tick, "state": self.state}
+
+    def delta_message_data(self) -> Optional[Dict]:
+        if self.delta is None:
+            return None
+        return {"seq": self.seq, "tick": self.tick, **self.delta}
+
+
+class StateSnapshotCache:
+    """Holds the /state snapshot for the current tick.
+
+    The scheduler rebuilds it once at the end of every tick; readers never query the
+    DB themselves, so UI load stays constant regardless of how many viewers poll.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._snapshot: Optional[StateSnapshot] = None
+        self._seq = 0
+
+    async def refresh(self) -> StateSnapshot:
+        """Builds a fresh snapshot from the DB. Called once per tick by the scheduler."""
+        async with self._lock:
+            return await self._build_unlocked()
+
+    async def get_snapshot(self) -> StateSnapshot:
+        """Returns the current snapshot, building it only if none exists yet."""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        async with self._lock:
+            if self._snapshot is None:
+                await self._build_unlocked()
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """Drops the snapshot, e.g. after a reset or reseed moved the clock or NPCs."""
+        self._snapshot = None
+
+    def follow_remote(self, message_type: str, data: Dict, state: Optional[Dict] = None) -> None:
+        """Keeps a non-ticking worker in step with the snapshots the ticking process publishes.
+
+        A full state_snapshot is adopted as-is, and so is the full state the ticker sends
+        along with a state_delta. A state_delta without it drops the local snapshot so the
+        next reader rebuilds it from the DB under the ticker's seq number.
+        """
+        if message_type == "state_snapshot" and data.get("state") is not None:
+            self._seq = data["seq"]
+            self._snapshot = StateSnapshot(data["seq"], data["tick"], data["state"])
+        elif message_type == "state_delta" and state is not None:
+            self._seq = data["seq"]
+            delta = {key: value for key, value in data.items() if key not in ("seq", "tick")}
+            self._snapshot = StateSnapshot(data["seq"], data["tick"], state, delta)
+        elif message_type == "state_delta":
+            self._seq = data["seq"] - 1
+            self._snapshot = None
+
+    async def _build_unlocked(self) -> StateSnapshot:
+        state = await get_state()
+        previous = self._snapshot
+        delta = compute_state_delta(previous.state, state) if previous is not None else None
+        self._seq += 1
+        self._snapshot = StateSnapshot(self._seq, tick_of_state(state), state, delta)
+        return self._snapshot
+
+
+state_cache = StateSnapshotCache()
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .services import format_dialogue_turn, get_dialogue_transcripts
+
+TRANSCRIPT_CACHE_SIZE = 512
+
+# A finished transcript never changes, so browsers may keep it for good
+TRANSCRIPT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class CachedTranscript:
+    """A finished dialogue transcript, serialized once with a strong ETag over its bytes."""
+
+    def __init__(self, dialogue_id: str, turns: List[Dict]):
+        self.dialogue_id = dialogue_id
+        self.turns = turns
+        self.body: bytes = json.dumps({"dialogue_id": dialogue_id, "turns": turns}, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+
+class TranscriptCache:
+    """LRU of finished dialogue transcripts keyed by dialogue id.
+
+    Filled by the dialogue service as soon as a transcript is written and, on a miss,
+    from the DB. Only transcripts with turns are cached: turns are written in a single
+    insert once the dialogue is over, so a non-empty transcript is final.
+    """
+
+    def __init__(self, max_size: int = TRANSCRIPT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, CachedTranscript]" = OrderedDict()
+
+    def get(self, dialogue_id: str) -> Optional[CachedTranscript]:
+        entry = self._entries.get(dialogue_id)
+        if entry is not None:
+            self._entries.move_to_end(dialogue_id)
+        return entry
+
+    def put(self, dialogue_id: str, turns: List[Dict]) -> Optional[CachedTranscript]:
+        if not turns:
+            return None
+        entry = CachedTranscript(dialogue_id, turns)
+        self._entries[dialogue_id] = entry
+        self._entries.move_to_end(dialogue_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def put_written(self, dialogue_id: str, turns: List[Dict[str, str]], start_min: int, minutes_per_turn: int) -> None:
+        """Caches a transcript straight from the turns the dialogue service just persisted."""
+        self.put(dialogue_id, [
+            format_dialogue_turn(turn["speaker"], turn["line"], start_min + index * minutes_per_turn)
+            for index, turn in enumerate(turns)
+        ])
+
+    async def get_many(self, dialogue_ids: List[str]) -> Optional[Dict[str, List[Dict]]]:
+        """Turns for each requested dialogue; misses are loaded together in one query."""
+        transcripts: Dict[str, List[Dict]] = {}
+        missing_ids = []
+        for dialogue_id in dict.fromkeys(dialogue_ids):
+            entry = self.get(dialogue_id)
+            if entry is not None:
+                transcripts[dialogue_id] = entry.turns
+            else:
+                missing_ids.append(dialogue_id)
+        if missing_ids:
+            loaded = await get_dialogue_transcripts(missing_ids)
+            if loaded is None:
+                return None
+            for dialogue_id in missing_ids:
+                turns = loaded.get(dialogue_id, [])
+                self.put(dialogue_id, turns)
+                transcripts[dialogue_id] = turns
+        return transcripts
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+transcript_cache = TranscriptCache()
@@ -1,35 +1,424 @@
+import asyncio
 import json
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional, Set, Iterable, Union
 
-_ws_clients: List[Any] = []
+import msgpack
 
-def register_ws(ws: Any):
-    # Ensure client is not already registered before appending
+from .pubsub import PROCESS_ID, create_bridge
+
+# Each client gets a bounded send queue drained by its own writer task, so a slow
+# browser only ever delays itself. Messages that don't fit are dropped (and counted);
+# a client that keeps dropping is disconnected.
+WS_SEND_QUEUE_SIZE = 256
+WS_MAX_CONSECUTIVE_DROPS = 64
+
+WS_ENCODING_JSON = "json"
+WS_ENCODING_MSGPACK = "msgpack"
+
+# Topics a client can subscribe to: "clock", "positions", "events", "dialogue" and
+# "npc:<id>" for everything about one NPC. "*" (the default) receives every message.
+WS_TOPIC_ALL = "*"
+WS_TOPIC_CLOCK = "clock"
+WS_TOPIC_POSITIONS = "positions"
+WS_TOPIC_EVENTS = "events"
+WS_TOPIC_DIALOGUE = "dialogue"
+
+
+def npc_topic(npc_id: Optional[str]) -> Optional[str]:
+    return f"npc:{npc_id}" if npc_id else None
+
+
+def topics_for_message(message_type: str, data: Dict) -> Set[str]:
+    """Derives the topics a broadcast belongs to from its type and payload."""
+    if message_type == "tick_update":
+        return {WS_TOPIC_CLOCK}
+    if message_type in ("state_snapshot", "state_delta"):
+        return {WS_TOPIC_CLOCK, WS_TOPIC_POSITIONS}
+    if message_type in ("dialogue_event", "dialogue_turn"):
+        topics = {WS_TOPIC_DIALOGUE}
+        npc_ids = [data.get("npc_id"), data.get("npc_a_id"), data.get("npc_b_id")]
+    elif message_type == "social_event":
+        topics = {WS_TOPIC_EVENTS}
+        npc_ids = [data.get("observer_npc_id")]
+    else:
+        # sim_event, action_start, planning_event, reflection_event, replan_event, ...
+        topics = {WS_TOPIC_EVENTS}
+        npc_ids = [data.get("npc_id")]
+    topics.update(npc_topic(npc_id) for npc_id in npc_ids if npc_id)
+    return topics
+
+
+class WSClient:
+    """A registered WebSocket plus its send queue, writer task and counters.
+
+    batch clients receive everything broadcast during a tick as one "batch" frame;
+    msgpack clients receive binary frames instead of JSON text.
+    """
+
+    def __init__(self, ws: Any, batch: bool = False, encoding: str = WS_ENCODING_JSON):
+        self.ws = ws
+        self.batch = batch
+        self.encoding = encoding
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.sent = 0
+        self.dropped = 0
+        self.consecutive_drops = 0
+        self.writer_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, payload: Union[str, bytes]) -> bool:
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.consecutive_drops += 1
+            return False
+        self.consecutive_drops = 0
+        return True
+
+    async def _writer(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                if isinstance(payload, bytes):
+                    await self.ws.send_bytes(payload)
+                else:
+                    await self.ws.send_text(payload)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error sending WS message to client {self.ws}: {e} - Removing client.")
+                _remove_client(self.ws)
+                return
+
+    def stop(self):
+        if self.writer_task and not self.writer_task.done():
+            self.writer_task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "client": str(getattr(self.ws, "client", None) or id(self.ws)),
+            "batch": self.batch,
+            "encoding": self.encoding,
+            "topics": sorted(self.topics),
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+
+_ws_clients: Dict[Any, WSClient] = {}
+
+# topic -> clients subscribed to it, so a broadcast only visits interested clients
+_topic_subscribers: Dict[str, Set[WSClient]] = {}
+
+# Broadcasts go through a pub/sub bridge: the publishing (ticking) process wraps each
+# message in an envelope and every process fans envelopes out to its own sockets.
+# The default bridge is in-process; see pubsub.py for the cross-process one.
+_bridge = None
+
+# True while the publishing process is inside a tick; messages published meanwhile
+# are marked "batched" so receivers hold them back for their batch clients.
+_tick_batch_open = False
+
+# (message, topics) pairs received as "batched", held back for this process's batch
+# clients until the matching flush envelope arrives.
+_tick_batch_events: List[tuple] = []
+
+
+def subscribe_ws(ws: Any, topics: Iterable[str]) -> List[str]:
+    client = _ws_clients.get(ws)
+    if not client:
+        return []
+    for topic in topics:
+        if isinstance(topic, str) and topic:
+            client.topics.add(topic)
+            _topic_subscribers.setdefault(topic, set()).add(client)
+    return sorted(client.topics)
+
+
+def unsubscribe_ws(ws: Any, topics: Iterable[str]) -> List[str]:
+    client = _ws_clients.get(ws)
+    if not client:
+        return []
+    for topic in topics:
+        client.topics.discard(topic)
+        subscribers = _topic_subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del _topic_subscribers[topic]
+    return sorted(client.topics)
+
+
+def _subscribers_for(topics: Set[str]) -> Set[WSClient]:
+    recipients: Set[WSClient] = set(_topic_subscribers.get(WS_TOPIC_ALL, ()))
+    for topic in topics:
+        recipients.update(_topic_subscribers.get(topic, ()))
+    return recipients
+
+
+def register_ws(
+    ws: Any,
+    batch: bool = False,
+    encoding: str = WS_ENCODING_JSON,
+    topics: Optional[Iterable[str]] = None,
+) -> Dict:
+    """Registers a client and returns the framing actually negotiated for it.
+
+    The negotiated framing is queued as the client's first message, a JSON "ws_config"
+    text frame, so the client learns it before any other (possibly binary) frame.
+    """
+    if encoding not in (WS_ENCODING_JSON, WS_ENCODING_MSGPACK):
+        encoding = WS_ENCODING_JSON
+    # Ensure client is not already registered before creating its writer
     if ws not in _ws_clients:
-        _ws_clients.append(ws)
+        client = WSClient(ws, batch=batch, encoding=encoding)
+        _ws_clients[ws] = client
+        subscribe_ws(ws, topics or [WS_TOPIC_ALL])
+        client.enqueue(json.dumps({"type": "ws_config", "data": _ws_config(client)}))
+        client.start()
     # print(f"WS Registered. Total clients: {len(_ws_clients)}") # Optional debug
+    return _ws_config(_ws_clients[ws])
+
+
+def _ws_config(client: WSClient) -> Dict:
+    return {"batch": client.batch, "encoding": client.encoding, "topics": sorted(client.topics)}
+
 
 def unregister_ws(ws: Any):
-    if ws in _ws_clients:
-        _ws_clients.remove(ws)
+    _remove_client(ws)
     # print(f"WS Unregistered. Total clients: {len(_ws_clients)}") # Optional debug
 
-async def broadcast_ws_message(message_type: str, data: Dict):
-    typed_payload = {"type": message_type, "data": data}
-    # print(f"Broadcasting WS: {json.dumps(typed_payload)}") # Optional: for deep debugging
-    
-    # Iterate over a copy of the list for safe removal
-    active_clients_after_send = []
-    for ws_client in list(_ws_clients): # Iterate over a copy
-        if ws_client:
-            try:
-                await ws_client.send_text(json.dumps(typed_payload))
-                active_clients_after_send.append(ws_client) # Keep if send was successful
-            except Exception as e:
-                print(f"Error sending WS message ({message_type}) to client {ws_client}: {e} - Removing client.")
-                # No need to explicitly remove here if we rebuild the list with active_clients_after_send
-        else:
-            print(f"Found a None WebSocket object in _ws_clients during {message_type} broadcast")
-            # This client will be filtered out when rebuilding _ws_clients
 
-    _ws_clients[:] = active_clients_after_send # Update the original list with active clients 
\ No newline at end of file
+def _remove_client(ws: Any):
+    client = _ws_clients.get(ws)
+    if client:
+        unsubscribe_ws(ws, list(client.topics))
+        del _ws_clients[ws]
+        client.stop()
+
+
+def _disconnect_slow_client(client: WSClient):
+    print(f"WS client {client.ws} dropped {client.consecutive_drops} messages in a row - disconnecting slow consumer.")
+    _remove_client(client.ws)
+    try:
+        asyncio.create_task(client.ws.close(code=1013))  # 1013: try again later
+    except Exception as e:
+        print(f"Error closing slow WS client {client.ws}: {e}")
+
+
+def get_ws_stats() -> List[Dict]:
+    return [client.stats() for client in _ws_clients.values()]
+
+
+def _encode(message: Dict, encoding: str) -> Union[str, bytes]:
+    if encoding == WS_ENCODING_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message)
+
+
+def _fan_out(message: Dict, clients: Iterable[WSClient]):
+    """Encodes the message once per encoding in use and queues it for the given clients."""
+    encoded: Dict[str, Union[str, bytes]] = {}
+    for client in clients:
+        if client.encoding not in encoded:
+            encoded[client.encoding] = _encode(message, client.encoding)
+        if not client.enqueue(encoded[client.encoding]) and client.consecutive_drops >= WS_MAX_CONSECUTIVE_DROPS:
+            _disconnect_slow_client(client)
+
+
+async def start_ws_bridge():
+    """Creates the configured pub/sub bridge and starts receiving envelopes. Called at startup."""
+    global _bridge
+    if _bridge is None:
+        bridge = create_bridge()
+        await bridge.start(_deliver_envelope)
+        _bridge = bridge
+
+
+async def stop_ws_bridge():
+    global _bridge
+    bridge, _bridge = _bridge, None
+    if bridge is not None:
+        await bridge.stop()
+
+
+async def _publish(envelope: Dict):
+    if _bridge is None:
+        await start_ws_bridge()
+    await _bridge.publish(envelope)
+
+
+async def _deliver_envelope(envelope: Dict):
+    """Fans an envelope from the bridge out to the sockets connected to this process."""
+    kind = envelope.get("kind")
+    if kind == "message":
+        message = envelope["message"]
+        topics = set(envelope.get("topics") or [])
+        if envelope.get("origin") != PROCESS_ID and message.get("type") in ("state_snapshot", "state_delta"):
+            # Keep this worker's /state snapshot and seq numbering in step with the ticker
+            from .state_cache import state_cache
+            state_cache.follow_remote(message["type"], message["data"], envelope.get("state"))
+        recipients = _subscribers_for(topics)
+        if envelope.get("batched"):
+            _tick_batch_events.append((message, topics))
+            recipients = [client for client in recipients if not client.batch]
+        _fan_out(message, recipients)
+    elif kind == "flush":
+        _flush_local_tick_batch(envelope.get("tick"))
+    elif kind == "invalidate":
+        _invalidate_local_caches(envelope.get("caches") or [])
+    elif kind == "reset":
+        _reset_local_simulation_state(envelope["from_sim_min"])
+
+
+# Process-local caches that must be dropped everywhere when the data behind them changes
+CACHE_CATALOG = "catalog"
+CACHE_STATE = "state"
+CACHE_PROMPTS = "prompts"
+CACHE_COOLDOWNS = "cooldowns"
+
+
+def _invalidate_local_caches(caches: List[str]):
+    if CACHE_CATALOG in caches:
+        from .catalog import catalog
+        catalog.invalidate()
+    if CACHE_STATE in caches:
+        from .state_cache import state_cache
+        state_cache.invalidate()
+    if CACHE_PROMPTS in caches:
+        from .prompts import PROMPT_CACHE
+        PROMPT_CACHE.clear()
+    if CACHE_COOLDOWNS in caches:
+        from .cooldowns import dialogue_cooldowns
+        dialogue_cooldowns.invalidate()
+
+
+async def broadcast_cache_invalidation(caches: List[str]):
+    """Invalidates the named caches in every process sharing the bridge, this one included."""
+    await _publish({"kind": "invalidate", "origin": PROCESS_ID, "caches": list(caches)})
+
+
+def _reset_local_simulation_state(from_sim_min: int):
+    from .sim_calendar import sim_calendar
+    from .reflection_tracker import reflection_tracker
+    from .dialogue_service import dialogue_queue
+    from .replan_coordinator import replan_coordinator
+    from .batch_cognition import batch_cognition
+    sim_calendar.forget(from_sim_min)
+    reflection_tracker.reset()
+    dialogue_queue.reset()
+    replan_coordinator.reset()
+    batch_cognition.reset()
+
+
+async def broadcast_simulation_reset(from_sim_min: int):
+    """Drops the process-local simulation state (calendar claims from from_sim_min on,
+    reflection marks, dialogue and replan queues, night pipelines) in every process
+    sharing the bridge, this one included. Shared tables are cleared by the caller.
+    """
+    await _publish({"kind": "reset", "origin": PROCESS_ID, "from_sim_min": from_sim_min})
+
+
+async def broadcast_ws_message(message_type: str, data: Dict, topics: Optional[Set[str]] = None, state: Optional[Dict] = None):
+    """Publishes the message to every process; each queues it for its subscribed clients.
+
+    topics defaults to topics_for_message(); only clients subscribed to one of them
+    (or to "*") receive the message. state rides along in the envelope for the other
+    processes' /state snapshots and is never sent to clients.
+    """
+    if topics is None:
+        topics = topics_for_message(message_type, data)
+    envelope = {
+        "kind": "message",
+        "origin": PROCESS_ID,
+        "message": {"type": message_type, "data": data},
+        "topics": sorted(topics),
+        "batched": _tick_batch_open,
+    }
+    if state is not None:
+        envelope["state"] = state
+    await _publish(envelope)
+
+
+async def send_ws_message(ws: Any, message_type: str, data: Dict):
+    """Queues a message for a single client, keeping it ordered with broadcasts."""
+    client = _ws_clients.get(ws)
+    if client:
+        _fan_out({"type": message_type, "data": data}, [client])
+
+
+def begin_tick_batch():
+    """Starts collecting broadcasts for batch clients. Called at the start of a tick."""
+    global _tick_batch_open
+    _tick_batch_open = True
+
+
+async def flush_tick_batch(tick: Optional[int]):
+    """Tells every process to send what it collected since begin_tick_batch() as one frame per batch client."""
+    global _tick_batch_open
+    if not _tick_batch_open:
+        return
+    _tick_batch_open = False
+    await _publish({"kind": "flush", "origin": PROCESS_ID, "tick": tick})
+
+
+def _flush_local_tick_batch(tick: Optional[int]):
+    global _tick_batch_events
+    events, _tick_batch_events = _tick_batch_events, []
+    if not events:
+        return
+    # Clients with the same subscriptions get the same frame, so encode once per group
+    clients_by_topics: Dict[frozenset, List[WSClient]] = {}
+    for client in _ws_clients.values():
+        if client.batch:
+            clients_by_topics.setdefault(frozenset(client.topics), []).append(client)
+    for client_topics, clients in clients_by_topics.items():
+        client_events = [
+            message for message, topics in events
+            if WS_TOPIC_ALL in client_topics or not client_topics.isdisjoint(topics)
+        ]
+        if client_events:
+            _fan_out({"type": "batch", "data": {"tick": tick, "events": client_events}}, clients)
+
+# --- State streaming protocol ---
+# On connect a client receives a full "state_snapshot"; every tick after that it gets a
+# "state_delta" with only the NPCs that changed. Both carry a seq number; a client
+# that sees a gap sends {"type": "resync"} and is answered with a fresh snapshot.
+
+async def send_state_snapshot(ws: Any):
+    from .state_cache import state_cache
+    snapshot = await state_cache.get_snapshot()
+    await send_ws_message(ws, "state_snapshot", snapshot.snapshot_message_data())
+
+async def broadcast_state_update(snapshot: Any):
+    delta_data = snapshot.delta_message_data()
+    if delta_data is None:
+        # No previous snapshot to diff against (startup, reset, reseed): everyone resyncs
+        await broadcast_ws_message("state_snapshot", snapshot.snapshot_message_data())
+    else:
+        # Other processes adopt the full state, so their /state needs no DB rebuild
+        await broadcast_ws_message("state_delta", delta_data, state=snapshot.state)
+
+async def handle_ws_client_message(ws: Any, raw_message: str):
+    try:
+        message = json.loads(raw_message)
+    except (json.JSONDecodeError, TypeError):
+        return
+    if not isinstance(message, dict):
+        return
+    message_type = message.get("type")
+    if message_type == "resync":
+        await send_state_snapshot(ws)
+    elif message_type in ("subscribe", "unsubscribe"):
+        topics = message.get("topics") or []
+        if not isinstance(topics, list):
+            return
+        if message_type == "subscribe":
+            current_topics = subscribe_ws(ws, topics)
+        else:
+            current_topics = unsubscribe_ws(ws, topics)
+        await send_ws_message(ws, "subscriptions", {"topics": current_topics})
@@ -155,6 +155,49 @@ Conversation:
 {dialogue_transcript}
 
 Your one-sentence summary:'''
+    },
+    {
+        "name": "DIALOGUE_JOINT_SYSTEM_PROMPT_TEMPLATE",
+        "content": (
+            "You are an AI generating a brief, natural dialogue between two NPCs in a simulation, "
+            "and summarizing it from each participant's point of view. "
+            "{npc_name} has the following traits: {traits}. {other_npc_name} has the following traits: {other_npc_traits}. "
+            "Always answer with a single JSON object and nothing else."
+        )
+    },
+    {
+        "name": "DIALOGUE_JOINT_USER_PROMPT_TEMPLATE",
+        "content": (
+            "{npc_name} is talking with {other_npc_name} in the {area_name}.\n"
+            "CONTEXT ({npc_name}'s relevant memories):\n{memories}\n"
+            "Write a brief, natural dialogue with just 3-4 exchanges between {npc_name} and {other_npc_name}, "
+            "appropriate to both their personalities. Then summarize it once from each participant's perspective "
+            "in a single, concise first-person sentence focusing on the main topic or outcome.\n"
+            "Respond with JSON in exactly this shape:\n"
+            '{{"turns": [{{"speaker": "{npc_name}", "line": "..."}}, {{"speaker": "{other_npc_name}", "line": "..."}}], '
+            '"summary_a": "{npc_name}\'s one-sentence summary", "summary_b": "{other_npc_name}\'s one-sentence summary"}}'
+        )
+    },
+    {
+        "name": "PLAN_BATCH_SYSTEM_PROMPT_TEMPLATE",
+        "content": (
+            "You plan the day for several NPCs in a simulation. Today is {sim_date}. "
+            "Each NPC's schedule must fit their own traits and memories. "
+            "Always answer with a single JSON object and nothing else."
+        )
+    },
+    {
+        "name": "PLAN_BATCH_USER_PROMPT_TEMPLATE",
+        "content": (
+            f"For each NPC below, produce an ordered list of actions (max 8) for today, based on that NPC's personality and memories.\n"
+            f"You MUST choose actions EXCLUSIVELY from the following list: {AVAILABLE_ACTIONS_STR_FOR_DB}.\n"
+            f"Do NOT invent new actions. If you want to do something like 'Eat Breakfast', use the action 'Eat'.\n"
+            f"Format each action as: HH:MM — <ACTION_TITLE_FROM_LIST>\n"
+            f"The day starts at 00:00 and ends at 23:59. Schedule a reasonable number of actions per NPC.\n"
+            f"\n{{npc_sections}}\n\n"
+            f"Respond with JSON in exactly this shape, with one entry per NPC id:\n"
+            f'{{{{"plans": {{{{"<npc id>": ["09:00 — Work", "12:00 — Eat"]}}}}}}}}'
+        )
     }
 ]
 
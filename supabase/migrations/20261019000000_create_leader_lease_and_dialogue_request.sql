@@ -0,0 +1,51 @@
+-- Leader lease: exactly one replica runs the tick loop. The holder renews the row
+-- every few seconds; any replica may take it over once expires_at has passed.
+CREATE TABLE IF NOT EXISTS sim_leader_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    acquired_at TIMESTAMPTZ DEFAULT now() NOT NULL
+);
+
+-- Acquires or renews the lease atomically. Returns TRUE if p_holder holds it afterwards.
+CREATE OR REPLACE FUNCTION try_acquire_leader_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds DOUBLE PRECISION)
+RETURNS BOOLEAN AS $$
+DECLARE
+  v_holder TEXT;
+BEGIN
+  INSERT INTO sim_leader_lease AS l (name, holder, expires_at, acquired_at)
+  VALUES (p_name, p_holder, now() + make_interval(secs => p_ttl_seconds), now())
+  ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        expires_at = EXCLUDED.expires_at,
+        acquired_at = CASE WHEN l.holder = EXCLUDED.holder THEN l.acquired_at ELSE now() END
+    WHERE l.holder = EXCLUDED.holder OR l.expires_at < now()
+  RETURNING holder INTO v_holder;
+  RETURN v_holder IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Gives the lease up immediately (e.g. on shutdown) so failover does not wait for expiry.
+CREATE OR REPLACE FUNCTION release_leader_lease(p_name TEXT, p_holder TEXT)
+RETURNS VOID AS $$
+BEGIN
+  DELETE FROM sim_leader_lease WHERE name = p_name AND holder = p_holder;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Pending dialogue requests, shared so a newly elected leader picks up the queue.
+CREATE TABLE IF NOT EXISTS dialogue_request (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    npc_a_id UUID NOT NULL,
+    npc_b_id UUID NOT NULL,
+    npc_a_name TEXT,
+    npc_b_name TEXT,
+    npc_a_traits JSONB DEFAULT '[]'::jsonb,
+    npc_b_traits JSONB DEFAULT '[]'::jsonb,
+    trigger_event TEXT,
+    tick INTEGER NOT NULL,
+    area_name TEXT,
+    created_at TIMESTAMPTZ DEFAULT now() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS dialogue_request_created_at_idx ON dialogue_request (created_at);
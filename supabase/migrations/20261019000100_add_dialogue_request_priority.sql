@@ -0,0 +1,3 @@
+-- Priority inputs of a queued dialogue request (see backend/dialogue_queue.py)
+ALTER TABLE dialogue_request ADD COLUMN IF NOT EXISTS relationship DOUBLE PRECISION DEFAULT 0 NOT NULL;
+ALTER TABLE dialogue_request ADD COLUMN IF NOT EXISTS importance INTEGER DEFAULT 1 NOT NULL;
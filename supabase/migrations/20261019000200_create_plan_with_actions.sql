@@ -0,0 +1,52 @@
+-- Writes a whole plan in one round trip and one transaction, so a plan is never
+-- half-written. p_actions is a JSON array of action_instance rows
+-- ({npc_id, def_id, object_id, start_min, duration_min, status}); both functions
+-- return the ids of the inserted action instances in input order.
+
+-- Daily plan: inserts the action instances, then the plan row listing them.
+CREATE OR REPLACE FUNCTION create_plan_with_actions(p_npc_id UUID, p_sim_day INTEGER, p_actions JSONB)
+RETURNS UUID[] AS $$
+DECLARE
+  v_action_ids UUID[];
+BEGIN
+  WITH rows AS (
+    SELECT r.*, ord
+    FROM jsonb_array_elements(p_actions) WITH ORDINALITY AS e(value, ord),
+         jsonb_populate_record(NULL::action_instance, e.value) AS r
+  ), inserted AS (
+    INSERT INTO action_instance (npc_id, def_id, object_id, start_min, duration_min, status)
+    SELECT npc_id, def_id, object_id, start_min, duration_min, status FROM rows ORDER BY ord
+    RETURNING id
+  )
+  SELECT coalesce(array_agg(id), '{}') INTO v_action_ids FROM inserted;
+
+  INSERT INTO plan (npc_id, sim_day, actions) VALUES (p_npc_id, p_sim_day, v_action_ids);
+  RETURN v_action_ids;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replan: inserts the new action instances, deletes the replaced ones and points the
+-- plan at the kept plus new actions.
+CREATE OR REPLACE FUNCTION replace_plan_actions(p_plan_id UUID, p_keep_action_ids UUID[], p_delete_action_ids UUID[], p_actions JSONB)
+RETURNS UUID[] AS $$
+DECLARE
+  v_action_ids UUID[];
+BEGIN
+  WITH rows AS (
+    SELECT r.*, ord
+    FROM jsonb_array_elements(p_actions) WITH ORDINALITY AS e(value, ord),
+         jsonb_populate_record(NULL::action_instance, e.value) AS r
+  ), inserted AS (
+    INSERT INTO action_instance (npc_id, def_id, object_id, start_min, duration_min, status)
+    SELECT npc_id, def_id, object_id, start_min, duration_min, status FROM rows ORDER BY ord
+    RETURNING id
+  )
+  SELECT coalesce(array_agg(id), '{}') INTO v_action_ids FROM inserted;
+
+  IF coalesce(array_length(p_delete_action_ids, 1), 0) > 0 THEN
+    DELETE FROM action_instance WHERE id = ANY(p_delete_action_ids);
+  END IF;
+  UPDATE plan SET actions = coalesce(p_keep_action_ids, '{}') || v_action_ids WHERE id = p_plan_id;
+  RETURN v_action_ids;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,46 @@
+-- Replanning writes only the difference to the remaining plan, so replace_plan_actions
+-- (which re-inserted every remaining action) is superseded by apply_plan_diff.
+DROP FUNCTION IF EXISTS replace_plan_actions(UUID, UUID[], UUID[], JSONB);
+
+-- Updates changed action instances in place, inserts new ones, deletes removed ones and
+-- sets the plan to p_plan_action_ids followed by the new ids, in one transaction.
+-- p_update_actions rows carry their id; p_insert_actions rows do not. Returns the ids
+-- of the inserted action instances in input order.
+CREATE OR REPLACE FUNCTION apply_plan_diff(
+  p_plan_id UUID,
+  p_plan_action_ids UUID[],
+  p_delete_action_ids UUID[],
+  p_update_actions JSONB,
+  p_insert_actions JSONB
+)
+RETURNS UUID[] AS $$
+DECLARE
+  v_action_ids UUID[];
+BEGIN
+  UPDATE action_instance a
+  SET def_id = u.def_id,
+      object_id = u.object_id,
+      start_min = u.start_min,
+      duration_min = u.duration_min,
+      status = u.status
+  FROM jsonb_populate_recordset(NULL::action_instance, coalesce(p_update_actions, '[]'::jsonb)) AS u
+  WHERE a.id = u.id;
+
+  WITH rows AS (
+    SELECT r.*, ord
+    FROM jsonb_array_elements(coalesce(p_insert_actions, '[]'::jsonb)) WITH ORDINALITY AS e(value, ord),
+         jsonb_populate_record(NULL::action_instance, e.value) AS r
+  ), inserted AS (
+    INSERT INTO action_instance (npc_id, def_id, object_id, start_min, duration_min, status)
+    SELECT npc_id, def_id, object_id, start_min, duration_min, status FROM rows ORDER BY ord
+    RETURNING id
+  )
+  SELECT coalesce(array_agg(id), '{}') INTO v_action_ids FROM inserted;
+
+  IF coalesce(array_length(p_delete_action_ids, 1), 0) > 0 THEN
+    DELETE FROM action_instance WHERE id = ANY(p_delete_action_ids);
+  END IF;
+  UPDATE plan SET actions = coalesce(p_plan_action_ids, '{}') || v_action_ids WHERE id = p_plan_id;
+  RETURN v_action_ids;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,10 @@
+-- One row per sim-calendar job occurrence that has been claimed, so each job runs
+-- exactly once even across restarts and leader changes. item_key is the NPC id for
+-- per-NPC jobs and '' otherwise.
+CREATE TABLE IF NOT EXISTS sim_job_run (
+    job_name TEXT NOT NULL,
+    occurrence_sim_min INTEGER NOT NULL,
+    item_key TEXT NOT NULL DEFAULT '',
+    claimed_at TIMESTAMPTZ DEFAULT now() NOT NULL,
+    PRIMARY KEY (job_name, occurrence_sim_min, item_key)
+);
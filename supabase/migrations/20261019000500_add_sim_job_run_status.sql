@@ -0,0 +1,5 @@
+-- Outcome of a claimed sim-calendar job occurrence (see backend/sim_calendar.py):
+-- 'running' while its handler runs, then 'done', 'retry' (failed, retried on a later
+-- tick) or 'failed' (gave up). Rows claimed before this migration ran count as done.
+ALTER TABLE sim_job_run ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'done' NOT NULL;
+ALTER TABLE sim_job_run ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 1 NOT NULL;
@@ -0,0 +1,11 @@
+-- Replan requests the leader has debounced but not run yet (see backend/replan_coordinator.py),
+-- shared so a newly elected leader resumes them.
+CREATE TABLE IF NOT EXISTS replan_request (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    npc_id UUID NOT NULL,
+    event_info JSONB DEFAULT '{}'::jsonb NOT NULL,
+    sim_min INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT now() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS replan_request_created_at_idx ON replan_request (created_at);
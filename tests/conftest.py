@@ -0,0 +1,83 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# backend.config requires these at import time; the tests never reach the services behind them
+for _name, _value in {
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_ANON_KEY": "test",
+    "SUPABASE_SERVICE_ROLE_KEY": "test",
+    "OPENAI_API_KEY": "test",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+class FakeQuery:
+    """Records a supabase-py query chain; execute() answers it from the FakeSupa."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.ops = []
+
+    def __getattr__(self, name):
+        def op(*args, **kwargs):
+            self.ops.append((name, args, kwargs))
+            return self
+        return op
+
+    def op(self, name):
+        """Arguments of the first call to `name` in the chain, or None."""
+        for op_name, args, kwargs in self.ops:
+            if op_name == name:
+                return args, kwargs
+        return None
+
+    def execute(self):
+        self.db.queries.append(self)
+        responder = self.db.responders.get(self.table)
+        data = responder(self) if responder else self.db.default_response(self)
+        return SimpleNamespace(data=data)
+
+
+class FakeSupa:
+    """Stand-in for the supabase client: selects return rows[table], writes echo their payload."""
+
+    def __init__(self, rows=None):
+        self.rows = rows or {}
+        self.responders = {}  # table -> fn(query) for tests that need more control
+        self.queries = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def queries_for(self, table, op):
+        return [query for query in self.queries if query.table == table and query.op(op)]
+
+    def default_response(self, query):
+        if query.op("select"):
+            return list(self.rows.get(query.table, []))
+        for write in ("insert", "upsert"):
+            if query.op(write):
+                payload = query.op(write)[0][0]
+                return list(payload) if isinstance(payload, list) else [payload]
+        return []
+
+
+@pytest.fixture
+def fake_supa(monkeypatch):
+    """Points the given backend modules' supa / execute_supabase_query at one FakeSupa."""
+
+    def install(*modules, rows=None):
+        db = FakeSupa(rows)
+
+        async def execute_supabase_query(query_fn):
+            return query_fn()
+
+        for module in modules:
+            monkeypatch.setattr(module, "supa", db)
+            monkeypatch.setattr(module, "execute_supabase_query", execute_supabase_query)
+        return db
+
+    return install
@@ -0,0 +1,21 @@
+import json
+
+from backend.planning_and_reflection import _parse_batch_plans
+
+NPCS = [{"id": "id-alice", "name": "Alice"}, {"id": "id-bob", "name": "Bob"}]
+
+
+def test_schedules_keyed_by_id_or_name():
+    raw = json.dumps({"plans": {"id-alice": "07:00 - Work", " bob ": ["08:00 - Gym", "09:00 - Work"]}})
+    assert _parse_batch_plans(raw, NPCS) == {"id-alice": "07:00 - Work", "id-bob": "08:00 - Gym\n09:00 - Work"}
+
+
+def test_unknown_npcs_and_empty_schedules_are_left_out():
+    raw = json.dumps({"plans": {"Carol": "07:00 - Work", "Alice": "  ", "id-bob": 42}})
+    assert _parse_batch_plans(raw, NPCS) == {}
+
+
+def test_unreadable_responses_give_no_plans():
+    assert _parse_batch_plans("not json", NPCS) == {}
+    assert _parse_batch_plans(json.dumps(["07:00 - Work"]), NPCS) == {}
+    assert _parse_batch_plans(json.dumps({"plans": ["07:00 - Work"]}), NPCS) == {}
@@ -0,0 +1,64 @@
+import asyncio
+
+from backend import catalog as catalog_module
+from backend.catalog import Catalog, DEFAULT_ACTION_DURATION_MIN
+
+ROWS = {
+    "action_def": [
+        {"id": "ad-work", "title": "Work", "base_minutes": 240},
+        {"id": "ad-idle", "title": "Idle", "base_minutes": None},
+        {"id": "ad-work-2", "title": "Work", "base_minutes": 60},
+    ],
+    "area": [{"id": "area-office", "name": "Office"}, {"id": "area-bedroom", "name": "Bedroom"}],
+    "object": [
+        {"id": "obj-pc", "name": "PC", "area_id": "area-office"},
+        {"id": "obj-bed", "name": "Bed", "area_id": "area-bedroom"},
+    ],
+}
+
+
+def test_lookups_are_served_from_the_loaded_tables(fake_supa):
+    fake_supa(catalog_module, rows=ROWS)
+    catalog = asyncio.run(Catalog().ensure_loaded())
+
+    assert catalog.action_def("ad-work")["title"] == "Work"
+    assert catalog.action_def(None) is None
+    # The first row wins when titles repeat
+    assert catalog.action_def_by_title("Work")["id"] == "ad-work"
+    assert catalog.action_duration("ad-work") == 240
+    assert catalog.action_duration("ad-idle") == DEFAULT_ACTION_DURATION_MIN
+    assert catalog.area_by_name("Office")["id"] == "area-office"
+    assert catalog.area_name("missing", default="somewhere") == "somewhere"
+    assert catalog.object_area_name("obj-bed") == "Bedroom"
+    assert catalog.object_for_action_title("Work")["id"] == "obj-pc"
+    assert catalog.area_for_action_title("Sleep")["name"] == "Bedroom"
+    assert catalog.area_for_action_title("Watch TV") is None  # No TV in this world
+
+
+def test_ensure_loaded_queries_once_until_invalidated(fake_supa):
+    db = fake_supa(catalog_module, rows=ROWS)
+    catalog = Catalog()
+
+    async def load_twice():
+        await catalog.ensure_loaded()
+        await catalog.ensure_loaded()
+
+    asyncio.run(load_twice())
+    assert len(db.queries) == 3
+
+    catalog.invalidate()
+    db.rows["area"] = [{"id": "area-garden", "name": "Garden"}]
+    asyncio.run(catalog.ensure_loaded())
+    assert len(db.queries) == 6
+    assert catalog.area("area-garden")["name"] == "Garden"
+    assert catalog.area("area-office") is None
+
+
+def test_failed_load_leaves_the_catalog_unloaded(monkeypatch):
+    async def failing_query(query_fn):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(catalog_module, "execute_supabase_query", failing_query)
+    catalog = Catalog()
+    asyncio.run(catalog.ensure_loaded())
+    assert not catalog.loaded
@@ -0,0 +1,34 @@
+import asyncio
+
+from backend import cooldowns as cooldowns_module
+from backend.cooldowns import DialogueCooldowns, canonical_pair
+
+
+def test_canonical_pair_ignores_order():
+    assert canonical_pair("b", "a") == canonical_pair("a", "b") == ("a", "b")
+
+
+def test_cooldowns_are_answered_from_memory_and_expire(fake_supa):
+    db = fake_supa(cooldowns_module, rows={"npc_dialogue_cooldowns": [
+        {"npc_id_1": "b", "npc_id_2": "a", "cooldown_until_sim_min": 500},
+    ]})
+    cooldowns = DialogueCooldowns()
+    asyncio.run(cooldowns.ensure_loaded())
+    assert cooldowns.is_on_cooldown("a", "b", 499)
+    assert not cooldowns.is_on_cooldown("a", "c", 499)
+    assert not cooldowns.is_on_cooldown("b", "a", 500)
+    assert len(db.queries) == 1
+
+
+def test_set_cooldown_applies_at_once_and_writes_through(fake_supa):
+    db = fake_supa(cooldowns_module)
+    cooldowns = DialogueCooldowns()
+
+    async def set_and_flush():
+        cooldowns.set_cooldown("b", "a", 900)
+        assert cooldowns.is_on_cooldown("a", "b", 100)
+        await cooldowns.flush()
+
+    asyncio.run(set_and_flush())
+    (write,) = db.queries_for("npc_dialogue_cooldowns", "upsert")
+    assert write.op("upsert")[0][0] == {"npc_id_1": "a", "npc_id_2": "b", "cooldown_until_sim_min": 900}
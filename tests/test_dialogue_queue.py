@@ -0,0 +1,98 @@
+from backend.dialogue_queue import DialogueQueue, encounter_importance, relationship_strength
+
+
+def _request(a, b, tick, relationship=0.0, importance=1):
+    return {"npc_a_id": a, "npc_b_id": b, "npc_a_name": a, "npc_b_name": b, "tick": tick,
+            "trigger_event": f"saw {b}", "area_name": "Lounge", "relationship": relationship, "importance": importance}
+
+
+def _queue(max_size=10, max_per_tick=10, max_per_sim_hour=100, max_age_min=480):
+    return DialogueQueue(max_size=max_size, max_per_tick=max_per_tick, max_per_sim_hour=max_per_sim_hour, max_age_min=max_age_min)
+
+
+def _never_on_cooldown(a, b, tick):
+    return False
+
+
+def test_a_pair_is_queued_once_and_refreshed_by_newer_encounters():
+    queue = _queue()
+    assert queue.add(_request("a", "b", 10)) == (True, None)
+    assert queue.add(_request("b", "a", 20, relationship=0.8)) == (False, None)
+    assert len(queue) == 1
+    assert queue.requests()[0]["tick"] == 20 and queue.requests()[0]["relationship"] == 0.8
+    # An older encounter does not roll the request back
+    queue.add(_request("a", "b", 5))
+    assert queue.requests()[0]["tick"] == 20
+    assert queue.metrics["refreshed"] == 2
+
+
+def test_a_full_queue_evicts_the_lowest_priority_request():
+    queue = _queue(max_size=2)
+    queue.add(_request("a", "b", 0, relationship=1.0))
+    weak = _request("c", "d", 0)
+    queue.add(weak)
+    added, evicted = queue.add(_request("e", "f", 0, importance=3))
+    assert added and evicted is weak
+    # A newcomer weaker than everything queued is the one dropped
+    newcomer = _request("g", "h", 0)
+    assert queue.add(newcomer) == (False, newcomer)
+    assert not queue.contains("g", "h")
+
+
+def test_priority_weighs_recency_relationship_and_importance():
+    fresh = _request("a", "b", 100)
+    old = _request("c", "d", 10)
+    assert DialogueQueue.priority(fresh, 100) > DialogueQueue.priority(old, 100)
+    assert DialogueQueue.priority(_request("a", "b", 100, relationship=1.0), 100) > DialogueQueue.priority(fresh, 100)
+    assert DialogueQueue.priority(_request("a", "b", 100, importance=3), 100) > DialogueQueue.priority(fresh, 100)
+
+
+def test_starts_respect_the_per_tick_and_per_sim_hour_budgets():
+    queue = _queue(max_per_tick=2, max_per_sim_hour=3)
+    for i in range(5):
+        queue.add(_request(f"a{i}", f"b{i}", 0, relationship=i / 10))
+    started, dropped = queue.take_for_tick(0, _never_on_cooldown)
+    assert [req["npc_a_id"] for req in started] == ["a4", "a3"] and dropped == []
+    started, _ = queue.take_for_tick(15, _never_on_cooldown)
+    assert len(started) == 1  # The sim-hour budget has one start left
+    assert queue.take_for_tick(30, _never_on_cooldown)[0] == []
+    # Once the first starts are an hour old, the budget frees up again
+    assert len(queue.take_for_tick(60, _never_on_cooldown)[0]) == 2
+
+
+def test_stale_and_cooldown_requests_are_dropped():
+    queue = _queue(max_age_min=60)
+    queue.add(_request("a", "b", 0))
+    queue.add(_request("c", "d", 100))
+    queue.add(_request("e", "f", 100))
+    started, dropped = queue.take_for_tick(100, lambda a, b, tick: a == "c")
+    assert [req["npc_a_id"] for req in started] == ["e"]
+    assert sorted(req["npc_a_id"] for req in dropped) == ["a", "c"]
+    assert len(queue) == 0
+
+
+def test_reset_clears_the_queue_and_the_sim_hour_budget():
+    queue = _queue(max_per_sim_hour=1)
+    queue.add(_request("a", "b", 1400))
+    queue.add(_request("c", "d", 1400))
+    queue.take_for_tick(1400, _never_on_cooldown)
+    assert [req["npc_a_id"] for req in queue.reset()] in (["a"], ["c"])
+    assert len(queue) == 0
+    # After the clock is set back, the old starts no longer block new ones
+    queue.add(_request("e", "f", 1000))
+    assert len(queue.take_for_tick(1000, _never_on_cooldown)[0]) == 1
+
+
+def test_relationship_strength_reads_numbers_and_objects():
+    assert relationship_strength({"b": -0.6}, "b") == 0.6
+    assert relationship_strength({"b": {"affinity": 0.3}}, "b") == 0.3
+    assert relationship_strength({"b": "friend"}, "b") == 0.0
+    assert relationship_strength(None, "b") == 0.0
+
+
+def test_encounter_importance_rates_first_meetings_and_free_npcs_higher():
+    busy_strangers = ({"id": "a", "current_action_id": "x"}, {"id": "b", "current_action_id": "y"})
+    assert encounter_importance(*busy_strangers) == 2
+    busy_friends = ({"id": "a", "current_action_id": "x", "relationships": {"b": 0.5}}, {"id": "b", "current_action_id": "y"})
+    assert encounter_importance(*busy_friends) == 1
+    assert encounter_importance({"id": "a"}, {"id": "b", "current_action_id": "y"}) == 3
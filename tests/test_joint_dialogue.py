@@ -0,0 +1,35 @@
+import json
+
+from backend.dialogue_service import _parse_joint_dialogue
+
+
+def _response(turns, summary_a="Talked about the game.", summary_b="Heard about the game."):
+    return json.dumps({"turns": turns, "summary_a": summary_a, "summary_b": summary_b})
+
+
+def test_turns_and_both_summaries_are_returned():
+    raw = _response([{"speaker": "Alice", "line": "Hi Bob!"}, {"speaker": "Bob", "line": " Hey. "}])
+    turns, summary_a, summary_b = _parse_joint_dialogue(raw, "Alice", "Bob")
+    assert turns == [{"speaker": "Alice", "line": "Hi Bob!"}, {"speaker": "Bob", "line": "Hey."}]
+    assert (summary_a, summary_b) == ("Talked about the game.", "Heard about the game.")
+
+
+def test_speaker_names_are_normalized_and_strangers_dropped():
+    raw = _response([
+        {"speaker": "**alice**", "line": "Hi"},
+        {"speaker": "Narrator", "line": "They met."},
+        {"speaker": "BOB", "line": ""},
+        "not a turn",
+    ])
+    turns, _, _ = _parse_joint_dialogue(raw, "Alice", "Bob")
+    assert turns == [{"speaker": "Alice", "line": "Hi"}]
+
+
+def test_malformed_responses_are_rejected():
+    turn = [{"speaker": "Alice", "line": "Hi"}]
+    assert _parse_joint_dialogue("Alice: Hi", "Alice", "Bob") is None
+    assert _parse_joint_dialogue(None, "Alice", "Bob") is None
+    assert _parse_joint_dialogue(json.dumps({"turns": "Alice: Hi"}), "Alice", "Bob") is None
+    assert _parse_joint_dialogue(_response([]), "Alice", "Bob") is None
+    assert _parse_joint_dialogue(_response(turn, summary_b="  "), "Alice", "Bob") is None
+    assert _parse_joint_dialogue(_response(turn, summary_a=None), "Alice", "Bob") is None
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backend import npc_actions
+from backend.npc_actions import _plan_adherence_observation
+
+INSTANCES = {
+    "work": {"id": "work", "def_id": "def-work", "start_min": 540},
+    "lunch": {"id": "lunch", "def_id": "def-lunch", "start_min": 720},
+    "tv": {"id": "tv", "def_id": "def-tv", "start_min": 1200},
+}
+PLAN = ["work", "lunch", "tv"]
+
+
+@pytest.fixture(autouse=True)
+def titles(monkeypatch):
+    defs = {"def-work": {"title": "Work"}, "def-lunch": {"title": "Eat Lunch"}, "def-tv": {"title": "Watch TV"}}
+    monkeypatch.setattr(npc_actions, "catalog", SimpleNamespace(action_def=defs.get))
+
+
+def _observe(current_min_of_day, current_action_id, plan=PLAN):
+    return _plan_adherence_observation("12:00", current_min_of_day, current_action_id, plan, INSTANCES)
+
+
+def test_no_plan():
+    content, importance = _observe(720, None, plan=[])
+    assert "don't have a plan" in content and importance == 2
+
+
+def test_following_the_plan():
+    content, importance = _observe(720, "lunch")
+    assert "following my plan by doing Eat Lunch" in content and importance == 1
+
+
+def test_doing_something_else_than_scheduled():
+    content, importance = _observe(720, "tv")
+    assert "supposed to be Eat Lunch" in content and "instead I was doing Watch TV" in content
+    assert importance == 3
+
+
+def test_idle_while_something_is_scheduled():
+    content, importance = _observe(730, None)
+    assert "wasn't doing anything" in content and importance == 3
+
+
+def test_nothing_scheduled_in_the_window():
+    assert _observe(0, None)[1] == 1
+    content, importance = _observe(0, "tv")
+    assert "Watch TV which wasn't part of my original plan" in content and importance == 2
+    assert "something unplanned" in _observe(0, "deleted-action")[0]
@@ -0,0 +1,49 @@
+from backend.planning_and_reflection import _diff_plan_actions
+
+
+def _inst(inst_id, start_min, def_id, status="queued", object_id=None, duration_min=30):
+    return {"id": inst_id, "start_min": start_min, "def_id": def_id, "status": status,
+            "object_id": object_id, "duration_min": duration_min}
+
+
+def _row(start_min, def_id, object_id=None, duration_min=30):
+    return {"npc_id": "n", "start_min": start_min, "def_id": def_id, "object_id": object_id,
+            "duration_min": duration_min, "status": "queued"}
+
+
+def test_matching_actions_are_kept_or_updated_in_place():
+    remaining = [_inst(1, 600, "work"), _inst(2, 720, "lunch", duration_min=30)]
+    unchanged, updates, inserts, deletes = _diff_plan_actions(remaining, [_row(600, "work"), _row(720, "lunch", duration_min=60)])
+    assert unchanged == [1]
+    assert [(row["id"], row["duration_min"]) for row in updates] == [(2, 60)]
+    assert inserts == [] and deletes == []
+
+
+def test_a_matched_active_action_keeps_its_status():
+    remaining = [_inst(1, 600, "work", status="active")]
+    _, updates, _, _ = _diff_plan_actions(remaining, [_row(600, "work", object_id="pc")])
+    assert updates[0]["status"] == "active"
+
+
+def test_unmatched_queued_rows_are_reused_at_the_same_start_or_deleted():
+    remaining = [_inst(1, 600, "work"), _inst(2, 900, "gym")]
+    unchanged, updates, inserts, deletes = _diff_plan_actions(remaining, [_row(600, "read"), _row(1000, "tv")])
+    assert unchanged == []
+    assert [(row["id"], row["def_id"], row["status"]) for row in updates] == [(1, "read", "queued")]
+    assert [row["def_id"] for row in inserts] == ["tv"]
+    assert deletes == [2]
+
+
+def test_an_unmatched_active_row_is_left_alone():
+    remaining = [_inst(1, 600, "work", status="active"), _inst(2, 660, "gym")]
+    unchanged, updates, inserts, deletes = _diff_plan_actions(remaining, [_row(600, "read")])
+    # Neither reused for "read" nor deleted while it is the current action
+    assert unchanged == [1]
+    assert updates == [] and deletes == [2]
+    assert [row["def_id"] for row in inserts] == ["read"]
+
+
+def test_empty_remaining_plan_inserts_everything():
+    unchanged, updates, inserts, deletes = _diff_plan_actions([], [_row(600, "work"), _row(720, "lunch")])
+    assert (unchanged, updates, deletes) == ([], [], [])
+    assert len(inserts) == 2
@@ -0,0 +1,77 @@
+import asyncio
+
+from backend import planning_and_reflection
+from backend import reflection_tracker as reflection_tracker_module
+from backend.reflection_tracker import SIM_DAY_MINUTES, ReflectionTracker
+
+NOW = 2 * SIM_DAY_MINUTES + 600  # Day 3, 10:00
+NPCS = [{"id": "a", "name": "Alice"}, {"id": "b", "name": "Bob"}]
+
+
+def _memory_db(fake_supa, reflect_rows, experience_rows):
+    db = fake_supa(reflection_tracker_module)
+    db.responders["memory"] = lambda query: reflect_rows if query.op("eq") else experience_rows
+    return db
+
+
+def _check(tracker, monkeypatch):
+    reflected = []
+
+    async def run_reflection_for_npc(npc, current_day, current_sim_minutes_total):
+        reflected.append((npc["id"], current_day, current_sim_minutes_total))
+        tracker.mark_reflected(npc["id"], current_sim_minutes_total)
+
+    monkeypatch.setattr(planning_and_reflection, "run_reflection_for_npc", run_reflection_for_npc)
+
+    async def check_and_wait():
+        await tracker.check(NPCS, 3, NOW)
+        await tracker.flush()
+
+    asyncio.run(check_and_wait())
+    return reflected
+
+
+def test_only_npcs_over_the_threshold_since_their_mark_reflect(fake_supa, monkeypatch):
+    _memory_db(
+        fake_supa,
+        reflect_rows=[{"npc_id": "b", "sim_min": NOW - 60}],
+        experience_rows=[
+            {"npc_id": "a", "sim_min": NOW - 120, "importance": 6},
+            {"npc_id": "a", "sim_min": NOW - 30, "importance": 5},
+            # Bob's big experience predates his last reflection
+            {"npc_id": "b", "sim_min": NOW - 120, "importance": 10},
+            {"npc_id": "b", "sim_min": NOW - 30, "importance": None},
+        ],
+    )
+    tracker = ReflectionTracker(threshold=10)
+    assert _check(tracker, monkeypatch) == [("a", 3, NOW)]
+    assert tracker.since("a") == NOW and tracker.since("b") == NOW - 60
+    assert tracker.metrics == {"checks": 1, "reflections": 1}
+
+
+def test_marks_are_reloaded_after_a_reset(fake_supa, monkeypatch):
+    db = _memory_db(fake_supa, reflect_rows=[{"npc_id": "a", "sim_min": NOW - 10}], experience_rows=[])
+    tracker = ReflectionTracker(threshold=10)
+    tracker.mark_reflected("a", NOW + 500)
+    tracker.reset()
+    assert tracker.since("a") is None
+    assert _check(tracker, monkeypatch) == []
+    assert tracker.since("a") == NOW - 10
+    assert len(db.queries_for("memory", "eq")) == 1
+
+
+def test_mark_reflected_never_moves_back():
+    tracker = ReflectionTracker(threshold=10)
+    tracker.mark_reflected("a", 100)
+    tracker.mark_reflected("a", 50)
+    assert tracker.since("a") == 100
+
+
+def test_a_failed_query_skips_the_check(monkeypatch):
+    async def failing_query(query_fn):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(reflection_tracker_module, "execute_supabase_query", failing_query)
+    tracker = ReflectionTracker(threshold=10)
+    assert _check(tracker, monkeypatch) == []
+    assert tracker.metrics["checks"] == 0
@@ -0,0 +1,21 @@
+from backend.replan_coordinator import merge_replan_events
+
+
+def test_merged_event_takes_the_newest_source_and_lists_every_description():
+    events = [
+        {"source": "dialogue", "partner_name": "Bob", "original_description": "Talked to Bob"},
+        {"source": "challenge", "challenge_code": "wifi_down", "original_description": "Wifi is down"},
+        {"source": "challenge", "challenge_code": "wifi_down", "original_description": "Wifi is down"},
+    ]
+    merged = merge_replan_events(events)
+    assert merged["source"] == "challenge" and merged["challenge_code"] == "wifi_down"
+    assert merged["original_description"] == "Talked to Bob; Wifi is down"
+    assert merged["merged_events"] == 3
+
+
+def test_gate_rules_survive_only_if_every_event_agrees():
+    rule = {"priority_action": "Work", "affected_action_title": "Work"}
+    assert merge_replan_events([dict(rule), dict(rule)])["priority_action"] == "Work"
+    merged = merge_replan_events([dict(rule), {"description": "User event"}])
+    assert "priority_action" not in merged and "affected_action_title" not in merged
+    assert merged["description"] == "User event"
@@ -0,0 +1,41 @@
+import asyncio
+
+from backend import replan_gate as replan_gate_module
+from backend.replan_gate import GATE_ASK, GATE_REPLAN, GATE_SKIP, ReplanGate
+
+EMBEDDINGS = {
+    "Fire in the kitchen": [1.0, 0.0],
+    "Cook Dinner": [0.9, 0.1],
+    "Read": [0.0, 1.0],
+    "Birds are singing": [0.1, 1.0],
+}
+
+
+def _gate(monkeypatch):
+    async def get_embedding(text):
+        return EMBEDDINGS.get(text)
+
+    monkeypatch.setattr(replan_gate_module, "get_embedding", get_embedding)
+    return ReplanGate(skip_below=0.15, replan_above=0.55, audit_rate=0.0)
+
+
+def test_challenge_rules_decide_without_embeddings(monkeypatch):
+    gate = _gate(monkeypatch)
+    wifi_down = {"affected_action_title": "Work"}
+    assert asyncio.run(gate.decide(wifi_down, "Wifi is down", ["work", "Lunch"])) == GATE_REPLAN
+    assert asyncio.run(gate.decide(wifi_down, "Wifi is down", ["Lunch"])) == GATE_SKIP
+    fire_alarm = {"priority_action": "Evacuate"}
+    assert asyncio.run(gate.decide(fire_alarm, "Fire alarm", ["Evacuate"])) == GATE_SKIP
+    assert asyncio.run(gate.decide(fire_alarm, "Fire alarm", ["Work"])) == GATE_REPLAN
+    assert gate.metrics["skip_rule"] == 2 and gate.metrics["replan_rule"] == 2
+
+
+def test_similarity_decides_clear_cases_and_asks_otherwise(monkeypatch):
+    gate = _gate(monkeypatch)
+    assert asyncio.run(gate.decide({}, "Fire in the kitchen", ["Cook Dinner"])) == GATE_REPLAN
+    assert asyncio.run(gate.decide({}, "Fire in the kitchen", ["Read"])) == GATE_SKIP
+    # Middling similarity, an unknown embedding or nothing upcoming go to the LLM
+    assert asyncio.run(gate.decide({}, "Birds are singing", ["Cook Dinner"])) == GATE_ASK
+    assert asyncio.run(gate.decide({}, "Something new", ["Read"])) == GATE_ASK
+    assert asyncio.run(gate.decide({}, "Fire in the kitchen", [])) == GATE_ASK
+    assert gate.metrics["ask_llm"] == 3
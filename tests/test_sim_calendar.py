@@ -0,0 +1,137 @@
+import asyncio
+
+from postgrest.exceptions import APIError
+
+from backend import sim_calendar as sim_calendar_module
+from backend.sim_calendar import SIM_DAY_MINUTES, SIM_JOB_MAX_ATTEMPTS, SimCalendar, _occurrences
+
+NPCS = [{"id": "npc-1"}, {"id": "npc-2"}]
+
+
+def _npcs(ctx):
+    return ctx["npcs"]
+
+
+def _calendar(runs, fail_times=0):
+    """A calendar with a daily 05:00 job and a per-NPC job spread over 00:00-01:00."""
+    calendar = SimCalendar()
+    failures = {"left": fail_times}
+
+    async def daily(occurrence, ctx):
+        if failures["left"] > 0:
+            failures["left"] -= 1
+            raise RuntimeError("planning failed")
+        runs.append(("daily", occurrence))
+
+    async def spread(occurrence, ctx, npc):
+        runs.append(("spread", occurrence, npc["id"]))
+
+    calendar.every_day("daily", [300], daily)
+    calendar.spread_daily("spread", 0, 60, _npcs, spread)
+    return calendar
+
+
+def _ticks(calendar, start, end, step, ctx=None):
+    async def run():
+        for tick in range(start, end, step):
+            await calendar.run_due(tick, tick + step, ctx or {"npcs": NPCS})
+    asyncio.run(run())
+
+
+def test_occurrences_cover_the_half_open_interval():
+    assert _occurrences(300, 0, 300) == [300]
+    assert _occurrences(300, 300, 600) == []
+    assert _occurrences(0, 0, 2 * SIM_DAY_MINUTES) == [SIM_DAY_MINUTES, 2 * SIM_DAY_MINUTES]
+
+
+def test_jobs_fire_once_whatever_the_tick_size(fake_supa):
+    for step in (1, 15, 90):
+        fake_supa(sim_calendar_module)
+        runs = []
+        _ticks(_calendar(runs), 0, 2 * SIM_DAY_MINUTES, step)
+        assert [run for run in runs if run[0] == "daily"] == [("daily", 300), ("daily", SIM_DAY_MINUTES + 300)]
+        spread_runs = [run for run in runs if run[0] == "spread"]
+        assert len(spread_runs) == 2 * len(NPCS)
+        assert all(run[1] % SIM_DAY_MINUTES < 60 for run in spread_runs)
+
+
+def test_spread_offsets_are_stable_per_item(fake_supa):
+    fake_supa(sim_calendar_module)
+    first, second = [], []
+    _ticks(_calendar(first), 0, 60, 15)
+    _ticks(_calendar(second), 0, 60, 1)
+    assert sorted(first) == sorted(second)
+
+
+def test_occurrences_claimed_elsewhere_are_skipped(fake_supa):
+    db = fake_supa(sim_calendar_module)
+    # Another process already owns every claim, so the upsert returns no rows
+    db.responders["sim_job_run"] = lambda query: []
+    runs = []
+    calendar = _calendar(runs)
+    _ticks(calendar, 285, 300, 15)
+    assert runs == []
+    assert calendar.metrics["skipped_already_claimed"] == 1
+
+
+def test_a_failed_job_is_retried_on_the_next_tick_and_then_recorded_done(fake_supa):
+    db = fake_supa(sim_calendar_module)
+    runs = []
+    calendar = _calendar(runs, fail_times=1)
+    _ticks(calendar, 285, 300, 15)
+    assert runs == [] and calendar.stats()["awaiting_retry"] == 1
+    _ticks(calendar, 300, 315, 15)
+    assert runs == [("daily", 300)]
+    assert calendar.metrics["failed"] == 1 and calendar.metrics["retried"] == 1
+
+    recorded = [row for query in db.queries_for("sim_job_run", "upsert") for row in query.op("upsert")[0][0]
+                if row["job_name"] == "daily" and not query.op("upsert")[1].get("ignore_duplicates")]
+    assert [(row["status"], row["attempts"]) for row in recorded] == [("retry", 1), ("done", 2)]
+
+
+def test_a_job_failing_every_attempt_is_given_up(fake_supa):
+    fake_supa(sim_calendar_module)
+    runs = []
+    calendar = _calendar(runs, fail_times=SIM_JOB_MAX_ATTEMPTS + 5)
+    _ticks(calendar, 285, 285 + 15 * (SIM_JOB_MAX_ATTEMPTS + 2), 15)
+    assert calendar.metrics["failed"] == SIM_JOB_MAX_ATTEMPTS
+    assert calendar.metrics["given_up"] == 1
+    assert calendar.stats()["awaiting_retry"] == 0
+
+
+def test_unfinished_jobs_of_a_previous_process_are_resumed(fake_supa):
+    fake_supa(sim_calendar_module, rows={"sim_job_run": [
+        {"job_name": "daily", "occurrence_sim_min": 300, "item_key": "", "attempts": 1},
+    ]})
+    runs = []
+    calendar = _calendar(runs)
+    # The new leader starts past 05:00 and still runs the interrupted occurrence, once
+    _ticks(calendar, 330, 360, 15)
+    assert runs == [("daily", 300)]
+
+
+def test_reset_forgets_claims_from_the_new_clock_on(fake_supa):
+    db = fake_supa(sim_calendar_module)
+    runs = []
+    calendar = _calendar(runs)
+    _ticks(calendar, 285, 300, 15)
+    asyncio.run(calendar.reset(200))
+    (delete,) = db.queries_for("sim_job_run", "delete")
+    assert delete.op("gte")[0] == ("occurrence_sim_min", 200)
+    _ticks(calendar, 285, 300, 15)
+    assert runs == [("daily", 300), ("daily", 300)]
+
+
+def test_claims_fall_back_to_memory_without_the_table(fake_supa):
+    db = fake_supa(sim_calendar_module)
+
+    def missing_table(query):
+        raise APIError({"message": 'relation "sim_job_run" does not exist', "code": "42P01"})
+
+    db.responders["sim_job_run"] = missing_table
+    runs = []
+    calendar = _calendar(runs)
+    _ticks(calendar, 285, 300, 15)
+    _ticks(calendar, 285, 300, 15)  # A repeated tick must not run the job again
+    assert runs == [("daily", 300)]
+    assert calendar.stats()["persist_claims"] is False
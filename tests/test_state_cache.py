@@ -0,0 +1,54 @@
+import asyncio
+
+from backend import state_cache as state_cache_module
+from backend.state_cache import StateSnapshot, StateSnapshotCache, compute_state_delta, tick_of_state
+
+
+def _state(day, sim_min, npcs):
+    return {"npcs": npcs, "areas": [], "sim_clock": {"sim_min": sim_min}, "environment": {"day": day}}
+
+
+def test_tick_of_state_counts_minutes_since_day_one():
+    assert tick_of_state(_state(1, 0, [])) == 0
+    assert tick_of_state(_state(3, 30, [])) == 2 * 24 * 60 + 30
+    assert tick_of_state({}) == 0
+
+
+def test_etag_follows_the_body_not_the_tick():
+    state = _state(1, 600, [{"id": "a", "x": 1}])
+    same = StateSnapshot(1, 600, state)
+    assert StateSnapshot(7, 600, dict(state)).etag == same.etag
+    # A reset revisits the tick with different content
+    other = StateSnapshot(8, 600, _state(1, 600, [{"id": "a", "x": 2}]))
+    assert other.etag != same.etag
+    assert same.etag.startswith('"') and same.etag.endswith('"')
+
+
+def test_refresh_numbers_snapshots_and_attaches_deltas(monkeypatch):
+    states = iter([_state(1, 0, [{"id": "a", "x": 1}]), _state(1, 15, [{"id": "a", "x": 2}])])
+
+    async def get_state():
+        return next(states)
+
+    monkeypatch.setattr(state_cache_module, "get_state", get_state)
+    cache = StateSnapshotCache()
+
+    async def two_ticks():
+        return await cache.refresh(), await cache.refresh()
+
+    first, second = asyncio.run(two_ticks())
+    assert (first.seq, first.delta) == (1, None)
+    assert second.seq == 2 and second.tick == 15
+    assert second.delta_message_data()["npcs"] == [{"id": "a", "x": 2, "y": None, "spawn": None, "current_action_id": None, "emoji": None}]
+
+
+def test_follow_remote_adopts_the_state_sent_with_a_delta():
+    cache = StateSnapshotCache()
+    state = _state(1, 30, [{"id": "a"}])
+    cache.follow_remote("state_delta", {"seq": 5, "tick": 30, "npcs": [], "removed_npc_ids": []}, state)
+    snapshot = asyncio.run(cache.get_snapshot())
+    assert (snapshot.seq, snapshot.state) == (5, state)
+
+    # Without the state, the next reader rebuilds under the ticker's seq
+    cache.follow_remote("state_delta", {"seq": 6, "tick": 45})
+    assert cache._snapshot is None and cache._seq == 5
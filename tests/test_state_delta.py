@@ -0,0 +1,33 @@
+from backend.state_cache import compute_state_delta
+
+
+def _state(npcs, sim_min=0):
+    return {"npcs": npcs, "sim_clock": {"sim_min": sim_min}, "environment": {"day": 1}}
+
+
+def test_unchanged_npcs_are_left_out():
+    npcs = [{"id": "a", "x": 1, "y": 2, "name": "Alice"}]
+    delta = compute_state_delta(_state(npcs), _state([dict(npcs[0])], sim_min=15))
+    assert delta["npcs"] == [] and delta["removed_npc_ids"] == []
+    assert delta["sim_clock"] == {"sim_min": 15}
+
+
+def test_changed_npcs_carry_only_the_delta_fields():
+    previous = _state([{"id": "a", "x": 1, "y": 2, "emoji": "😀", "name": "Alice"}])
+    current = _state([{"id": "a", "x": 5, "y": 2, "emoji": "😀", "name": "Alice"}])
+    (npc,) = compute_state_delta(previous, current)["npcs"]
+    assert npc["id"] == "a" and npc["x"] == 5 and "name" not in npc
+
+
+def test_non_delta_field_changes_are_ignored():
+    previous = _state([{"id": "a", "x": 1, "name": "Alice"}])
+    current = _state([{"id": "a", "x": 1, "name": "Alicia"}])
+    assert compute_state_delta(previous, current)["npcs"] == []
+
+
+def test_added_npcs_are_sent_in_full_and_removed_ones_by_id():
+    previous = _state([{"id": "a", "x": 1}, {"id": "b", "x": 2}])
+    current = _state([{"id": "a", "x": 1}, {"id": "c", "x": 3, "name": "Carol"}])
+    delta = compute_state_delta(previous, current)
+    assert delta["npcs"] == [{"id": "c", "x": 3, "name": "Carol"}]
+    assert delta["removed_npc_ids"] == ["b"]
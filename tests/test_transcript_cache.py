@@ -0,0 +1,48 @@
+import asyncio
+
+from backend import transcript_cache as transcript_cache_module
+from backend.transcript_cache import TranscriptCache
+
+
+def _turns(text):
+    return [{"speaker": "Alice", "line": text}]
+
+
+def test_least_recently_used_transcripts_are_evicted():
+    cache = TranscriptCache(max_size=2)
+    cache.put("d1", _turns("one"))
+    cache.put("d2", _turns("two"))
+    cache.get("d1")
+    cache.put("d3", _turns("three"))
+    assert cache.get("d2") is None
+    assert cache.get("d1") is not None and cache.get("d3") is not None
+
+
+def test_empty_transcripts_are_not_cached():
+    cache = TranscriptCache()
+    assert cache.put("d1", []) is None
+    assert cache.get("d1") is None
+
+
+def test_etag_is_over_the_serialized_transcript():
+    cache = TranscriptCache()
+    first = cache.put("d1", _turns("hello"))
+    assert TranscriptCache().put("d1", _turns("hello")).etag == first.etag
+    assert cache.put("d2", _turns("hello")).etag != first.etag
+
+
+def test_misses_are_loaded_in_one_query(monkeypatch):
+    calls = []
+
+    async def get_dialogue_transcripts(dialogue_ids):
+        calls.append(list(dialogue_ids))
+        return {"d2": _turns("two")}
+
+    monkeypatch.setattr(transcript_cache_module, "get_dialogue_transcripts", get_dialogue_transcripts)
+    cache = TranscriptCache()
+    cache.put("d1", _turns("one"))
+    transcripts = asyncio.run(cache.get_many(["d1", "d2", "d3", "d2"]))
+    assert calls == [["d2", "d3"]]
+    assert transcripts == {"d1": _turns("one"), "d2": _turns("two"), "d3": []}
+    # Still in progress (no turns yet), so it is asked for again next time
+    assert cache.get("d3") is None and cache.get("d2") is not None